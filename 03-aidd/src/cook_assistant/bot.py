@@ -76,7 +76,7 @@ async def cmd_help(message: Message) -> None:
 async def cmd_reset(message: Message) -> None:
     """Handle /reset command."""
     chat_id = message.chat.id
-    storage.clear(chat_id)
+    await storage.clear(chat_id)
     logger.info(f"History cleared for chat {chat_id}")
     await message.answer(
         "История диалога очищена. "
@@ -122,8 +122,8 @@ async def cmd_recipe(message: Message) -> None:
     await message.answer(response)
 
     # Store interaction in history? Optionally, we can store as user/assistant messages
-    storage.add_message(chat_id, "user", f"/recipe {query}")
-    storage.add_message(chat_id, "assistant", response)
+    await storage.add_message(chat_id, "user", f"/recipe {query}")
+    await storage.add_message(chat_id, "assistant", response)
 
 
 @dp.message()
@@ -164,7 +164,7 @@ async def handle_message(message: Message) -> None:
     await bot.send_chat_action(chat_id=chat_id, action="typing")
 
     # Get dialog history
-    history = storage.get_messages(chat_id)
+    history = await storage.get_messages(chat_id)
 
     # Generate LLM response with history
     response = await llm_client.generate_response(text, history)
@@ -180,15 +180,19 @@ async def handle_message(message: Message) -> None:
     await message.answer(response)
 
     # Store user message and assistant response
-    storage.add_message(chat_id, "user", text)
-    storage.add_message(chat_id, "assistant", response)
+    await storage.add_message(chat_id, "user", text)
+    await storage.add_message(chat_id, "assistant", response)
 
 
 async def main() -> None:
     """Start the bot."""
     config.validate()
     logger.info("Starting bot with LLM...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # Flush pending dialog writes to disk
+        storage.close()
 
 
 if __name__ == "__main__":
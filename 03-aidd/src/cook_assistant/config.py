@@ -18,6 +18,9 @@ class Config:
     # See https://openrouter.ai/models for available models
     LLM_MODEL: str = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
     MAX_HISTORY_LENGTH: int = int(os.getenv("MAX_HISTORY_LENGTH", "10"))
+    # Dialog storage backend: sqlite (survives restarts) or memory
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "sqlite")
+    STORAGE_DB_PATH: str = os.getenv("STORAGE_DB_PATH", "data/dialogs.sqlite3")
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     LOG_FILE: str = os.getenv("LOG_FILE", "")
     LOG_FORMAT: str = os.getenv(
@@ -32,6 +35,11 @@ class Config:
             raise ValueError("TELEGRAM_BOT_TOKEN is not set")
         if not cls.OPENROUTER_API_KEY:
             raise ValueError("OPENROUTER_API_KEY is not set")
+        if cls.STORAGE_BACKEND not in ("sqlite", "memory"):
+            raise ValueError(
+                f"STORAGE_BACKEND must be 'sqlite' or 'memory', "
+                f"got {cls.STORAGE_BACKEND!r}"
+            )
 
 
 config = Config()
\ No newline at end of file
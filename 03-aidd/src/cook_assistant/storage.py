@@ -1,9 +1,32 @@
-"""In-memory storage for dialog context."""
-from typing import Dict, List
+"""Storage for dialog context: in-memory or SQLite-backed."""
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
 from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
 
 from .config import config
 
+logger = logging.getLogger(__name__)
+
+# Maximum number of queued operations executed in one transaction
+MAX_BATCH_OPS = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (chat_id, id);
+"""
+
 
 class DialogStorage:
     """Simple in-memory storage for dialog messages."""
@@ -11,11 +34,11 @@ class DialogStorage:
     def __init__(self) -> None:
         self._storage: Dict[int, List[Dict]] = {}
 
-    def get_messages(self, chat_id: int) -> List[Dict]:
+    async def get_messages(self, chat_id: int) -> List[Dict]:
         """Get message history for a chat."""
         return self._storage.get(chat_id, [])
 
-    def add_message(
+    async def add_message(
         self, chat_id: int, role: str, content: str
     ) -> None:
         """Add a message to history."""
@@ -34,9 +57,155 @@ class DialogStorage:
                 -config.MAX_HISTORY_LENGTH:
             ]
 
-    def clear(self, chat_id: int) -> None:
+    async def clear(self, chat_id: int) -> None:
         """Clear history for a chat."""
         self._storage.pop(chat_id, None)
 
+    def close(self) -> None:
+        """Nothing to flush for in-memory storage."""
+
+
+def _add_message(
+    conn: sqlite3.Connection, chat_id: int, role: str, content: str
+) -> None:
+    conn.execute(
+        "INSERT INTO messages (chat_id, role, content, timestamp) "
+        "VALUES (?, ?, ?, ?)",
+        (chat_id, role, content, datetime.utcnow().isoformat()),
+    )
+    # Keep only the last MAX_HISTORY_LENGTH messages per chat
+    conn.execute(
+        "DELETE FROM messages WHERE chat_id = ? AND id NOT IN "
+        "(SELECT id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?)",
+        (chat_id, chat_id, config.MAX_HISTORY_LENGTH),
+    )
+
+
+def _get_messages(conn: sqlite3.Connection, chat_id: int) -> List[Dict]:
+    rows = conn.execute(
+        "SELECT role, content, timestamp FROM messages "
+        "WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+        (chat_id, config.MAX_HISTORY_LENGTH),
+    ).fetchall()
+    return [
+        {
+            "role": role,
+            "content": content,
+            "timestamp": datetime.fromisoformat(timestamp),
+        }
+        for role, content, timestamp in reversed(rows)
+    ]
+
+
+def _clear(conn: sqlite3.Connection, chat_id: int) -> None:
+    conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+
+
+class SQLiteDialogStorage:
+    """SQLite storage for dialog messages that survives bot restarts.
+
+    All operations run in a single worker thread with its own connection
+    (WAL mode), so the event loop is never blocked. Writes are queued and
+    not awaited: operations that pile up in the queue are executed in one
+    transaction. Reads go through the same queue, so they always see
+    previously added messages.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._queue: queue.Queue = queue.Queue()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Open the connection right away so a bad path fails at startup
+        self._conn = self._connect()
+        self._thread = threading.Thread(
+            target=self._run, name="dialog-storage", daemon=True
+        )
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is safe in WAL mode and avoids fsync on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _run(self) -> None:
+        conn = self._conn
+        stop = False
+        while not stop:
+            ops = [self._queue.get()]
+            while len(ops) < MAX_BATCH_OPS:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in ops
+            # Skip operations whose awaiting task was cancelled before they started
+            ops = [
+                op
+                for op in ops
+                if op is not None and op[2].set_running_or_notify_cancel()
+            ]
+            if not ops:
+                continue
+
+            results = []
+            try:
+                with conn:
+                    for func, args, future in ops:
+                        try:
+                            results.append((future, func(conn, *args), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+            except Exception as e:
+                # The transaction was not committed: none of the batch took effect
+                results = [(future, None, e) for _, _, future in ops]
+            finally:
+                # Never leave the loop with unresolved operations taken from the queue
+                resolved = {id(future) for future, _, _ in results}
+                results += [
+                    (future, None, RuntimeError("Dialog storage operation failed"))
+                    for _, _, future in ops if id(future) not in resolved
+                ]
+                for future, result, error in results:
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        logger.error(f"Dialog storage operation failed: {error!r}")
+                        future.set_exception(error)
+        conn.close()
+
+    def _submit(self, func, *args) -> Future:
+        future: Future = Future()
+        self._queue.put((func, args, future))
+        return future
+
+    async def get_messages(self, chat_id: int) -> List[Dict]:
+        """Get the last MAX_HISTORY_LENGTH messages for a chat."""
+        return await asyncio.wrap_future(self._submit(_get_messages, chat_id))
+
+    async def add_message(
+        self, chat_id: int, role: str, content: str
+    ) -> None:
+        """Add a message to history without waiting for the disk write."""
+        self._submit(_add_message, chat_id, role, content)
+
+    async def clear(self, chat_id: int) -> None:
+        """Clear history for a chat."""
+        self._submit(_clear, chat_id)
+
+    def close(self) -> None:
+        """Write pending operations and stop the worker thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+
+def create_storage():
+    """Create dialog storage for the configured STORAGE_BACKEND."""
+    if config.STORAGE_BACKEND == "sqlite":
+        return SQLiteDialogStorage(config.STORAGE_DB_PATH)
+    return DialogStorage()
+
 
-storage = DialogStorage()
\ No newline at end of file
+storage = create_storage()
@@ -3,6 +3,7 @@ import logging
 from aiogram import Bot, Dispatcher
 from handlers import router
 from config import config
+from storage import storage
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,7 +17,11 @@ async def main():
     dp.include_router(router)
     
     logger.info("Starting bot...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # Дописываем накопившиеся сообщения диалогов на диск
+        storage.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -38,6 +38,11 @@ class Config:
         os.getenv("SYSTEM_PROMPT_IMAGE_PATH", "prompts/system_prompt_image.txt"),
         "SYSTEM_PROMPT_IMAGE"
     )
+    # История диалогов: sqlite (переживает рестарт) или memory
+    HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "sqlite")
+    HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "data/conversations.sqlite3")  # Относительно корня проекта
+    HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "10"))  # Сколько последних сообщений передавать LLM
+    HISTORY_KEEP_LAST = int(os.getenv("HISTORY_KEEP_LAST", "100"))  # Сколько сообщений чата хранить
 
 config = Config()
 
@@ -8,6 +8,7 @@ from openai import APIError, InternalServerError, NotFoundError
 from llm import get_transaction_response_text, get_transaction_response_image
 from models import Transaction
 from config import config
+from storage import storage
 
 logger = logging.getLogger(__name__)
 
@@ -46,8 +47,7 @@ def format_time_string(time_str: str | None) -> str:
 
 router = Router()
 
-# Глобальные словари для хранения данных
-chat_conversations: dict[int, list[dict]] = {}
+# Глобальный словарь для хранения транзакций (истории диалогов - в storage)
 transactions: dict[int, list[Transaction]] = {}
 
 # Максимальная длина сообщения пользователя
@@ -59,9 +59,7 @@ async def cmd_start(message: Message):
     logger.info(f"User {chat_id} started the bot")
     
     # Очищаем историю и транзакции для данного чата
-    chat_conversations[chat_id] = [
-        {"role": "system", "content": config.SYSTEM_PROMPT_TEXT}
-    ]
+    await storage.clear(chat_id)
     transactions[chat_id] = []
     
     await message.answer(
@@ -199,12 +197,6 @@ async def handle_image(message: Message):
     
     logger.info(f"Image received from {chat_id}")
     
-    # Инициализируем историю если её нет
-    if chat_id not in chat_conversations:
-        chat_conversations[chat_id] = [
-            {"role": "system", "content": config.SYSTEM_PROMPT_IMAGE}
-        ]
-    
     try:
         # Определяем источник изображения
         if message.photo:
@@ -224,8 +216,8 @@ async def handle_image(message: Message):
         # Конвертируем в base64
         image_base64 = base64.b64encode(image_bytes).decode('utf-8')
         
-        # Получаем историю сообщений без системного промпта для контекста
-        message_history = chat_conversations[chat_id][1:] if chat_conversations[chat_id] else []
+        # Получаем последние сообщения истории для контекста
+        message_history = await storage.get_messages(chat_id, config.HISTORY_LIMIT)
         
         # Получаем ответ LLM с structured output
         response = await get_transaction_response_image(image_base64, message_history)
@@ -264,14 +256,10 @@ async def handle_image(message: Message):
         answer_text += f"\n💵 Баланс: {balance_str} руб."
         
         # Добавляем изображение в историю как текстовое описание (для контекста)
-        chat_conversations[chat_id].append(
-            {"role": "user", "content": "[Изображение: чек/скриншот]"}
-        )
+        await storage.add_message(chat_id, "user", "[Изображение: чек/скриншот]")
         
         # Добавляем ответ LLM в историю
-        chat_conversations[chat_id].append(
-            {"role": "assistant", "content": response.answer}
-        )
+        await storage.add_message(chat_id, "assistant", response.answer)
         
         await message.answer(answer_text)
     except (APIError, InternalServerError, NotFoundError) as e:
@@ -317,14 +305,8 @@ async def handle_message(message: Message):
     
     logger.info(f"Message from {chat_id}: {last_message[:100]}...")
     
-    # Инициализируем историю если её нет
-    if chat_id not in chat_conversations:
-        chat_conversations[chat_id] = [
-            {"role": "system", "content": config.SYSTEM_PROMPT_TEXT}
-        ]
-    
-    # Получаем историю сообщений без системного промпта для контекста
-    message_history = chat_conversations[chat_id][1:] if chat_conversations[chat_id] else []
+    # Получаем последние сообщения истории для контекста
+    message_history = await storage.get_messages(chat_id, config.HISTORY_LIMIT)
     
     try:
         # Получаем ответ LLM с structured output (извлечение транзакций только из последнего сообщения)
@@ -364,14 +346,10 @@ async def handle_message(message: Message):
         answer_text += f"\n💵 Баланс: {balance_str} руб."
         
         # Добавляем сообщение пользователя в историю
-        chat_conversations[chat_id].append(
-            {"role": "user", "content": last_message}
-        )
+        await storage.add_message(chat_id, "user", last_message)
         
         # Добавляем ответ LLM в историю
-        chat_conversations[chat_id].append(
-            {"role": "assistant", "content": response.answer}
-        )
+        await storage.add_message(chat_id, "assistant", response.answer)
         
         await message.answer(answer_text)
     except (APIError, InternalServerError) as e:
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from config import config, PROJECT_ROOT
+
+logger = logging.getLogger(__name__)
+
+# Максимум операций в одной транзакции
+MAX_BATCH_OPS = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (chat_id, id);
+"""
+
+class MemoryConversationStorage:
+    """Истории диалогов в памяти процесса (теряются при рестарте)"""
+
+    def __init__(self, keep_last: int):
+        self.keep_last = keep_last
+        self._storage: dict[int, list[dict]] = {}
+
+    async def get_messages(self, chat_id: int, limit: int) -> list[dict]:
+        return self._storage.get(chat_id, [])[-limit:]
+
+    async def add_message(self, chat_id: int, role: str, content: str):
+        messages = self._storage.setdefault(chat_id, [])
+        messages.append({"role": role, "content": content})
+        del messages[:-self.keep_last]
+
+    async def clear(self, chat_id: int):
+        self._storage.pop(chat_id, None)
+
+    def close(self):
+        pass
+
+def _add_message(conn, chat_id: int, role: str, content: str, keep_last: int):
+    conn.execute(
+        "INSERT INTO messages (chat_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+        (chat_id, role, content, time.time()),
+    )
+    # Старые сообщения не нужны для контекста - база не растет бесконечно
+    conn.execute(
+        "DELETE FROM messages WHERE chat_id = ? AND id NOT IN "
+        "(SELECT id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?)",
+        (chat_id, chat_id, keep_last),
+    )
+
+def _get_messages(conn, chat_id: int, limit: int) -> list[dict]:
+    rows = conn.execute(
+        "SELECT role, content FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+        (chat_id, limit),
+    ).fetchall()
+    return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+def _clear(conn, chat_id: int):
+    conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+
+class SQLiteConversationStorage:
+    """
+    Истории диалогов в SQLite (WAL), переживают рестарт бота
+
+    Все операции выполняются в одном потоке со своим соединением, event loop не
+    блокируется. add_message не ждет записи на диск: операции накапливаются в очереди
+    и выполняются одной транзакцией. Чтения идут через ту же очередь и видят все
+    предыдущие записи. Для каждого чата хранятся последние keep_last сообщений.
+    """
+
+    def __init__(self, path: str, keep_last: int):
+        self.path = path
+        self.keep_last = keep_last
+        self._queue = queue.Queue()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Соединение открывается сразу: неверный путь или права - ошибка при старте бота
+        self._conn = self._connect()
+        self._thread = threading.Thread(target=self._run, name="conversation-storage", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL режиме NORMAL не теряет целостность, но не делает fsync на каждый commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _run(self):
+        conn = self._conn
+        stop = False
+        while not stop:
+            ops = [self._queue.get()]
+            while len(ops) < MAX_BATCH_OPS:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in ops
+            # Операции, отмененные до начала выполнения (ожидавшая задача отменена), пропускаются
+            ops = [op for op in ops if op is not None and op[2].set_running_or_notify_cancel()]
+            if not ops:
+                continue
+
+            results = []
+            try:
+                with conn:
+                    for func, args, future in ops:
+                        try:
+                            results.append((future, func(conn, *args), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+            except Exception as e:
+                # Транзакция не зафиксирована - ни одна операция батча не выполнена
+                results = [(future, None, e) for _, _, future in ops]
+            finally:
+                # Поток не завершается, пока не разрешены все взятые из очереди операции
+                resolved = {id(future) for future, _, _ in results}
+                results += [
+                    (future, None, RuntimeError("Ошибка операции с историей диалогов"))
+                    for _, _, future in ops if id(future) not in resolved
+                ]
+                for future, result, error in results:
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        logger.error(f"Ошибка операции с историей диалогов: {error!r}")
+                        future.set_exception(error)
+        conn.close()
+
+    def _submit(self, func, *args) -> Future:
+        future = Future()
+        self._queue.put((func, args, future))
+        return future
+
+    async def get_messages(self, chat_id: int, limit: int) -> list[dict]:
+        """Последние limit сообщений чата от старых к новым"""
+        return await asyncio.wrap_future(self._submit(_get_messages, chat_id, limit))
+
+    async def add_message(self, chat_id: int, role: str, content: str):
+        """Добавление сообщения (без ожидания записи на диск)"""
+        self._submit(_add_message, chat_id, role, content, self.keep_last)
+
+    async def clear(self, chat_id: int):
+        self._submit(_clear, chat_id)
+
+    def close(self):
+        """Запись оставшихся операций и остановка потока"""
+        self._queue.put(None)
+        self._thread.join()
+
+def create_storage():
+    """Хранилище историй по HISTORY_BACKEND"""
+    if config.HISTORY_BACKEND == "memory":
+        return MemoryConversationStorage(config.HISTORY_KEEP_LAST)
+    path = Path(config.HISTORY_DB_PATH)
+    if not path.is_absolute():
+        path = PROJECT_ROOT / path
+    return SQLiteConversationStorage(str(path), config.HISTORY_KEEP_LAST)
+
+storage = create_storage()
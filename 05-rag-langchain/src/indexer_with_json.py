@@ -5,6 +5,7 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores import InMemoryVectorStore
 from config import config
+from embedding_cache import with_cache
 from langchain_community.document_loaders import JSONLoader
 
 logger = logging.getLogger(__name__)
@@ -51,8 +52,10 @@ def split_documents(pages: list) -> list:
 
 def create_vector_store(chunks: list):
     """Создание векторного хранилища"""
-    embeddings = OllamaEmbeddings(
-        model=config.EMBEDDING_MODEL
+    embeddings = with_cache(
+        OllamaEmbeddings(model=config.EMBEDDING_MODEL),
+        "ollama",
+        config.EMBEDDING_MODEL
     )
     vector_store = InMemoryVectorStore.from_documents(
         documents=chunks,
@@ -18,6 +18,12 @@ class Config:
     RETRIEVER_K = int(os.getenv("RETRIEVER_K", "3"))
     SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT")
     
+    # Дисковый кеш embeddings
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite")
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+    EMBEDDING_CACHE_MAX_SIZE_MB = int(os.getenv("EMBEDDING_CACHE_MAX_SIZE_MB", "2048"))
+    
     # Отображение источников
     SHOW_SOURCES = os.getenv("SHOW_SOURCES", "false").lower() == "true"
     
@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from pathlib import Path
+from langchain_core.embeddings import Embeddings
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Обновления last_access копятся в памяти и записываются пачкой (не на каждое попадание)
+ACCESS_FLUSH_ENTRIES = 256
+ACCESS_FLUSH_INTERVAL_S = 60.0
+# Раз в столько записанных векторов счетчики сверяются с таблицей (кеш пишут и другие процессы)
+TOTALS_SYNC_ENTRIES = 5000
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для ключа кеша: NFC, схлопывание пробелов, trim"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обертка над любым LangChain Embeddings с дисковым кешем (SQLite)
+
+    Ключ: (провайдер, модель, тип - документ/запрос, sha256 нормализованного текста).
+    Вытеснение по LRU при превышении лимита записей или размера: число записей и
+    размер ведутся в памяти, таблица не пересчитывается на каждой записи.
+    Одинаковые строки внутри одного батча эмбеддятся один раз.
+    """
+
+    def __init__(self, embeddings: Embeddings, provider: str, model: str,
+                 cache_path: str, max_entries: int, max_size_mb: int):
+        self.embeddings = embeddings
+        self.provider = provider
+        self.model = model
+        self.max_entries = max_entries
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        path = Path(cache_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._pending_access = {}
+        self._access_flushed_at = time.monotonic()
+        self._written_since_sync = 0
+        self._sync_totals()
+        logger.info(f"Embedding cache enabled: {path} ({provider}/{model})")
+
+    def _key(self, text: str, kind: str) -> str:
+        raw = f"{self.provider}\x00{self.model}\x00{kind}\x00{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _sync_totals(self):
+        """Число записей и суммарный размер по таблице (при старте и периодически)"""
+        self._count, self._size = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings"
+        ).fetchone()
+        self._written_since_sync = 0
+
+    def _get_many(self, keys: list) -> dict:
+        """Чтение векторов из кеша; время доступа обновляется отложенно"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite ограничивает число параметров запроса - читаем пачками
+            for start in range(0, len(unique_keys), 500):
+                part = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._pending_access.update((key, now) for key in found)
+                if (len(self._pending_access) >= ACCESS_FLUSH_ENTRIES
+                        or time.monotonic() - self._access_flushed_at >= ACCESS_FLUSH_INTERVAL_S):
+                    self._flush_access()
+                    self._conn.commit()
+        return found
+
+    def _flush_access(self):
+        """Запись накопленных last_access (вызывается под self._lock, commit - у вызывающего)"""
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key, now in self._pending_access.items()],
+            )
+            self._pending_access.clear()
+        self._access_flushed_at = time.monotonic()
+
+    def _put_many(self, items: dict):
+        """Запись векторов в кеш и вытеснение старых записей при превышении лимитов"""
+        now = time.time()
+        with self._lock:
+            for key, vector in items.items():
+                blob = array("f", vector).tobytes()
+                # Вектор для ключа не меняется: существующая запись (из другого процесса) не перезаписывается
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, blob, len(blob), now),
+                )
+                if cursor.rowcount:
+                    self._count += 1
+                    self._size += len(blob)
+            self._written_since_sync += len(items)
+            if self._written_since_sync >= TOTALS_SYNC_ENTRIES:
+                self._sync_totals()
+            if self._count > self.max_entries or self._size > self.max_size_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """LRU-вытеснение по количеству записей и суммарному размеру"""
+        # Перед вытеснением: актуальные last_access и точные счетчики
+        self._flush_access()
+        self._sync_totals()
+        count, total_size = self._count, self._size
+        if count <= self.max_entries and total_size <= self.max_size_bytes:
+            return
+
+        avg_size = total_size / count if count else 1
+        excess_by_count = count - self.max_entries
+        excess_by_size = int((total_size - self.max_size_bytes) / avg_size) + 1
+        # Удаляем с запасом 10%, чтобы не вытеснять на каждой записи
+        to_delete = max(excess_by_count, excess_by_size, 0) + count // 10
+        victims = self._conn.execute(
+            "SELECT key, size FROM embeddings ORDER BY last_access ASC LIMIT ?", (to_delete,)
+        ).fetchall()
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key, _ in victims])
+        self._count -= len(victims)
+        self._size -= sum(size for _, size in victims)
+        logger.info(f"Embedding cache eviction: removed {len(victims)} entries")
+
+    def _split_cached(self, texts: list, kind: str):
+        """Ключи текстов, найденные в кеше векторы и уникальные промахи"""
+        keys = [self._key(text, kind) for text in texts]
+        found = self._get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        # Счетчики под блокировкой: async методы вызывают _split_cached из потоков
+        with self._lock:
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += len(missing)
+        return keys, found, missing
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, missing = self._split_cached(texts, "doc")
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._put_many(computed)
+            found.update(computed)
+        return [list(found[key]) for key in keys]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        # Дисковый I/O кеша - в потоке, чтобы не блокировать event loop
+        keys, found, missing = await asyncio.to_thread(self._split_cached, texts, "doc")
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            await asyncio.to_thread(self._put_many, computed)
+            found.update(computed)
+        return [list(found[key]) for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        keys, found, missing = self._split_cached([text], "query")
+        if missing:
+            vector = self.embeddings.embed_query(text)
+            self._put_many({keys[0]: vector})
+            return list(vector)
+        return list(found[keys[0]])
+
+    async def aembed_query(self, text: str) -> list[float]:
+        keys, found, missing = await asyncio.to_thread(self._split_cached, [text], "query")
+        if missing:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self._put_many, {keys[0]: vector})
+            return list(vector)
+        return list(found[keys[0]])
+
+    def get_stats(self) -> dict:
+        """Статистика кеша: попадания, промахи, число записей и размер"""
+        with self._lock:
+            count, total_size = self._count, self._size
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": count,
+            "size_mb": round(total_size / (1024 * 1024), 2),
+        }
+
+def with_cache(embeddings: Embeddings, provider: str, model: str) -> Embeddings:
+    """Оборачивает embeddings в дисковый кеш, если он включен в конфиге"""
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    return CachedEmbeddings(
+        embeddings,
+        provider=provider,
+        model=model,
+        cache_path=config.EMBEDDING_CACHE_PATH,
+        max_entries=config.EMBEDDING_CACHE_MAX_ENTRIES,
+        max_size_mb=config.EMBEDDING_CACHE_MAX_SIZE_MB,
+    )
@@ -17,6 +17,7 @@ from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
 from ragas.run_config import RunConfig
 from config import config
+from embedding_cache import with_cache
 import rag
 
 logger = logging.getLogger(__name__)
@@ -40,7 +41,11 @@ def init_ragas_metrics():
     
     # Настройка LLM и embeddings для RAGAS (фиксированные модели для единообразной оценки)
     langchain_llm = ChatOpenAI(model=config.RAGAS_LLM_MODEL, temperature=0)
-    langchain_embeddings = OpenAIEmbeddings(model=config.RAGAS_EMBEDDING_MODEL)
+    langchain_embeddings = with_cache(
+        OpenAIEmbeddings(model=config.RAGAS_EMBEDDING_MODEL),
+        "openai",
+        config.RAGAS_EMBEDDING_MODEL
+    )
     
     # Создаем метрики
     metrics = [
@@ -5,6 +5,7 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import InMemoryVectorStore
 from config import config
+from embedding_cache import with_cache
 
 logger = logging.getLogger(__name__)
 
@@ -59,8 +60,10 @@ def load_json_documents(json_file_path: str) -> list:
 
 def create_vector_store(chunks: list):
     """Создание векторного хранилища"""
-    embeddings = OpenAIEmbeddings(
-        model=config.EMBEDDING_MODEL
+    embeddings = with_cache(
+        OpenAIEmbeddings(model=config.EMBEDDING_MODEL),
+        "openai",
+        config.EMBEDDING_MODEL
     )
     vector_store = InMemoryVectorStore.from_documents(
         documents=chunks,
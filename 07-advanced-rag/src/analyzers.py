@@ -0,0 +1,150 @@
+import re
+from functools import lru_cache
+
+# Анализаторы текста для BM25: одинаково применяются при индексации и к запросу
+
+_WORD_RE = re.compile(r"\w+")
+_CYRILLIC_RE = re.compile(r"^[а-я]+$")
+
+RUSSIAN_STOPWORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до его ее ей ему
+если есть еще же за здесь и из или им их к как ко когда кто ли либо между меня мне может мы на над надо наш не
+него нее нет ни них но ну о об однако он она они оно от очень по под при с со так также такой там те тем то того
+тоже той только том ты у уже хотя чего чей чем что чтобы чье чья эта эти это этого этой этом этот я
+""".split())
+
+ENGLISH_STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+def fold_yo(text: str) -> str:
+    """Замена ё на е (в запросах и документах пишут по-разному)"""
+    return text.replace("ё", "е")
+
+class SimpleAnalyzer:
+    """Слова в нижнем регистре без нормализации словоформ"""
+
+    name = "simple"
+
+    def analyze(self, text: str) -> list:
+        return _WORD_RE.findall(text.lower())
+
+class RussianAnalyzer:
+    """
+    Анализатор для русского текста
+
+    Нижний регистр, ё -> е, удаление стоп-слов и стемминг кириллических слов
+    (Snowball Russian). Результаты стемминга кешируются: словарь корпуса
+    ограничен, поэтому каждое слово стеммится один раз.
+    """
+
+    name = "russian"
+
+    def analyze(self, text: str) -> list:
+        tokens = _WORD_RE.findall(fold_yo(text.lower()))
+        return [stem_russian(token) for token in tokens if token not in RUSSIAN_STOPWORDS and token not in ENGLISH_STOPWORDS]
+
+ANALYZERS = {
+    SimpleAnalyzer.name: SimpleAnalyzer,
+    RussianAnalyzer.name: RussianAnalyzer,
+}
+
+def get_analyzer(name: str):
+    """Анализатор по имени (см. ANALYZERS)"""
+    if name not in ANALYZERS:
+        raise ValueError(f"Unknown analyzer: {name}. Must be one of: {', '.join(ANALYZERS)}")
+    return ANALYZERS[name]()
+
+# --- Snowball Russian stemmer ---
+# https://snowballstem.org/algorithms/russian/stemmer.html
+# Окончания первой группы должны идти после "а" или "я"
+
+_VOWELS = frozenset("аеиоуыэюя")
+
+def _endings(group1: str, group2: str) -> list:
+    """(окончание, нужна ли предшествующая а/я), сначала самые длинные"""
+    endings = [(e, True) for e in group1.split()] + [(e, False) for e in group2.split()]
+    return sorted(endings, key=lambda item: len(item[0]), reverse=True)
+
+_PERFECTIVE_GERUND = _endings("в вши вшись", "ив ивши ившись ыв ывши ывшись")
+_ADJECTIVE = _endings(
+    "",
+    "ее ие ые ое ими ыми ей ий ый ой ем им ым ом его ого ему ому их ых ую юю ая яя ою ею",
+)
+_PARTICIPLE = _endings("ем нн вш ющ щ", "ивш ывш ующ")
+_REFLEXIVE = _endings("", "ся сь")
+_VERB = _endings(
+    "ла на ете йте ли й л ем н ло но ет ют ны ть ешь нно",
+    "ила ыла ена ейте уйте ите или ыли ей уй ил ыл им ым ен ило ыло ено ят ует уют ит ыт ены ить ыть ишь ую ю",
+)
+_NOUN = _endings(
+    "",
+    "а ев ов ие ье е иями ями ами еи ии и ией ей ой ий й иям ям ием ем ам ом о у ах иях ях ы ь ию ью ю ия ья я",
+)
+_SUPERLATIVE = _endings("", "ейш ейше")
+_DERIVATIONAL = _endings("", "ост ость")
+
+def _regions(word: str):
+    """Начала областей RV и R2 (индексы в слове)"""
+    rv = r1 = r2 = len(word)
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+def _remove_ending(word: str, start: int, endings: list) -> str | None:
+    """Удаляет самое длинное подходящее окончание внутри области [start:]; None если нет"""
+    for ending, after_a in endings:
+        pos = len(word) - len(ending)
+        if pos < start or not word.endswith(ending):
+            continue
+        if after_a and (pos - 1 < start or word[pos - 1] not in "ая"):
+            continue
+        return word[:pos]
+    return None
+
+@lru_cache(maxsize=200000)
+def stem_russian(word: str) -> str:
+    """Основа русского слова (слова не из кириллицы возвращаются как есть)"""
+    if len(word) < 3 or not _CYRILLIC_RE.match(word):
+        return word
+    rv, r2 = _regions(word)
+
+    # Шаг 1: деепричастие, иначе возвратность + прилагательное/причастие, глагол, существительное
+    stemmed = _remove_ending(word, rv, _PERFECTIVE_GERUND)
+    if stemmed is None:
+        word = _remove_ending(word, rv, _REFLEXIVE) or word
+        stemmed = _remove_ending(word, rv, _ADJECTIVE)
+        if stemmed is not None:
+            stemmed = _remove_ending(stemmed, rv, _PARTICIPLE) or stemmed
+        else:
+            stemmed = _remove_ending(word, rv, _VERB)
+            if stemmed is None:
+                stemmed = _remove_ending(word, rv, _NOUN)
+    word = stemmed if stemmed is not None else word
+
+    # Шаг 2: конечное "и"
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3: словообразовательный суффикс в R2
+    word = _remove_ending(word, max(rv, r2), _DERIVATIONAL) or word
+
+    # Шаг 4: превосходная степень, удвоенное "н", мягкий знак
+    superlative = _remove_ending(word, rv, _SUPERLATIVE)
+    if superlative is not None:
+        word = superlative
+    if word.endswith("нн") and len(word) - 2 >= rv:
+        word = word[:-1]
+    elif superlative is None and word.endswith("ь") and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
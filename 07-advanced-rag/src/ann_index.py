@@ -0,0 +1,192 @@
+import logging
+import time
+import numpy as np
+from vector_store import normalize_rows, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+# Имена массивов IVF индекса в директории версии индекса
+IVF_CENTROIDS = "ivf_centroids"
+IVF_ROWS = "ivf_rows"
+IVF_OFFSETS = "ivf_offsets"
+
+# Размер блока строк при назначении кластеров (ограничивает пиковую память)
+ASSIGN_BLOCK_ROWS = 16384
+
+def default_nlist(num_vectors: int) -> int:
+    """Число кластеров по умолчанию: ~4*sqrt(N)"""
+    return max(1, min(num_vectors, int(4 * np.sqrt(num_vectors))))
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Ближайший центроид (по косинусу) для каждой строки, блоками"""
+    assignments = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], ASSIGN_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+class IVFIndex:
+    """
+    Inverted File (IVF) индекс для приближенного поиска ближайших соседей
+
+    Векторы разбиваются на nlist кластеров сферическим k-means. При поиске
+    скорятся только строки из nprobe ближайших к запросу кластеров, поэтому
+    стоимость запроса ~ nlist + N * nprobe / nlist вместо N.
+    Больше nprobe - выше recall и latency.
+    """
+
+    def __init__(self, centroids: np.ndarray, rows: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids
+        self.rows = rows
+        self.offsets = offsets
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: int, n_iter: int = 20,
+              sample_size: int = 50000, seed: int = 0) -> "IVFIndex":
+        """
+        Обучение IVF на нормализованной матрице
+
+        Args:
+            matrix: L2-нормализованные векторы (n x dim), можно memory-mapped
+            nlist: число кластеров
+            n_iter: итерации k-means
+            sample_size: размер выборки для обучения центроидов
+        """
+        started_at = time.perf_counter()
+        rng = np.random.default_rng(seed)
+        n = matrix.shape[0]
+        nlist = max(1, min(nlist, n))
+
+        sample_rows = np.sort(rng.choice(n, size=min(n, max(sample_size, nlist)), replace=False))
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assignments = _assign(sample, centroids)
+            counts = np.bincount(assignments, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(centroids)
+            nonempty = counts > 0
+            sums[nonempty] = np.add.reduceat(sample[np.argsort(assignments, kind="stable")], starts[nonempty], axis=0)
+            empty = ~nonempty
+            # Пустые кластеры переинициализируем случайными точками выборки
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+            centroids = normalize_rows(sums)
+
+        assignments = _assign(matrix, centroids)
+        rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))]).astype(np.int64)
+
+        logger.info(f"IVF index built: {n} vectors, nlist={nlist} in {time.perf_counter() - started_at:.2f}s")
+        return cls(centroids, rows, offsets)
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, k: int, nprobe: int):
+        """
+        Приближенный top-k по косинусной близости
+
+        Returns:
+            tuple: (rows, scores) - индексы строк matrix и их scores по убыванию
+        """
+        if nprobe >= self.nlist:
+            scores = matrix @ query
+            top = top_k_indices(scores, k)
+            return top, scores[top]
+
+        probe = top_k_indices(self.centroids @ query, nprobe)
+        candidates = np.concatenate([self.rows[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+        if len(candidates) == 0:
+            return candidates, np.empty(0, dtype=np.float32)
+        # Сортировка кандидатов улучшает локальность чтения из memory-mapped матрицы
+        candidates.sort()
+        scores = matrix[candidates] @ query
+        top = top_k_indices(scores, k)
+        return candidates[top], scores[top]
+
+    def to_arrays(self) -> dict:
+        """Массивы для сохранения рядом с индексом"""
+        return {IVF_CENTROIDS: self.centroids, IVF_ROWS: self.rows, IVF_OFFSETS: self.offsets}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "IVFIndex":
+        return cls(arrays[IVF_CENTROIDS], arrays[IVF_ROWS], arrays[IVF_OFFSETS])
+
+def evaluate_recall(matrix: np.ndarray, ivf: IVFIndex, k: int, nprobe: int,
+                    n_queries: int = 200, noise: float = 0.05, seed: int = 0) -> dict:
+    """
+    Recall@k приближенного поиска относительно точного и сравнение latency
+
+    Запросы - случайные векторы индекса с небольшим шумом (имитация
+    перефразированного вопроса к существующему чанку).
+    """
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    rows = rng.choice(n, size=min(n_queries, n), replace=False)
+    queries = np.asarray(matrix[rows], dtype=np.float32)
+    queries = normalize_rows(queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32))
+
+    exact_time = 0.0
+    ann_time = 0.0
+    hits = 0
+    for query in queries:
+        started_at = time.perf_counter()
+        exact = top_k_indices(matrix @ query, k)
+        exact_time += time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        approx, _ = ivf.search(matrix, query, k, nprobe)
+        ann_time += time.perf_counter() - started_at
+
+        hits += len(set(exact.tolist()) & set(approx.tolist()))
+
+    total = len(queries) * min(k, n)
+    exact_ms = exact_time / len(queries) * 1000
+    ann_ms = ann_time / len(queries) * 1000
+    return {
+        "k": k,
+        "nprobe": nprobe,
+        "nlist": ivf.nlist,
+        "recall": round(hits / total, 4) if total else 0.0,
+        "exact_ms": round(exact_ms, 3),
+        "ann_ms": round(ann_ms, 3),
+        "speedup": round(exact_ms / ann_ms, 2) if ann_ms else 0.0,
+    }
+
+def main():
+    """CLI: отчет recall vs exact для сохраненного индекса при разных nprobe"""
+    import argparse
+    import index_store
+    from config import config
+
+    parser = argparse.ArgumentParser(description="IVF recall vs exact search report")
+    parser.add_argument("--k", type=int, default=config.SEMANTIC_RETRIEVER_K, help="Top-k for recall")
+    parser.add_argument("--nlist", type=int, default=config.IVF_NLIST, help="Number of clusters (0 = auto)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    args = parser.parse_args()
+
+    loaded = index_store.load_index()
+    if loaded is None:
+        logger.error("No persisted index found. Run the bot or /index first.")
+        return
+    _, matrix, _ = loaded
+
+    nlist = args.nlist if args.nlist > 0 else default_nlist(matrix.shape[0])
+    ivf = IVFIndex.build(matrix, nlist)
+
+    print(f"{'nprobe':>8} {'recall@' + str(args.k):>10} {'exact ms':>10} {'ivf ms':>10} {'speedup':>8}")
+    for nprobe in sorted({1, 2, 4, 8, 16, 32, 64, config.IVF_NPROBE}):
+        if nprobe > nlist:
+            continue
+        report = evaluate_recall(matrix, ivf, args.k, nprobe, n_queries=args.queries)
+        print(
+            f"{nprobe:>8} {report['recall']:>10.3f} {report['exact_ms']:>10.3f} "
+            f"{report['ann_ms']:>10.3f} {report['speedup']:>8.2f}"
+        )
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
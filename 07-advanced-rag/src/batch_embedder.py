@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import random
+import time
+import numpy as np
+from config import config
+from text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# HTTP статусы, при которых запрос embeddings стоит повторить
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError"}
+
+def make_batches(texts: list, max_tokens: int, max_size: int) -> list:
+    """
+    Группировка текстов в батчи по бюджету токенов
+    
+    Returns:
+        list[list[int]]: индексы текстов для каждого батча
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_size):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _get_status_code(error: Exception):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+def _is_retryable(error: Exception) -> bool:
+    """429/5xx и сетевые ошибки повторяем, остальные (например 400/401) - нет"""
+    status = _get_status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES or isinstance(error, (TimeoutError, ConnectionError))
+
+def _get_retry_after(error: Exception):
+    """Значение заголовка Retry-After (секунды), если провайдер его прислал"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class BatchEmbedder:
+    """
+    Embedding стадия индексации: батчи по бюджету токенов, ограниченная
+    конкурентность и повторы 429/5xx с jittered exponential backoff
+    
+    Один экземпляр на переиндексацию: семафор и статистика общие для всех
+    файлов, поэтому параллельная обработка файлов не превышает лимит запросов.
+    При 429 все запросы делают паузу (backpressure), а не только упавший.
+    """
+    
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.max_tokens = config.EMBEDDING_BATCH_MAX_TOKENS
+        self.max_size = config.EMBEDDING_BATCH_MAX_SIZE
+        self.max_retries = config.EMBEDDING_MAX_RETRIES
+        self._semaphore = asyncio.Semaphore(config.EMBEDDING_MAX_CONCURRENCY)
+        self._pause_until = 0.0
+        self._started_at = None
+        self.chunks = 0
+        self.tokens = 0
+        self.batches = 0
+        self.retries = 0
+    
+    async def embed(self, texts: list) -> np.ndarray:
+        """Embeddings для списка текстов (порядок сохраняется)"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if self._started_at is None:
+            self._started_at = time.perf_counter()
+        
+        batches = make_batches(texts, self.max_tokens, self.max_size)
+        results = await asyncio.gather(*(
+            self._embed_batch([texts[i] for i in batch]) for batch in batches
+        ))
+        return np.asarray([vector for batch_vectors in results for vector in batch_vectors], dtype=np.float32)
+    
+    async def _embed_batch(self, batch: list) -> list:
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                # Общая пауза после 429 - не долбим провайдера остальными запросами
+                delay = self._pause_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    vectors = await self.embeddings.aembed_documents(batch)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries or not _is_retryable(e):
+                        raise
+                    backoff = _get_retry_after(e) or min(60.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+                    self.retries += 1
+                    if _get_status_code(e) == 429:
+                        self._pause_until = max(self._pause_until, time.monotonic() + backoff)
+                    logger.warning(
+                        f"Embedding batch failed ({type(e).__name__}: {e}), "
+                        f"retry {attempt + 1}/{self.max_retries} in {backoff:.1f}s"
+                    )
+                    await asyncio.sleep(backoff)
+        
+        self.chunks += len(batch)
+        self.tokens += sum(estimate_tokens(text) for text in batch)
+        self.batches += 1
+        return vectors
+    
+    def get_stats(self) -> dict:
+        """Пропускная способность embedding стадии"""
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        return {
+            "chunks": self.chunks,
+            "tokens": self.tokens,
+            "batches": self.batches,
+            "retries": self.retries,
+            "seconds": round(elapsed, 2),
+            "chunks_per_s": round(self.chunks / elapsed, 1) if elapsed else 0.0,
+            "tokens_per_s": round(self.tokens / elapsed, 1) if elapsed else 0.0,
+        }
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import statistics
+import time
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnablePassthrough
+from config import config
+import rag
+
+class StaticRetriever(BaseRetriever):
+    """Retriever без поиска: измеряется только накладной расход цепочки"""
+
+    documents: list
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> list:
+        return self.documents
+
+def build_legacy_chain():
+    """Цепочка в прежнем виде: answer-пайплайн создается внутри lambda на каждый вызов"""
+    prompt, _ = rag._load_prompts()
+    return (
+        RunnablePassthrough.assign(documents=rag.get_retrieval_query_transformation_chain() | rag.retriever)
+        | RunnablePassthrough.assign(
+            answer=lambda x: (prompt | rag._get_llm() | StrOutputParser()).invoke({
+                "context": rag.format_chunks(x["documents"]),
+                "messages": x["messages"],
+            })
+        )
+        | (lambda x: {"answer": x["answer"], "documents": x["documents"]})
+    )
+
+async def measure(run, requests: int) -> list:
+    """Длительности запросов в мс (первые 5 - прогрев)"""
+    for _ in range(5):
+        await run()
+    durations = []
+    for _ in range(requests):
+        started_at = time.perf_counter()
+        await run()
+        durations.append((time.perf_counter() - started_at) * 1000)
+    return durations
+
+async def run_benchmark(requests: int):
+    inputs = {"messages": [HumanMessage(content="Какие условия досрочного погашения кредита?")]}
+
+    async def legacy():
+        # Было: цепочка собиралась на каждое сообщение
+        await build_legacy_chain().ainvoke(inputs)
+
+    async def per_request():
+        await rag.get_rag_chain().ainvoke(inputs)
+
+    async def prebuilt():
+        await rag.rag_chain.ainvoke(inputs)
+
+    results = {
+        "legacy (per message)": await measure(legacy, requests),
+        "get_rag_chain per message": await measure(per_request, requests),
+        "prebuilt chain": await measure(prebuilt, requests),
+    }
+
+    print(f"\n{'variant':>28} {'p50 ms':>8} {'mean ms':>8}")
+    for name, durations in results.items():
+        print(f"{name:>28} {statistics.median(durations):>8.2f} {statistics.mean(durations):>8.2f}")
+
+    # Стоимость одной только сборки цепочки (то, что больше не платится на каждое сообщение)
+    print(f"\n{'build only':>28} {'mean us':>8}")
+    for name, build in [("legacy chain", build_legacy_chain), ("get_rag_chain", rag.get_rag_chain)]:
+        started_at = time.perf_counter()
+        for _ in range(requests):
+            build()
+        print(f"{name:>28} {(time.perf_counter() - started_at) / requests * 1e6:>8.1f}")
+
+def main():
+    """
+    CLI: накладные расходы RAG цепочки на запрос (сборка на каждое сообщение vs один раз)
+    
+    LLM и retriever заменены заглушками, поэтому измеряется только оркестрация LCEL.
+    Запрос переписывается LLM во всех вариантах (QUERY_TRANSFORM_MODE=always), как в прежней цепочке.
+    """
+    parser = argparse.ArgumentParser(description="RAG chain per-request overhead micro-benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="Number of measured requests")
+    args = parser.parse_args()
+
+    # Прежняя цепочка всегда переписывает запрос: та же политика для всех вариантов,
+    # чтобы разница была только в сборке и переиспользовании цепочки
+    config.QUERY_TRANSFORM_MODE = "always"
+    rag._llm = FakeListChatModel(responses=["Ответ по документам."])
+    rag._llm_query_transform = FakeListChatModel(responses=["досрочное погашение кредита"])
+    rag.retriever = StaticRetriever(documents=[
+        Document(page_content=f"Чанк {i} о досрочном погашении", metadata={"source": "doc.pdf", "page": i})
+        for i in range(5)
+    ])
+    rag.rag_chain = rag.get_rag_chain()
+
+    asyncio.run(run_benchmark(args.requests))
+
+if __name__ == "__main__":
+    main()
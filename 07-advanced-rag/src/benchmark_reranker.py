@@ -0,0 +1,107 @@
+import argparse
+import logging
+import time
+import numpy as np
+import index_store
+from bm25_index import build_bm25_index, load_bm25_index
+from config import config
+from cross_encoder import load_cross_encoder
+
+logger = logging.getLogger(__name__)
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    """Ранговая корреляция Спирмена двух векторов scores"""
+    if len(a) < 2:
+        return 1.0
+    rank_a = np.argsort(np.argsort(a)).astype(np.float64)
+    rank_b = np.argsort(np.argsort(b)).astype(np.float64)
+    correlation = np.corrcoef(rank_a, rank_b)[0, 1]
+    return float(correlation) if np.isfinite(correlation) else 1.0
+
+def build_workload(chunks: list, n_queries: int, n_candidates: int, seed: int = 0) -> list:
+    """Пары (запрос, тексты кандидатов) из чанков индекса"""
+    index = load_bm25_index(chunks) or build_bm25_index(chunks)
+    rng = np.random.default_rng(seed)
+    workload = []
+    for row in rng.permutation(len(chunks)):
+        words = chunks[row].page_content.split()
+        if len(words) < 8:
+            continue
+        query = " ".join(words[:8])
+        doc_ids, _ = index.search(query, n_candidates)
+        if len(doc_ids) < 2:
+            continue
+        workload.append((query, [chunks[doc_id].page_content for doc_id in doc_ids]))
+        if len(workload) >= n_queries:
+            break
+    return workload
+
+def run_backend(backend: str, workload: list) -> dict:
+    """Latency и scores backend'а на нагрузке (первый прогон - прогрев, не учитывается)"""
+    started_at = time.perf_counter()
+    model = load_cross_encoder(backend)
+    load_s = time.perf_counter() - started_at
+
+    query, passages = workload[0]
+    model.predict([(query, passage) for passage in passages])
+
+    latencies = []
+    scores = []
+    for query, passages in workload:
+        started_at = time.perf_counter()
+        result = model.predict([(query, passage) for passage in passages])
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        scores.append(np.asarray(result, dtype=np.float64))
+    return {"load_s": load_s, "latencies": np.array(latencies), "scores": scores}
+
+def main():
+    """
+    CLI: сравнение backend'ов cross-encoder (torch vs onnx_int8)
+    
+    Запросы - первые слова случайных чанков сохраненного индекса, кандидаты - top BM25
+    для запроса (как в hybrid_reranker). Печатает latency и согласованность ранжирования:
+    пересечение top-k и ранговую корреляцию Спирмена.
+    """
+    parser = argparse.ArgumentParser(description="Cross-encoder backend benchmark (torch vs onnx_int8)")
+    parser.add_argument("--queries", type=int, default=50, help="Number of queries")
+    parser.add_argument("--candidates", type=int, default=20, help="Candidates per query")
+    parser.add_argument("--top-k", type=int, default=config.RERANKER_TOP_K, help="Top-k for agreement")
+    args = parser.parse_args()
+
+    loaded = index_store.load_index()
+    if loaded is None:
+        logger.error("No persisted index found. Run the bot or /index first.")
+        return
+    workload = build_workload(loaded[0], args.queries, args.candidates)
+    if not workload:
+        logger.error("Not enough chunks to build benchmark queries")
+        return
+    logger.info(f"Workload: {len(workload)} queries x up to {args.candidates} candidates")
+
+    results = {backend: run_backend(backend, workload) for backend in ["torch", "onnx_int8"]}
+
+    print(f"\n{'backend':>10} {'load s':>8} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    for backend, result in results.items():
+        latencies = result["latencies"]
+        print(
+            f"{backend:>10} {result['load_s']:>8.1f} {np.percentile(latencies, 50):>8.1f} "
+            f"{np.percentile(latencies, 95):>8.1f} {latencies.mean():>8.1f}"
+        )
+
+    overlaps = []
+    correlations = []
+    for torch_scores, onnx_scores in zip(results["torch"]["scores"], results["onnx_int8"]["scores"]):
+        k = min(args.top_k, len(torch_scores))
+        torch_top = set(np.argsort(-torch_scores)[:k].tolist())
+        onnx_top = set(np.argsort(-onnx_scores)[:k].tolist())
+        overlaps.append(len(torch_top & onnx_top) / k)
+        correlations.append(spearman(torch_scores, onnx_scores))
+
+    speedup = results["torch"]["latencies"].mean() / results["onnx_int8"]["latencies"].mean()
+    print(f"\nSpeedup (mean latency): {speedup:.2f}x")
+    print(f"Top-{args.top_k} agreement: {np.mean(overlaps):.3f}")
+    print(f"Spearman rank correlation: {np.mean(correlations):.3f}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
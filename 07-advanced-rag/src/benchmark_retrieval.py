@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from config import config
+import indexer
+import rag
+
+logger = logging.getLogger(__name__)
+
+MODES = ["semantic", "hybrid", "hybrid_reranker"]
+# Чанк считается найденным эталонным контекстом, если содержит не меньше этой доли его шинглов
+RELEVANCE_OVERLAP = 0.5
+SHINGLE_SIZE = 3
+
+class PrecomputedQueryEmbeddings(Embeddings):
+    """Embeddings вопросов датасета, вычисленные заранее: latency режимов не включает вызов модели"""
+
+    def __init__(self, embeddings: Embeddings, vectors: dict):
+        self.embeddings = embeddings
+        self.vectors = vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.vectors.get(text)
+        return vector if vector is not None else self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        vector = self.vectors.get(text)
+        return vector if vector is not None else await self.embeddings.aembed_query(text)
+
+def shingles(text: str) -> set:
+    words = text.lower().replace("ё", "е").split()
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def load_dataset(path: str) -> list:
+    """Вопросы и шинглы эталонных контекстов из JSON датасета (dataset_synthesizer.save_dataset)"""
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    dataset = []
+    for item in items:
+        contexts = [shingles(context) for context in item.get("contexts", []) if context.strip()]
+        if item.get("question") and contexts:
+            dataset.append({"question": item["question"], "contexts": contexts})
+    return dataset
+
+def relevance(documents: list, contexts: list) -> list:
+    """
+    Бинарная релевантность найденных чанков по рангам
+
+    Чанк релевантен, если покрывает еще не найденный эталонный контекст
+    (или содержится в нем): повторные попадания в тот же контекст не засчитываются.
+    """
+    found = set()
+    gains = []
+    for doc in documents:
+        doc_shingles = shingles(doc.page_content)
+        gain = 0
+        for i, context in enumerate(contexts):
+            if i in found or not doc_shingles or not context:
+                continue
+            common = len(doc_shingles & context)
+            if common / len(context) >= RELEVANCE_OVERLAP or common / len(doc_shingles) >= RELEVANCE_OVERLAP:
+                found.add(i)
+                gain = 1
+                break
+        gains.append(gain)
+    return gains
+
+def score_query(gains: list, n_relevant: int, ks: list) -> dict:
+    """recall@k для каждого k, MRR и nDCG@max(k) одного запроса"""
+    scores = {f"recall@{k}": sum(gains[:k]) / n_relevant for k in ks}
+    first = next((rank for rank, gain in enumerate(gains, 1) if gain), None)
+    scores["mrr"] = 1 / first if first else 0.0
+    k = max(ks)
+    dcg = sum(gain / math.log2(rank + 1) for rank, gain in enumerate(gains[:k], 1))
+    idcg = sum(1 / math.log2(rank + 1) for rank in range(1, min(n_relevant, k) + 1))
+    scores[f"ndcg@{k}"] = dcg / idcg
+    return scores
+
+def build_search(mode: str, store, chunks: list):
+    """Синхронная и асинхронная функции поиска режима (без трансформации запроса LLM)"""
+    if mode == "semantic":
+        retriever = rag.create_semantic_retriever(store)
+    else:
+        retriever = rag.create_hybrid_retriever(store, chunks)
+
+    if mode != "hybrid_reranker":
+        return retriever.invoke, retriever.ainvoke
+
+    def search(query: str) -> list:
+        return [doc for doc, _ in rag.rerank_documents(query, retriever.invoke(query))]
+
+    async def asearch(query: str) -> list:
+        return [doc for doc, _ in await rag.arerank_documents(query, await retriever.ainvoke(query))]
+
+    return search, asearch
+
+async def measure_throughput(asearch, questions: list, concurrency: int) -> float:
+    """Запросов в секунду при concurrency одновременных запросах"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(question: str):
+        async with semaphore:
+            await asearch(question)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(run(question) for question in questions))
+    return len(questions) / (time.perf_counter() - started_at)
+
+def run_mode(mode: str, store, chunks: list, dataset: list, ks: list, concurrency: int) -> dict:
+    """Качество и скорость поиска режима на датасете (первый запрос - прогрев, не учитывается)"""
+    search, asearch = build_search(mode, store, chunks)
+    search(dataset[0]["question"])
+
+    latencies = []
+    totals = {}
+    for item in dataset:
+        started_at = time.perf_counter()
+        documents = search(item["question"])
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        for name, value in score_query(relevance(documents, item["contexts"]), len(item["contexts"]), ks).items():
+            totals[name] = totals.get(name, 0.0) + value
+
+    latencies = np.array(latencies)
+    result = {name: round(value / len(dataset), 4) for name, value in totals.items()}
+    result["p50_ms"] = round(float(np.percentile(latencies, 50)), 2)
+    result["p95_ms"] = round(float(np.percentile(latencies, 95)), 2)
+    result["qps"] = round(asyncio.run(measure_throughput(asearch, [item["question"] for item in dataset], concurrency)), 1)
+    return result
+
+def main():
+    """
+    CLI: офлайн бенчмарк retrieval для режимов semantic / hybrid / hybrid_reranker
+
+    Вопросы берутся из локального датасета (make dataset), поиск идет по сохраненному индексу
+    без LLM (трансформации запроса и генерации). Найденный чанк релевантен, если совпадает
+    с эталонным контекстом вопроса по шинглам слов. Печатает recall@k, MRR, nDCG,
+    p50/p95 latency (последовательные запросы) и пропускную способность (параллельные).
+    Embeddings вопросов вычисляются заранее, их время печатается отдельно.
+    """
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark for RETRIEVAL_MODEs")
+    parser.add_argument("--dataset", default="datasets/06-rag-qa-dataset.json", help="Local dataset JSON")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated retrieval modes")
+    parser.add_argument("--k", default="1,3,5,10", help="Comma-separated k values for recall@k")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent queries for throughput")
+    parser.add_argument("--semantic-k", type=int, default=config.SEMANTIC_RETRIEVER_K)
+    parser.add_argument("--bm25-k", type=int, default=config.BM25_RETRIEVER_K)
+    parser.add_argument("--semantic-weight", type=float, default=config.ENSEMBLE_SEMANTIC_WEIGHT,
+                        help="Semantic weight in hybrid fusion (BM25 weight = 1 - value)")
+    parser.add_argument("--fusion", choices=["rrf", "weighted"], default=config.HYBRID_FUSION)
+    parser.add_argument("--reranker-top-k", type=int, default=config.RERANKER_TOP_K)
+    parser.add_argument("--output", help="Save results as JSON")
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"Unknown modes: {', '.join(unknown)}. Must be one of: {', '.join(MODES)}")
+    ks = sorted({int(k) for k in args.k.split(",")})
+
+    # Параметры поиска из аргументов - для подбора k и весов без правки .env
+    config.SEMANTIC_RETRIEVER_K = args.semantic_k
+    config.BM25_RETRIEVER_K = args.bm25_k
+    config.ENSEMBLE_SEMANTIC_WEIGHT = args.semantic_weight
+    config.ENSEMBLE_BM25_WEIGHT = round(1 - args.semantic_weight, 4)
+    config.HYBRID_FUSION = args.fusion
+    config.RERANKER_TOP_K = args.reranker_top_k
+    # Каждый запрос должен доходить до cross-encoder, в том числе при замере пропускной способности
+    rag.rerank_cache = None
+
+    dataset = load_dataset(args.dataset)
+    if not dataset:
+        logger.error(f"No questions with contexts in {args.dataset}. Run `make dataset` first.")
+        return
+    loaded = indexer.load_persisted_index(indexer.create_embeddings())
+    if loaded is None:
+        logger.error("No persisted index found. Run the bot or /index first.")
+        return
+    store, chunks = loaded
+    logger.info(f"Dataset: {len(dataset)} questions, index: {len(chunks)} chunks")
+
+    embedding_latencies = []
+    vectors = {}
+    for item in dataset:
+        started_at = time.perf_counter()
+        vectors[item["question"]] = store.embeddings.embed_query(item["question"])
+        embedding_latencies.append((time.perf_counter() - started_at) * 1000)
+    store.embedding = PrecomputedQueryEmbeddings(store.embeddings, vectors)
+
+    results = {mode: run_mode(mode, store, chunks, dataset, ks, args.concurrency) for mode in modes}
+
+    metric_names = [f"recall@{k}" for k in ks] + ["mrr", f"ndcg@{max(ks)}"]
+    print(f"\n{'mode':>16} " + " ".join(f"{name:>10}" for name in metric_names)
+          + f" {'p50 ms':>8} {'p95 ms':>8} {'qps':>8}")
+    for mode, result in results.items():
+        print(f"{mode:>16} " + " ".join(f"{result[name]:>10.3f}" for name in metric_names)
+              + f" {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['qps']:>8.1f}")
+    print(
+        f"\nQuery embedding (not included above): p50 {np.percentile(embedding_latencies, 50):.1f} ms, "
+        f"p95 {np.percentile(embedding_latencies, 95):.1f} ms"
+    )
+
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, ensure_ascii=False, indent=2)
+        logger.info(f"Results saved to {args.output}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import time
+from collections import Counter
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+import index_store
+from analyzers import get_analyzer
+from config import config
+from vector_store import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+# Имена массивов BM25 индекса в директории версии индекса
+BM25_TERMS = "bm25_terms"
+BM25_OFFSETS = "bm25_offsets"
+BM25_DOCS = "bm25_docs"
+BM25_IMPACTS = "bm25_impacts"
+BM25_IDF = "bm25_idf"
+BM25_DOC_LENS = "bm25_doc_lens"
+BM25_META = "bm25_meta"
+BM25_ARRAYS = [BM25_TERMS, BM25_OFFSETS, BM25_DOCS, BM25_IMPACTS, BM25_IDF, BM25_DOC_LENS, BM25_META]
+
+# Параметры Okapi BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+class BM25Index:
+    """
+    Инвертированный индекс Okapi BM25
+
+    Словарь - отсортированный массив термов (поиск через searchsorted),
+    постинги - непрерывные массивы (номер документа, вклад в score).
+    Вклад idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)) считается
+    один раз при построении, поэтому запрос читает только постинги своих
+    термов и суммирует их. Документы и запросы проходят через один и тот же
+    анализатор (см. analyzers), его имя хранится в meta.
+    """
+
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, docs: np.ndarray,
+                 impacts: np.ndarray, idf: np.ndarray, doc_lens: np.ndarray, meta: dict):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.impacts = impacts
+        self.idf = idf
+        self.doc_lens = doc_lens
+        self.meta = meta
+        self.analyzer = get_analyzer(meta["analyzer"])
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lens)
+
+    @classmethod
+    def build(cls, texts: list, analyzer_name: str, k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        """Построение индекса по текстам документов (номер документа = позиция в списке)"""
+        started_at = time.perf_counter()
+        analyzer = get_analyzer(analyzer_name)
+        vocab = {}
+        term_ids = []
+        doc_ids = []
+        tfs = []
+        doc_lens = np.zeros(len(texts), dtype=np.int32)
+        for doc_id, text in enumerate(texts):
+            tokens = analyzer.analyze(text)
+            doc_lens[doc_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+
+        # Перенумеровываем термы в алфавитном порядке, чтобы словарь был отсортированным массивом
+        sorted_terms = sorted(vocab)
+        remap = np.empty(len(vocab), dtype=np.int64)
+        remap[[vocab[term] for term in sorted_terms]] = np.arange(len(sorted_terms))
+        term_ids = remap[np.asarray(term_ids, dtype=np.int64)]
+
+        # Стабильная сортировка сохраняет возрастающий порядок документов внутри терма
+        order = np.argsort(term_ids, kind="stable")
+        term_ids = term_ids[order]
+        docs = np.asarray(doc_ids, dtype=np.int32)[order]
+        tf = np.asarray(tfs, dtype=np.float32)[order]
+
+        df = np.bincount(term_ids, minlength=len(sorted_terms))
+        offsets = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        n = len(texts)
+        idf = np.log((n - df + 0.5) / (df + 0.5) + 1.0).astype(np.float32)
+        avgdl = float(doc_lens.mean()) if n and doc_lens.sum() else 1.0
+        norm = k1 * (1 - b + b * doc_lens[docs] / avgdl)
+        impacts = (idf[term_ids] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+        terms = np.array(sorted_terms) if sorted_terms else np.array([], dtype="<U1")
+        meta = {"k1": k1, "b": b, "avgdl": avgdl, "num_docs": n, "analyzer": analyzer_name}
+        logger.info(
+            f"BM25 index built ({analyzer_name} analyzer): {n} docs, {len(sorted_terms)} terms, "
+            f"{len(docs)} postings in {time.perf_counter() - started_at:.2f}s"
+        )
+        return cls(terms, offsets, docs, impacts, idf, doc_lens, meta)
+
+    def _term_ids(self, tokens: list) -> list:
+        """Номера термов запроса, которые есть в словаре (повторы сохраняются)"""
+        if not tokens or len(self.terms) == 0:
+            return []
+        positions = np.searchsorted(self.terms, tokens)
+        return [
+            int(pos) for pos, token in zip(positions, tokens)
+            if pos < len(self.terms) and self.terms[pos] == token
+        ]
+
+    def search(self, query: str, k: int):
+        """
+        Top-k документов по BM25
+
+        Returns:
+            tuple: (doc_ids, scores) по убыванию score, только документы с хотя бы одним термом запроса
+        """
+        term_ids = self._term_ids(self.analyzer.analyze(query))
+        if not term_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        docs = np.concatenate([self.docs[self.offsets[t]:self.offsets[t + 1]] for t in term_ids])
+        impacts = np.concatenate([self.impacts[self.offsets[t]:self.offsets[t + 1]] for t in term_ids])
+        unique_docs, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=impacts)
+        top = top_k_indices(scores, k)
+        return unique_docs[top], scores[top]
+
+    def to_arrays(self) -> dict:
+        """Массивы для сохранения рядом с индексом"""
+        return {
+            BM25_TERMS: self.terms,
+            BM25_OFFSETS: self.offsets,
+            BM25_DOCS: self.docs,
+            BM25_IMPACTS: self.impacts,
+            BM25_IDF: self.idf,
+            BM25_DOC_LENS: self.doc_lens,
+            BM25_META: np.array(json.dumps(self.meta)),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "BM25Index":
+        return cls(
+            arrays[BM25_TERMS], arrays[BM25_OFFSETS], arrays[BM25_DOCS], arrays[BM25_IMPACTS],
+            arrays[BM25_IDF], arrays[BM25_DOC_LENS], json.loads(str(arrays[BM25_META])),
+        )
+
+def chunks_key(chunks: list) -> str:
+    """Отпечаток списка чанков (id в порядке индекса) для проверки соответствия BM25 индекса"""
+    return hashlib.sha256("\n".join(str(chunk.id) for chunk in chunks).encode("utf-8")).hexdigest()
+
+def build_bm25_index(chunks: list) -> BM25Index:
+    """BM25 индекс по чанкам (номер документа = позиция чанка в списке)"""
+    index = BM25Index.build([chunk.page_content for chunk in chunks], config.BM25_ANALYZER)
+    index.meta["chunks_key"] = chunks_key(chunks)
+    return index
+
+def load_bm25_index(chunks: list) -> BM25Index | None:
+    """BM25 индекс текущей версии с диска (None если его нет или он построен для других чанков/параметров)"""
+    arrays = index_store.load_arrays(BM25_ARRAYS)
+    if arrays is None:
+        return None
+    meta = json.loads(str(arrays[BM25_META]))
+    if (meta.get("chunks_key") != chunks_key(chunks) or meta.get("analyzer") != config.BM25_ANALYZER
+            or meta.get("k1") != BM25_K1 or meta.get("b") != BM25_B):
+        logger.info("Persisted BM25 index does not match current chunks or parameters")
+        return None
+    return BM25Index.from_arrays(arrays)
+
+class BM25IndexRetriever(BaseRetriever):
+    """LangChain retriever поверх BM25Index (документы - чанки в порядке индекса)"""
+
+    index: BM25Index
+    documents: list
+    k: int = 4
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        doc_ids, _ = self.index.search(query, self.k)
+        return [self.documents[doc_id] for doc_id in doc_ids]
@@ -7,26 +7,37 @@ from pathlib import Path
 os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
 
 from aiogram import Bot, Dispatcher
+import handlers
 from handlers import router
 from config import config
 import indexer
+import metrics
 import rag
+import warmup
 
-# Создаем директорию для логов
-log_dir = Path("logs")
-log_dir.mkdir(exist_ok=True)
-
-# Настройка логирования в консоль и файл
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # Вывод в консоль
-        logging.FileHandler(log_dir / "bot.log", encoding='utf-8')  # Запись в файл
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def setup_logging():
+    """
+    Логирование в консоль и logs/bot.log
+    
+    Вызывается только при запуске бота: процессы индексации (spawn) импортируют
+    этот модуль заново и настраивают логирование сами.
+    """
+    # Создаем директорию для логов
+    log_dir = Path("logs")
+    log_dir.mkdir(exist_ok=True)
+    
+    # Настройка логирования в консоль и файл
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(),  # Вывод в консоль
+            logging.FileHandler(log_dir / "bot.log", encoding='utf-8')  # Запись в файл
+        ]
+    )
+
 async def main():
     logger.info("=" * 70)
     logger.info("🤖 Advanced Hybrid RAG Bot Starting...")
@@ -53,6 +64,9 @@ async def main():
     logger.info(f"  Show sources: {config.SHOW_SOURCES}")
     logger.info("-" * 70)
     
+    # История диалогов (при HISTORY_BACKEND=sqlite неверный путь к базе - ошибка уже здесь)
+    history_store = handlers.create_history_store()
+    
     # Индексация при старте
     logger.info("📚 Starting indexing...")
     result = await indexer.reindex_all()
@@ -69,6 +83,13 @@ async def main():
     dp = Dispatcher()
     dp.include_router(router)
     
+    # Прогрев моделей в фоне: первый пользователь не ждет загрузки cross-encoder/embeddings
+    warmup.start_warmup()
+    
+    metrics_server = None
+    if config.METRICS_PORT:
+        metrics_server = metrics.start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+    
     logger.info("-" * 70)
     logger.info("🚀 Starting bot polling...")
     logger.info("=" * 70)
@@ -79,10 +100,16 @@ async def main():
     except Exception as e:
         logger.error(f"❌ Bot stopped with error: {e}", exc_info=True)
     finally:
+        # Дописываем накопившиеся сообщения диалогов на диск
+        if history_store.backend is not None:
+            history_store.backend.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
         logger.info("=" * 70)
         logger.info("🛑 Bot shutdown complete")
         logger.info("=" * 70)
 
 if __name__ == "__main__":
+    setup_logging()
     asyncio.run(main())
 
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+class LRUTTLCache:
+    """
+    Потокобезопасный in-memory кеш с LRU-вытеснением и временем жизни записей
+
+    Args:
+        max_entries: максимум записей (при превышении вытесняются давно не читанные)
+        ttl_s: время жизни записи в секундах (0 - без ограничения)
+    """
+
+    def __init__(self, max_entries: int, ttl_s: float = 0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Значение по ключу (запись становится самой свежей) или default"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl_s and time.monotonic() - entry[1] > self.ttl_s:
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Удаление всех записей (счетчики попаданий сохраняются)"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": len(self._data),
+        }
+
+class SemanticCache:
+    """
+    Кеш по смысловой близости: значение находится по embedding запроса,
+    если cosine similarity с сохраненным запросом не ниже threshold
+
+    Записи привязаны к версии данных (version): после clear(version) записи,
+    вычисленные на старой версии, не принимаются. Вытеснение LRU, время жизни ttl_s.
+
+    Args:
+        max_entries: максимум записей
+        ttl_s: время жизни записи в секундах (0 - без ограничения)
+        threshold: минимальная cosine similarity для попадания
+    """
+
+    def __init__(self, max_entries: int, ttl_s: float = 0, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.threshold = threshold
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (vector, value, created_at)
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _drop_expired(self):
+        if not self.ttl_s:
+            return
+        now = time.monotonic()
+        expired = [key for key, entry in self._data.items() if now - entry[2] > self.ttl_s]
+        for key in expired:
+            del self._data[key]
+        if expired:
+            self._matrix = None
+
+    def get(self, vector, default=None):
+        """Значение самого близкого запроса (similarity >= threshold) или default"""
+        query = self._normalize(vector)
+        with self._lock:
+            self._drop_expired()
+            if self._data:
+                # Матрица пересобирается только после изменений (записи - на промахах, т.е. после LLM)
+                if self._matrix is None:
+                    self._matrix_keys = list(self._data)
+                    self._matrix = np.stack([self._data[key][0] for key in self._matrix_keys])
+                similarities = self._matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key = self._matrix_keys[best]
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return self._data[key][1]
+            self.misses += 1
+            return default
+
+    def set(self, key, vector, value, version: int | None = None):
+        """Сохранение значения для запроса key; запись старой версии данных игнорируется"""
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._data[key] = (self._normalize(vector), value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            self._matrix = None
+
+    def clear(self, version: int | None = None):
+        """Удаление всех записей и (опционально) переход на новую версию данных"""
+        with self._lock:
+            self._data.clear()
+            self._matrix = None
+            if version is not None:
+                self.version = version
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": len(self._data),
+        }
@@ -15,23 +15,90 @@ class Config:
     PROMPTS_DIR = os.getenv("PROMPTS_DIR", "prompts")
     CONVERSATION_SYSTEM_PROMPT_FILE = os.getenv("CONVERSATION_SYSTEM_PROMPT_FILE", "conversation_system.txt")
     QUERY_TRANSFORM_PROMPT_FILE = os.getenv("QUERY_TRANSFORM_PROMPT_FILE", "query_transform.txt")
+    HISTORY_SUMMARY_PROMPT_FILE = os.getenv("HISTORY_SUMMARY_PROMPT_FILE", "history_summary.txt")
     SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT")
     
+    # Персистентный индекс (embeddings + чанки на диске)
+    INDEX_DIR = os.getenv("INDEX_DIR", "index")
+    # Число процессов для параллельной загрузки и разбиения файлов (0 = по числу ядер)
+    INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "0"))
+    
     # Embeddings Configuration
     EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai/huggingface
     HUGGINGFACE_EMBEDDING_MODEL = os.getenv("HUGGINGFACE_EMBEDDING_MODEL", "intfloat/multilingual-e5-base")
     HUGGINGFACE_DEVICE = os.getenv("HUGGINGFACE_DEVICE", "cpu")  # cpu/cuda/mps
     
+    # Дисковый кеш embeddings (общий для индексации и RAGAS)
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite")
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+    EMBEDDING_CACHE_MAX_SIZE_MB = int(os.getenv("EMBEDDING_CACHE_MAX_SIZE_MB", "2048"))
+    
+    # Батчинг и конкурентность запросов embeddings при индексации
+    EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "8000"))
+    EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "128"))
+    EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+    EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+    
     # Retrieval Configuration
     RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "semantic")  # semantic/hybrid/hybrid_reranker
     SEMANTIC_RETRIEVER_K = int(os.getenv("SEMANTIC_RETRIEVER_K", "10"))
     BM25_RETRIEVER_K = int(os.getenv("BM25_RETRIEVER_K", "10"))
+    BM25_ANALYZER = os.getenv("BM25_ANALYZER", "russian")  # russian (стемминг + стоп-слова) / simple
     ENSEMBLE_SEMANTIC_WEIGHT = float(os.getenv("ENSEMBLE_SEMANTIC_WEIGHT", "0.5"))
     ENSEMBLE_BM25_WEIGHT = float(os.getenv("ENSEMBLE_BM25_WEIGHT", "0.5"))
+    HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")  # rrf (по рангам) / weighted (по нормализованным scores)
+    HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+    
+    # Индекс для semantic поиска: exact (полный перебор) / ivf (приближенный, Inverted File)
+    VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "exact")
+    IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # Число кластеров (0 = ~4*sqrt(N))
+    IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))  # Сколько кластеров просматривать (recall vs latency)
     
     # Cross-Encoder Reranking Configuration
     CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
     RERANKER_TOP_K = int(os.getenv("RERANKER_TOP_K", "3"))
+    CROSS_ENCODER_BACKEND = os.getenv("CROSS_ENCODER_BACKEND", "torch")  # torch / onnx_int8
+    CROSS_ENCODER_ONNX_DIR = os.getenv("CROSS_ENCODER_ONNX_DIR", "cache/onnx")  # Экспортированные ONNX модели
+    CROSS_ENCODER_QUANTIZATION = os.getenv("CROSS_ENCODER_QUANTIZATION", "avx2")  # arm64/avx2/avx512/avx512_vnni
+    RERANKER_BATCH_WINDOW_MS = float(os.getenv("RERANKER_BATCH_WINDOW_MS", "10"))  # Окно сбора батча
+    RERANKER_MAX_BATCH_PAIRS = int(os.getenv("RERANKER_MAX_BATCH_PAIRS", "128"))  # Макс. пар (query, chunk) в батче
+    
+    # Кеш scores reranker по (нормализованный вопрос, id чанка)
+    RERANK_CACHE_ENABLED = os.getenv("RERANK_CACHE_ENABLED", "true").lower() == "true"
+    RERANK_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "50000"))
+    RERANK_CACHE_TTL_S = float(os.getenv("RERANK_CACHE_TTL_S", "86400"))  # 0 = без ограничения
+    
+    # История диалогов: лимиты на чат и вытеснение неактивных чатов
+    HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "10"))  # Реплик пользователя (с ответами)
+    HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "3000"))
+    HISTORY_IDLE_TTL_S = float(os.getenv("HISTORY_IDLE_TTL_S", "86400"))  # 0 = без ограничения
+    HISTORY_MAX_CHATS = int(os.getenv("HISTORY_MAX_CHATS", "10000"))
+    HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "sqlite")  # sqlite (переживает рестарт) / memory
+    HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "cache/conversations.sqlite3")
+    HISTORY_SUMMARY_ENABLED = os.getenv("HISTORY_SUMMARY_ENABLED", "false").lower() == "true"
+    HISTORY_SUMMARY_MAX_WORDS = int(os.getenv("HISTORY_SUMMARY_MAX_WORDS", "150"))
+    
+    # Бюджет контекста для LLM в токенах (оценка по символам, 0 = без ограничения)
+    CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+    
+    # Семантический кеш ответов (сбрасывается при переиндексации)
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # Минимальная cosine similarity
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "3600"))  # 0 = без ограничения
+    
+    # Трансформация запроса LLM: always / auto (только уточняющие вопросы) / speculative
+    QUERY_TRANSFORM_MODE = os.getenv("QUERY_TRANSFORM_MODE", "auto")
+    QUERY_TRANSFORM_TIMEOUT_S = float(os.getenv("QUERY_TRANSFORM_TIMEOUT_S", "5"))  # Для speculative режима
+    
+    # Потоковый ответ: сообщение дописывается по мере генерации
+    STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "true").lower() == "true"
+    STREAM_EDIT_INTERVAL_S = float(os.getenv("STREAM_EDIT_INTERVAL_S", "1.0"))  # Не чаще одной правки за интервал
+    
+    # Метрики этапов RAG в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = HTTP сервер метрик выключен
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
     
     # Отображение источников
     SHOW_SOURCES = os.getenv("SHOW_SOURCES", "false").lower() == "true"
@@ -49,6 +116,8 @@ class Config:
     # Для HuggingFace используем те же настройки что и для основных embeddings
     RAGAS_HUGGINGFACE_EMBEDDING_MODEL = os.getenv("RAGAS_HUGGINGFACE_EMBEDDING_MODEL", HUGGINGFACE_EMBEDDING_MODEL)
     RAGAS_HUGGINGFACE_DEVICE = os.getenv("RAGAS_HUGGINGFACE_DEVICE", HUGGINGFACE_DEVICE)
+    # Одновременно выполняемых примеров /evaluate_dataset (RAG цепочка, RAGAS, загрузка feedback)
+    EVALUATION_MAX_CONCURRENCY = int(os.getenv("EVALUATION_MAX_CONCURRENCY", "8"))
     
     @classmethod
     def load_prompt(cls, filename: str) -> str:
@@ -69,6 +138,62 @@ class Config:
                 f"Must be one of: {', '.join(valid_retrieval_modes)}"
             )
         
+        # Валидация HISTORY_BACKEND
+        valid_history_backends = ["sqlite", "memory"]
+        if cls.HISTORY_BACKEND not in valid_history_backends:
+            raise ValueError(
+                f"Invalid HISTORY_BACKEND: {cls.HISTORY_BACKEND}. "
+                f"Must be one of: {', '.join(valid_history_backends)}"
+            )
+        
+        # Валидация ANSWER_CACHE_THRESHOLD
+        if not 0 < cls.ANSWER_CACHE_THRESHOLD <= 1:
+            raise ValueError(f"Invalid ANSWER_CACHE_THRESHOLD: {cls.ANSWER_CACHE_THRESHOLD}. Must be in (0, 1]")
+        
+        # Валидация EVALUATION_MAX_CONCURRENCY
+        if cls.EVALUATION_MAX_CONCURRENCY < 1:
+            raise ValueError(f"Invalid EVALUATION_MAX_CONCURRENCY: {cls.EVALUATION_MAX_CONCURRENCY}. Must be >= 1")
+        
+        # Валидация QUERY_TRANSFORM_MODE
+        valid_query_transform_modes = ["always", "auto", "speculative"]
+        if cls.QUERY_TRANSFORM_MODE not in valid_query_transform_modes:
+            raise ValueError(
+                f"Invalid QUERY_TRANSFORM_MODE: {cls.QUERY_TRANSFORM_MODE}. "
+                f"Must be one of: {', '.join(valid_query_transform_modes)}"
+            )
+        
+        # Валидация CROSS_ENCODER_BACKEND
+        valid_cross_encoder_backends = ["torch", "onnx_int8"]
+        if cls.CROSS_ENCODER_BACKEND not in valid_cross_encoder_backends:
+            raise ValueError(
+                f"Invalid CROSS_ENCODER_BACKEND: {cls.CROSS_ENCODER_BACKEND}. "
+                f"Must be one of: {', '.join(valid_cross_encoder_backends)}"
+            )
+        
+        # Валидация HYBRID_FUSION
+        valid_hybrid_fusions = ["rrf", "weighted"]
+        if cls.HYBRID_FUSION not in valid_hybrid_fusions:
+            raise ValueError(
+                f"Invalid HYBRID_FUSION: {cls.HYBRID_FUSION}. "
+                f"Must be one of: {', '.join(valid_hybrid_fusions)}"
+            )
+        
+        # Валидация BM25_ANALYZER
+        valid_bm25_analyzers = ["russian", "simple"]
+        if cls.BM25_ANALYZER not in valid_bm25_analyzers:
+            raise ValueError(
+                f"Invalid BM25_ANALYZER: {cls.BM25_ANALYZER}. "
+                f"Must be one of: {', '.join(valid_bm25_analyzers)}"
+            )
+        
+        # Валидация VECTOR_INDEX_TYPE
+        valid_vector_index_types = ["exact", "ivf"]
+        if cls.VECTOR_INDEX_TYPE not in valid_vector_index_types:
+            raise ValueError(
+                f"Invalid VECTOR_INDEX_TYPE: {cls.VECTOR_INDEX_TYPE}. "
+                f"Must be one of: {', '.join(valid_vector_index_types)}"
+            )
+        
         # Валидация EMBEDDING_PROVIDER
         valid_embedding_providers = ["openai", "huggingface"]
         if cls.EMBEDDING_PROVIDER not in valid_embedding_providers:
@@ -0,0 +1,109 @@
+from collections import Counter
+from text_utils import estimate_tokens
+
+# Максимальное перекрытие соседних чанков, которое ищется при склейке
+# (у сплиттера chunk_overlap=50, с запасом на границы слов)
+MAX_OVERLAP_CHARS = 120
+# Более короткие совпадения считаем случайными
+MIN_OVERLAP_CHARS = 10
+
+# Накопительная статистика упаковки (для /index_status)
+stats = Counter()
+
+def find_overlap(left: str, right: str) -> int:
+    """Длина самого длинного суффикса left, совпадающего с префиксом right (0 - не соседи)"""
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+class ContextBlock:
+    """Фрагмент контекста: один или несколько склеенных соседних чанков одной страницы"""
+
+    def __init__(self, chunk):
+        self.source = chunk.metadata.get('source', 'Unknown')
+        self.page = chunk.metadata.get('page', 'N/A')
+        self.text = chunk.page_content.strip()
+
+    def contains(self, text: str) -> bool:
+        return text in self.text
+
+    def merge(self, text: str) -> str | None:
+        """Склейка с соседним чанком по перекрытию; возвращает добавленный текст или None"""
+        overlap = find_overlap(self.text, text)
+        if overlap:
+            added = text[overlap:]
+            self.text += added
+            return added
+        overlap = find_overlap(text, self.text)
+        if overlap:
+            added = text[:-overlap]
+            self.text = added + self.text
+            return added
+        return None
+
+def pack_chunks(chunks: list, max_tokens: int) -> list:
+    """
+    Упаковка найденных чанков в контекст ограниченного размера
+
+    Чанки обрабатываются в порядке релевантности: дубликаты (текст уже есть в контексте)
+    пропускаются, соседние чанки одной страницы склеиваются без повторения перекрытия,
+    остальные добавляются, пока хватает бюджета max_tokens (0 - без ограничения).
+    Самый релевантный чанк попадает в контекст всегда.
+
+    Returns:
+        list[ContextBlock]: блоки в порядке релевантности лучшего чанка
+    """
+    blocks = []
+    used_tokens = 0
+    for chunk in chunks:
+        text = chunk.page_content.strip()
+        if not text:
+            continue
+        same_page = [
+            block for block in blocks
+            if block.source == chunk.metadata.get('source', 'Unknown')
+            and block.page == chunk.metadata.get('page', 'N/A')
+        ]
+        if any(block.contains(text) for block in same_page):
+            stats["duplicates"] += 1
+            continue
+
+        merged = False
+        for block in same_page:
+            backup = block.text
+            added = block.merge(text)
+            if added is None:
+                continue
+            if max_tokens and used_tokens + estimate_tokens(added) > max_tokens:
+                block.text = backup
+                break
+            used_tokens += estimate_tokens(added)
+            stats["merged"] += 1
+            merged = True
+            break
+        if merged:
+            continue
+
+        tokens = estimate_tokens(text)
+        if blocks and max_tokens and used_tokens + tokens > max_tokens:
+            stats["dropped"] += 1
+            continue
+        blocks.append(ContextBlock(chunk))
+        used_tokens += tokens
+
+    stats["contexts"] += 1
+    stats["tokens_in"] += sum(estimate_tokens(chunk.page_content) for chunk in chunks)
+    stats["tokens_out"] += used_tokens
+    return blocks
+
+def get_stats() -> dict:
+    """Статистика упаковки: сколько токенов контекста сэкономлено"""
+    tokens_in = stats["tokens_in"]
+    return {
+        "contexts": stats["contexts"],
+        "duplicates": stats["duplicates"],
+        "merged": stats["merged"],
+        "dropped": stats["dropped"],
+        "token_ratio": round(stats["tokens_out"] / tokens_in, 3) if tokens_in else 1.0,
+    }
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Максимум операций в одной транзакции
+MAX_BATCH_OPS = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (chat_id, id);
+CREATE TABLE IF NOT EXISTS summaries (
+    chat_id INTEGER PRIMARY KEY,
+    summary TEXT NOT NULL
+);
+"""
+
+def _add_message(conn, chat_id: int, role: str, content: str):
+    conn.execute(
+        "INSERT INTO messages (chat_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+        (chat_id, role, content, time.time()),
+    )
+
+def _get_messages(conn, chat_id: int, limit: int) -> list:
+    rows = conn.execute(
+        "SELECT role, content, created_at FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+        (chat_id, limit),
+    ).fetchall()
+    return [{"role": role, "content": content, "created_at": created_at} for role, content, created_at in reversed(rows)]
+
+def _trim(conn, chat_id: int, keep: int):
+    conn.execute(
+        "DELETE FROM messages WHERE chat_id = ? AND id NOT IN "
+        "(SELECT id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?)",
+        (chat_id, chat_id, keep),
+    )
+
+def _delete_last(conn, chat_id: int):
+    conn.execute(
+        "DELETE FROM messages WHERE id = (SELECT MAX(id) FROM messages WHERE chat_id = ?)",
+        (chat_id,),
+    )
+
+def _clear(conn, chat_id: int):
+    conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+    conn.execute("DELETE FROM summaries WHERE chat_id = ?", (chat_id,))
+
+def _get_summary(conn, chat_id: int) -> str:
+    row = conn.execute("SELECT summary FROM summaries WHERE chat_id = ?", (chat_id,)).fetchone()
+    return row[0] if row else ""
+
+def _set_summary(conn, chat_id: int, summary: str):
+    conn.execute(
+        "INSERT INTO summaries (chat_id, summary) VALUES (?, ?) "
+        "ON CONFLICT(chat_id) DO UPDATE SET summary = excluded.summary",
+        (chat_id, summary),
+    )
+
+class SQLiteConversationStore:
+    """
+    Хранилище сообщений диалогов в SQLite (WAL) с асинхронным доступом
+
+    Все операции выполняются в одном потоке со своим соединением, event loop не
+    блокируется. Записи не ждут диска: add_message только ставит операцию в очередь,
+    накопившиеся операции выполняются одной транзакцией. Чтения идут через ту же
+    очередь и поэтому видят все предыдущие записи.
+
+    Args:
+        path: путь к файлу базы
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.transactions = 0
+        self.operations = 0
+        self._queue = queue.Queue()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Соединение открывается сразу: неверный путь или права - ошибка при старте бота
+        self._conn = self._connect()
+        self._thread = threading.Thread(target=self._run, name="conversation-store", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL режиме NORMAL не теряет целостность, но не делает fsync на каждый commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _run(self):
+        conn = self._conn
+        stop = False
+        while not stop:
+            ops = [self._queue.get()]
+            while len(ops) < MAX_BATCH_OPS:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in ops
+            # Операции, отмененные до начала выполнения (ожидавшая задача отменена), пропускаются
+            ops = [op for op in ops if op is not None and op[2].set_running_or_notify_cancel()]
+            if not ops:
+                continue
+
+            results = []
+            try:
+                with conn:
+                    for func, args, future in ops:
+                        try:
+                            results.append((future, func(conn, *args), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+                self.transactions += 1
+                self.operations += len(ops)
+            except Exception as e:
+                # Транзакция не зафиксирована - ни одна операция батча не выполнена
+                results = [(future, None, e) for _, _, future in ops]
+            finally:
+                # Поток не завершается, пока не разрешены все взятые из очереди операции
+                resolved = {id(future) for future, _, _ in results}
+                results += [
+                    (future, None, RuntimeError("Conversation store operation failed"))
+                    for _, _, future in ops if id(future) not in resolved
+                ]
+                for future, result, error in results:
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        logger.error(f"Conversation store operation failed: {error!r}")
+                        future.set_exception(error)
+        conn.close()
+
+    def _submit(self, func, *args) -> Future:
+        future = Future()
+        self._queue.put((func, args, future))
+        return future
+
+    async def _call(self, func, *args):
+        return await asyncio.wrap_future(self._submit(func, *args))
+
+    async def get_messages(self, chat_id: int, limit: int) -> list:
+        """Последние limit сообщений чата: [{"role", "content", "created_at"}] от старых к новым"""
+        return await self._call(_get_messages, chat_id, limit)
+
+    async def add_message(self, chat_id: int, role: str, content: str):
+        """Добавление сообщения (без ожидания записи на диск)"""
+        self._submit(_add_message, chat_id, role, content)
+
+    async def clear(self, chat_id: int):
+        """Удаление истории чата"""
+        self._submit(_clear, chat_id)
+
+    async def delete_last(self, chat_id: int):
+        """Удаление последнего сообщения чата"""
+        self._submit(_delete_last, chat_id)
+
+    async def trim(self, chat_id: int, keep: int):
+        """Удаление всех сообщений чата, кроме последних keep"""
+        self._submit(_trim, chat_id, keep)
+
+    async def get_summary(self, chat_id: int) -> str:
+        return await self._call(_get_summary, chat_id)
+
+    async def set_summary(self, chat_id: int, summary: str):
+        self._submit(_set_summary, chat_id, summary)
+
+    async def flush(self):
+        """Ожидание записи всех поставленных в очередь операций"""
+        await self._call(lambda conn: None)
+
+    def close(self):
+        """Запись оставшихся операций и остановка потока"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def get_stats(self) -> dict:
+        return {
+            "transactions": self.transactions,
+            "avg_batch_ops": round(self.operations / self.transactions, 1) if self.transactions else 0.0,
+            "pending": self._queue.qsize(),
+        }
@@ -0,0 +1,57 @@
+import logging
+import re
+import time
+from pathlib import Path
+from config import config
+
+logger = logging.getLogger(__name__)
+
+ONNX_INSTALL_HINT = 'ONNX backend requires optional dependencies: uv pip install "sentence-transformers[onnx]"'
+
+def get_onnx_export_dir(model_name: str) -> Path:
+    """Директория экспортированной ONNX модели (одна на имя модели)"""
+    return Path(config.CROSS_ENCODER_ONNX_DIR) / re.sub(r"[^A-Za-z0-9._-]+", "_", model_name)
+
+def get_quantized_file_name(quantization: str) -> str:
+    """Имя int8 модели внутри директории экспорта (как его формирует sentence-transformers)"""
+    return f"onnx/model_qint8_{quantization}.onnx"
+
+def load_torch_cross_encoder(model_name: str):
+    """Cross-encoder в PyTorch (full precision)"""
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name)
+
+def load_onnx_int8_cross_encoder(model_name: str, quantization: str):
+    """
+    Cross-encoder в ONNX Runtime с int8 dynamic quantization
+
+    При первом запуске модель экспортируется в ONNX, квантуется и сохраняется
+    в CROSS_ENCODER_ONNX_DIR; следующие запуски загружают готовый файл.
+    """
+    try:
+        from sentence_transformers import CrossEncoder, export_dynamic_quantized_onnx_model
+    except ImportError as e:
+        raise ImportError(ONNX_INSTALL_HINT) from e
+
+    export_dir = get_onnx_export_dir(model_name)
+    file_name = get_quantized_file_name(quantization)
+    if not (export_dir / file_name).exists():
+        started_at = time.perf_counter()
+        logger.info(f"Exporting cross-encoder to ONNX int8 ({quantization}): {export_dir}")
+        try:
+            model = CrossEncoder(model_name, backend="onnx")
+        except ImportError as e:
+            raise ImportError(ONNX_INSTALL_HINT) from e
+        model.save_pretrained(str(export_dir))
+        export_dynamic_quantized_onnx_model(model, quantization, str(export_dir))
+        logger.info(f"ONNX export finished in {time.perf_counter() - started_at:.1f}s")
+
+    return CrossEncoder(str(export_dir), backend="onnx", model_kwargs={"file_name": file_name})
+
+def load_cross_encoder(backend: str | None = None, model_name: str | None = None):
+    """Загрузка cross-encoder для выбранного backend (CROSS_ENCODER_BACKEND)"""
+    backend = backend or config.CROSS_ENCODER_BACKEND
+    model_name = model_name or config.CROSS_ENCODER_MODEL
+    if backend == "onnx_int8":
+        return load_onnx_int8_cross_encoder(model_name, config.CROSS_ENCODER_QUANTIZATION)
+    return load_torch_cross_encoder(model_name)
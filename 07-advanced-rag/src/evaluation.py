@@ -1,5 +1,8 @@
 import logging
-from typing import Optional, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Dict, Any
+from langchain_core.messages import HumanMessage
 from langsmith import Client
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
@@ -18,6 +21,7 @@ from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
 from ragas.run_config import RunConfig
 from config import config
+from embedding_cache import with_cache
 import rag
 
 logger = logging.getLogger(__name__)
@@ -25,6 +29,8 @@ logger = logging.getLogger(__name__)
 # Глобальные инициализированные метрики
 _ragas_metrics = None
 _ragas_run_config = None
+# Захвачен, пока выполняется evaluation (запускается не больше одной)
+evaluation_lock = threading.Lock()
 
 def create_ragas_embeddings():
     """
@@ -35,15 +41,16 @@ def create_ragas_embeddings():
     
     if provider == "openai":
         logger.info(f"Creating RAGAS OpenAI embeddings: {config.RAGAS_EMBEDDING_MODEL}")
-        return OpenAIEmbeddings(model=config.RAGAS_EMBEDDING_MODEL)
+        return with_cache(OpenAIEmbeddings(model=config.RAGAS_EMBEDDING_MODEL), provider, config.RAGAS_EMBEDDING_MODEL)
     
     elif provider == "huggingface":
         logger.info(f"Creating RAGAS HuggingFace embeddings: {config.RAGAS_HUGGINGFACE_EMBEDDING_MODEL} on {config.RAGAS_HUGGINGFACE_DEVICE}")
-        return HuggingFaceEmbeddings(
+        embeddings = HuggingFaceEmbeddings(
             model_name=config.RAGAS_HUGGINGFACE_EMBEDDING_MODEL,
             model_kwargs={'device': config.RAGAS_HUGGINGFACE_DEVICE},
             encode_kwargs={'normalize_embeddings': True}
         )
+        return with_cache(embeddings, provider, config.RAGAS_HUGGINGFACE_EMBEDDING_MODEL)
     
     else:
         raise ValueError(f"Unknown RAGAS embedding provider: {provider}. Use 'openai' or 'huggingface'")
@@ -89,7 +96,7 @@ def init_ragas_metrics():
     
     # Настройки для выполнения
     run_config = RunConfig(
-        max_workers=4,
+        max_workers=config.EVALUATION_MAX_CONCURRENCY,
         max_wait=180,
         max_retries=3
     )
@@ -129,7 +136,8 @@ def check_dataset_exists(dataset_name: str) -> bool:
         logger.error(f"Error checking dataset: {e}")
         return False
 
-def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]:
+def evaluate_dataset(dataset_name: Optional[str] = None, max_concurrency: Optional[int] = None,
+                     on_progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
     """
     Главная функция evaluation RAG системы
     
@@ -138,19 +146,38 @@ def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]:
     2. RAGAS batch evaluation
     3. Загрузка метрик как feedback в LangSmith
     
+    Функция синхронная и долгая: из бота вызывается в отдельном потоке (asyncio.to_thread).
+    Примеры датасета прогоняются через RAG цепочку параллельно (max_concurrency потоков).
+    
     Args:
         dataset_name: имя датасета (по умолчанию из конфига)
+        max_concurrency: одновременно выполняемых примеров (по умолчанию EVALUATION_MAX_CONCURRENCY)
+        on_progress: callback (stage, done, total) о ходе evaluation, stage: experiment / ragas / feedback;
+            вызывается из потоков evaluation
     
     Returns:
         dict с результатами evaluation
     """
+    if not evaluation_lock.acquire(blocking=False):
+        raise ValueError("Evaluation is already running")
+    try:
+        return run_evaluation(dataset_name, max_concurrency, on_progress)
+    finally:
+        evaluation_lock.release()
+
+def run_evaluation(dataset_name: Optional[str] = None, max_concurrency: Optional[int] = None,
+                   on_progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
+    """Evaluation как в evaluate_dataset, но без захвата evaluation_lock (его уже держит вызывающий)"""
     if not config.LANGSMITH_API_KEY:
         raise ValueError("LANGSMITH_API_KEY not set. Cannot run evaluation.")
-    
-    if dataset_name is None:
-        dataset_name = config.LANGSMITH_DATASET
-    
-    logger.info(f"Starting evaluation for dataset: {dataset_name}")
+    return _evaluate_dataset(
+        dataset_name or config.LANGSMITH_DATASET,
+        max_concurrency or config.EVALUATION_MAX_CONCURRENCY,
+        on_progress or (lambda stage, done, total: None),
+    )
+
+def _evaluate_dataset(dataset_name: str, max_concurrency: int, on_progress: Callable[[str, int, int], None]) -> Dict[str, Any]:
+    logger.info(f"Starting evaluation for dataset: {dataset_name} (max_concurrency={max_concurrency})")
     
     # Проверяем существование датасета
     if not check_dataset_exists(dataset_name):
@@ -160,19 +187,22 @@ def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]:
     ragas_metrics, ragas_run_config = init_ragas_metrics()
     
     client = Client()
+    total = sum(1 for _ in client.list_examples(dataset_name=dataset_name))
     
     # ========== Шаг 1: Запуск эксперимента и сбор данных ==========
     logger.info("\n[1/3] Running experiment and collecting data...")
+    on_progress("experiment", 0, total)
     
-    # Создаем target функцию для нашего RAG
+    # Используем уже собранную RAG цепочку (одна на все вопросы датасета)
+    rag_chain = rag.rag_chain or rag.get_rag_chain()
+    
+    # Создаем target функцию для нашего RAG (LangSmith вызывает ее из max_concurrency потоков)
     def target(inputs: dict) -> dict:
         """Target функция для evaluation"""
         question = inputs["question"]
         
-        # Используем существующую RAG цепочку
         # Передаем только вопрос (без истории для evaluation)
-        from langchain_core.messages import HumanMessage
-        result = rag.get_rag_chain().invoke({"messages": [HumanMessage(content=question)]})
+        result = rag_chain.invoke({"messages": [HumanMessage(content=question)]})
         
         return {
             "answer": result["answer"],
@@ -198,6 +228,7 @@ def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]:
             "embedding_model": config.EMBEDDING_MODEL,
         },
         blocking=False,
+        max_concurrency=max_concurrency,
     ):
         run = result["run"]
         example = result["example"]
@@ -214,11 +245,13 @@ def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]:
         contexts_list.append(contexts)
         ground_truths.append(ground_truth)
         run_ids.append(str(run.id))
+        on_progress("experiment", len(questions), total)
     
     logger.info(f"Experiment completed, collected {len(questions)} examples")
     
     # ========== Шаг 2: RAGAS evaluation ==========
     logger.info("\n[2/3] Running RAGAS evaluation...")
+    on_progress("ragas", 0, len(questions))
     
     # Создаем Dataset для RAGAS
     ragas_dataset = Dataset.from_dict({
@@ -249,20 +282,25 @@ def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]:
     
     # ========== Шаг 3: Загрузка feedback в LangSmith ==========
     logger.info("\n[3/3] Uploading feedback to LangSmith...")
+    on_progress("feedback", 0, len(run_ids))
     
-    for idx, run_id in enumerate(run_ids):
+    def upload_feedback(idx: int):
         row = ragas_df.iloc[idx]
         
         for metric in ragas_metrics:
             if metric.name in row:
                 score = row[metric.name]
                 client.create_feedback(
-                    run_id=run_id,
+                    run_id=run_ids[idx],
                     key=metric.name,
                     score=float(score),
                     comment=f"RAGAS metric: {metric.name}"
                 )
     
+    # Feedback - отдельные HTTP запросы, отправляем их параллельно
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        list(executor.map(upload_feedback, range(len(run_ids))))
+    
     logger.info(f"Feedback uploaded ({len(run_ids)} runs)")
     
     return {
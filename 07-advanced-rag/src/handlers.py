@@ -1,27 +1,46 @@
+import asyncio
 import logging
+import time
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage, AIMessage
 from config import config
 import indexer
 import rag
 import evaluation
+import warmup
+from streaming import StreamingMessage
+from history import HistoryStore
+from conversation_store import SQLiteConversationStore
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-# Глобальный словарь для хранения историй диалогов в формате LangChain Messages
-chat_conversations: dict[int, list] = {}
+# Истории диалогов в формате LangChain Messages (ограничены по размеру и времени жизни).
+# Создается в bot.main(), а не при импорте: процессы индексации (spawn) импортируют модуль бота
+# заново и не должны запускать свой поток SQLite
+history_store: HistoryStore = None
+
+def create_history_store() -> HistoryStore:
+    """Создание хранилища историй диалогов по настройкам (с SQLite backend при HISTORY_BACKEND=sqlite)"""
+    global history_store
+    history_store = HistoryStore(
+        max_turns=config.HISTORY_MAX_TURNS,
+        max_tokens=config.HISTORY_MAX_TOKENS,
+        idle_ttl_s=config.HISTORY_IDLE_TTL_S,
+        max_chats=config.HISTORY_MAX_CHATS,
+        summarize=rag.summarize_history if config.HISTORY_SUMMARY_ENABLED else None,
+        backend=SQLiteConversationStore(config.HISTORY_DB_PATH) if config.HISTORY_BACKEND == "sqlite" else None,
+    )
+    return history_store
 
 @router.message(Command("start"))
 async def cmd_start(message: Message):
     logger.info(f"User {message.chat.id} started the bot")
     
-    # Инициализируем историю с системным промптом в LangChain формате
-    chat_conversations[message.chat.id] = [
-        SystemMessage(content=config.SYSTEM_PROMPT)
-    ]
+    # Начинаем диалог заново
+    await history_store.reset(message.chat.id)
     
     await message.answer(
         "Привет! Я RAG-ассистент Сбербанка.\n\n"
@@ -41,7 +60,8 @@ async def cmd_help(message: Message):
         "*Доступные команды:*\n"
         "/start \\- Начать новый диалог\n"
         "/help \\- Показать эту справку\n"
-        "/index \\- Переиндексировать документы\n"
+        "/index \\- Переиндексировать новые и измененные документы\n"
+        "/index full \\- Полная переиндексация\n"
         "/index\\_status \\- Статус и конфигурация\n"
         "/evaluate\\_dataset \\- Оценить качество RAG\n\n"
         "*🔍 Режимы Retrieval:*\n"
@@ -65,27 +85,94 @@ async def cmd_help(message: Message):
     )
     await message.answer(help_text, parse_mode="MarkdownV2")
 
+# Сообщения о ходе фоновой переиндексации по стадиям indexer.reindex_all
+REINDEX_STAGES = {
+    "files": "разбор новых и измененных файлов",
+    "file_loaded": "разбор файлов",
+    "embedding": "вычисление embeddings",
+    "saving": "сохранение индекса",
+    "search_indexes": "построение индексов поиска",
+    "loading": "загрузка нового индекса",
+}
+# Не чаще одной правки сообщения о прогрессе в секунду (лимиты Telegram)
+REINDEX_PROGRESS_INTERVAL_S = 1.0
+
+def _format_reindex_progress(stage: str, info: dict, loaded_files: int, total_files: int) -> str:
+    text = f"⏳ Переиндексация: {REINDEX_STAGES.get(stage, stage)}"
+    if stage == "files":
+        text += (
+            f"\nФайлы: новых {info['added']}, изменено {info['changed']}, "
+            f"удалено {info['removed']}, без изменений {info['unchanged']}"
+        )
+    elif stage == "file_loaded":
+        text += f" ({loaded_files} из {total_files})"
+    elif stage == "embedding":
+        text += f" ({info['chunks']} чанков)"
+    text += "\n\nБот продолжает отвечать по текущему индексу."
+    return text
+
 @router.message(Command("index"))
 async def cmd_index(message: Message):
     logger.info(f"User {message.chat.id} requested reindexing")
-    await message.answer("Начинаю переиндексацию документов...")
+    
+    if indexer.reindex_running:
+        await message.answer("⏳ Переиндексация уже выполняется, дождитесь ее завершения.")
+        return
+    
+    # /index full - полная переиндексация без переиспользования embeddings
+    command_parts = message.text.split(maxsplit=1)
+    force = len(command_parts) > 1 and command_parts[1].strip().lower() == "full"
+    status = await message.answer(
+        "Начинаю полную переиндексацию документов..." if force
+        else "Начинаю переиндексацию документов (только новые и измененные файлы)..."
+    )
+    
+    progress = {"files": 0, "loaded": 0, "edited_at": 0.0}
+    
+    async def on_progress(stage: str, info: dict):
+        if stage == "files":
+            progress["files"] = info["added"] + info["changed"]
+        elif stage == "file_loaded":
+            progress["loaded"] += 1
+            if time.monotonic() - progress["edited_at"] < REINDEX_PROGRESS_INTERVAL_S:
+                return
+        progress["edited_at"] = time.monotonic()
+        try:
+            await status.edit_text(_format_reindex_progress(stage, info, progress["loaded"], progress["files"]))
+        except Exception as e:
+            logger.debug(f"Skipped reindex progress update: {e}")
     
     try:
-        result = await indexer.reindex_all()
-        if result and result[0] is not None:
-            rag.vector_store, rag.chunks = result
-            rag.initialize_retriever()
+        # Индекс строится в отдельном процессе, бот отвечает по старому индексу до переключения
+        embeddings = rag.vector_store.embeddings if rag.vector_store is not None else None
+        result = await indexer.reindex_in_background(force=force, on_progress=on_progress, embeddings=embeddings)
+        if result is not None:
+            vector_store, chunks = result
+            built = await asyncio.to_thread(rag.build_retriever_chains, vector_store, chunks)
+            rag.activate_index(vector_store, chunks, built)
             stats = rag.get_vector_store_stats()
+            report = indexer.last_report or {}
             await message.answer(
                 f"✅ Переиндексация завершена!\n"
                 f"Проиндексировано документов: {stats['count']}\n"
                 f"Режим: {stats['retrieval_mode']}\n"
-                f"Провайдер: {stats['embedding_provider']}"
+                f"Провайдер: {stats['embedding_provider']}\n\n"
+                f"Файлы: новых {len(report.get('added', []))}, "
+                f"изменено {len(report.get('changed', []))}, "
+                f"удалено {len(report.get('removed', []))}, "
+                f"без изменений {len(report.get('unchanged', []))}\n"
+                f"Embeddings: вычислено {report.get('embedded_chunks', 0)}, "
+                f"переиспользовано {report.get('reused_chunks', 0)}\n"
+                f"Время: {report.get('duration_s', 0)} с"
+                + (
+                    f"\nСкорость embeddings: {report['embedding']['chunks_per_s']} чанков/с"
+                    if report.get("embedding") else ""
+                )
             )
         else:
             await message.answer("⚠️ Не найдено документов для индексации")
     except Exception as e:
-        logger.error(f"Error during reindexing: {e}")
+        logger.error(f"Error during reindexing: {e}", exc_info=True)
         await message.answer(f"❌ Ошибка при переиндексации: {str(e)}")
 
 @router.message(Command("index_status"))
@@ -104,6 +191,8 @@ async def cmd_index_status(message: Message):
         f"Документов: {stats['count']}\n\n"
         f"🔍 *Retrieval: {stats['retrieval_mode']}*\n"
     )
+    if indexer.reindex_running:
+        status_text += "⏳ Идет переиндексация, ответы по текущему индексу\n"
     
     # Параметры в зависимости от режима
     if stats['retrieval_mode'] == 'semantic':
@@ -119,9 +208,67 @@ async def cmd_index_status(message: Message):
             f"• Semantic k: {stats.get('semantic_k', 'N/A')}\n"
             f"• BM25 k: {stats.get('bm25_k', 'N/A')}\n"
             f"• Reranker top k: {stats.get('reranker_top_k', 'N/A')}\n"
-            f"• Cross-encoder: {stats.get('cross_encoder_model', 'N/A').split('/')[-1]}\n"
+            f"• Cross-encoder: {stats.get('cross_encoder_model', 'N/A').split('/')[-1]} "
+            f"(`{stats.get('cross_encoder_backend', 'torch')}`)\n"
+        )
+    
+    decisions = stats.get("query_transform") or {}
+    if decisions:
+        rewritten = decisions.get("rewritten", 0)
+        total = sum(decisions.values())
+        status_text += (
+            f"• Трансформация запроса ({stats['query_transform_mode']}): "
+            f"LLM в {rewritten} из {total} запросов\n"
+        )
+    
+    timings = stats.get("hybrid_timings")
+    if timings and timings["queries"]:
+        status_text += (
+            f"• Слияние: {stats.get('fusion', 'N/A')}\n"
+            f"• Поиск (среднее за {timings['queries']} запр.): semantic {timings['avg_semantic_ms']}мс, "
+            f"BM25 {timings['avg_bm25_ms']}мс, слияние {timings['avg_fusion_ms']}мс, "
+            f"всего {timings['avg_total_ms']}мс\n"
+        )
+    
+    reranker = stats.get("reranker")
+    if reranker and reranker["batches"]:
+        status_text += (
+            f"• Reranker: {reranker['requests']} запр. в {reranker['batches']} батчах "
+            f"(~{reranker['avg_batch_pairs']} пар), ожидание {reranker['avg_wait_ms']}мс, "
+            f"модель {reranker['avg_predict_ms']}мс\n"
+        )
+    
+    rerank_cache = stats.get("rerank_cache")
+    if rerank_cache:
+        status_text += (
+            f"• Кеш reranker: {rerank_cache['hit_rate'] * 100:.0f}% попаданий "
+            f"({rerank_cache['hits']}/{rerank_cache['hits'] + rerank_cache['misses']}), "
+            f"записей {rerank_cache['entries']}\n"
         )
     
+    packing = stats.get("context_packing")
+    if packing and packing["contexts"]:
+        status_text += (
+            f"• Контекст (бюджет {stats['context_max_tokens']} ток.): "
+            f"{packing['token_ratio'] * 100:.0f}% токенов чанков, "
+            f"дублей {packing['duplicates']}, склеено {packing['merged']}, отброшено {packing['dropped']}\n"
+        )
+    
+    answer_cache = stats.get("answer_cache")
+    if answer_cache:
+        status_text += (
+            f"• Кеш ответов: {answer_cache['hit_rate'] * 100:.0f}% попаданий "
+            f"({answer_cache['hits']}/{answer_cache['hits'] + answer_cache['misses']}), "
+            f"записей {answer_cache['entries']}\n"
+        )
+    
+    stage_timings = stats.get("stage_timings")
+    if stage_timings:
+        # Имена этапов в `...`: подчеркивания в них ломают разметку Markdown
+        status_text += "• Этапы (среднее): " + ", ".join(
+            f"`{stage}` {timing['avg_ms']}мс" for stage, timing in stage_timings.items()
+        ) + "\n"
+    
     # Информация об embeddings
     status_text += f"\n🧬 *Embeddings: {stats['embedding_provider']}*\n"
     if stats['embedding_provider'] == 'openai':
@@ -132,8 +279,32 @@ async def cmd_index_status(message: Message):
             f"• Устройство: {stats.get('device', 'N/A')}\n"
         )
     
+    # Размер хранилища историй диалогов
+    history = history_store.get_stats()
+    status_text += (
+        f"\n💬 Диалоги: {history['chats']} (сообщений {history['messages']}, "
+        f"~{history['tokens']} ток., {history['text_kb']} КБ), "
+        f"вытеснено сообщений {history['trimmed_messages']}, чатов {history['evicted_chats']}\n"
+    )
+    
+    # Готовность моделей (фоновый прогрев при старте)
+    warmup_status = warmup.get_status()
+    if warmup_status["ready"]:
+        status_text += "\n✅ Модели готовы\n"
+    else:
+        models = ", ".join(f"{name.replace('_', '-')}: {status}" for name, status in warmup_status["models"].items())
+        status_text += f"\n⏳ Модели прогреваются ({models or 'ожидание'})\n"
+    
     await message.answer(status_text, parse_mode="Markdown")
 
+# Сообщения о ходе evaluation по стадиям evaluation.evaluate_dataset
+EVALUATION_STAGES = {
+    "experiment": "Шаг 1/3: Прогон примеров через RAG",
+    "ragas": "Шаг 2/3: Вычисление RAGAS метрик",
+    "feedback": "Шаг 3/3: Загрузка feedback в LangSmith",
+}
+EVALUATION_PROGRESS_INTERVAL_S = 2.0
+
 @router.message(Command("evaluate_dataset"))
 async def cmd_evaluate_dataset(message: Message):
     logger.info(f"User {message.chat.id} requested dataset evaluation")
@@ -154,26 +325,53 @@ async def cmd_evaluate_dataset(message: Message):
         )
         return
     
-    # Извлекаем название датасета из команды (опционально)
-    command_parts = message.text.split(maxsplit=1)
-    dataset_name = command_parts[1] if len(command_parts) > 1 else None
-    
-    if dataset_name is None:
-        dataset_name = config.LANGSMITH_DATASET
-        await message.answer(
-            f"🔍 Начинаю evaluation датасета: {dataset_name}\n\n"
-            f"Это может занять несколько минут...\n"
-            f"Шаг 1/3: Запуск эксперимента в LangSmith..."
-        )
-    else:
-        await message.answer(
-            f"🔍 Начинаю evaluation датасета: {dataset_name}\n\n"
-            f"Это может занять несколько минут..."
-        )
+    # Захват без ожидания: event loop не блокируется, повторный запуск сразу получает отказ
+    if not evaluation.evaluation_lock.acquire(blocking=False):
+        await message.answer("⏳ Evaluation уже выполняется, дождитесь ее завершения.")
+        return
     
     try:
-        # Запускаем evaluation
-        result = evaluation.evaluate_dataset(dataset_name)
+        # Извлекаем название датасета из команды (опционально)
+        command_parts = message.text.split(maxsplit=1)
+        dataset_name = command_parts[1] if len(command_parts) > 1 else None
+    
+        if dataset_name is None:
+            dataset_name = config.LANGSMITH_DATASET
+            status = await message.answer(
+                f"🔍 Начинаю evaluation датасета: {dataset_name}\n\n"
+                f"Это может занять несколько минут...\n"
+                f"Шаг 1/3: Запуск эксперимента в LangSmith..."
+            )
+        else:
+            status = await message.answer(
+                f"🔍 Начинаю evaluation датасета: {dataset_name}\n\n"
+                f"Это может занять несколько минут..."
+            )
+    
+        loop = asyncio.get_running_loop()
+        progress = {"edited_at": 0.0}
+    
+        async def edit_status(text: str):
+            try:
+                await status.edit_text(text)
+            except Exception as e:
+                logger.debug(f"Skipped evaluation progress update: {e}")
+    
+        def on_progress(stage: str, done: int, total: int):
+            # Вызывается из потоков evaluation - правка сообщения планируется в event loop бота
+            if stage == "experiment" and 0 < done < total:
+                if time.monotonic() - progress["edited_at"] < EVALUATION_PROGRESS_INTERVAL_S:
+                    return
+            progress["edited_at"] = time.monotonic()
+            text = (
+                f"🔍 Evaluation датасета: {dataset_name}\n\n"
+                f"{EVALUATION_STAGES[stage]}"
+                + (f": {done} из {total}" if stage == "experiment" else f" ({total} примеров)")
+            )
+            asyncio.run_coroutine_threadsafe(edit_status(text), loop)
+    
+        # Evaluation синхронная и долгая - в отдельном потоке, бот продолжает отвечать
+        result = await asyncio.to_thread(evaluation.run_evaluation, dataset_name, on_progress=on_progress)
         
         # Формируем отчет
         metrics = result["metrics"]
@@ -221,6 +419,33 @@ async def cmd_evaluate_dataset(message: Message):
             f"❌ Произошла ошибка при evaluation:\n{str(e)}\n\n"
             f"Проверьте логи для подробностей."
         )
+    finally:
+        evaluation.evaluation_lock.release()
+
+async def _stream_answer(message: Message, history: list):
+    """
+    Потоковая генерация ответа с постепенным редактированием сообщения
+    
+    Returns:
+        tuple: (answer, documents, StreamingMessage) - финальный текст еще не показан
+    """
+    await message.bot.send_chat_action(message.chat.id, "typing")
+    stream = StreamingMessage(message, config.STREAM_EDIT_INTERVAL_S)
+    started_at = time.monotonic()
+    documents = []
+    answer = ""
+    async for kind, value in rag.rag_answer_stream(history, chat_id=message.chat.id):
+        if kind == "documents":
+            documents = value
+        else:
+            answer += value
+            await stream.update(answer)
+    if stream.first_token_at is not None:
+        logger.info(
+            f"Streamed answer for chat {message.chat.id}: first token in "
+            f"{stream.first_token_at - started_at:.2f}s, {stream.edits} edits"
+        )
+    return answer, documents, stream
 
 @router.message()
 async def handle_message(message: Message):
@@ -231,16 +456,8 @@ async def handle_message(message: Message):
     
     logger.info(f"Message from {message.chat.id}: {message.text[:100]}...")
     
-    # Инициализируем историю если её нет
-    if message.chat.id not in chat_conversations:
-        chat_conversations[message.chat.id] = [
-            SystemMessage(content=config.SYSTEM_PROMPT)
-        ]
-    
     # Добавляем сообщение пользователя в историю
-    chat_conversations[message.chat.id].append(
-        HumanMessage(content=message.text)
-    )
+    await history_store.append(message.chat.id, HumanMessage(content=message.text))
     
     try:
         # Проверка инициализации векторного хранилища
@@ -251,19 +468,21 @@ async def handle_message(message: Message):
                 "Пожалуйста, подождите или используйте /index для индексации."
             )
             # Удаляем последнее сообщение из истории
-            chat_conversations[message.chat.id].pop()
+            await history_store.pop(message.chat.id)
             return
         
-        # Получаем ответ через RAG (передаем историю без system message)
-        # Теперь возвращает dict с answer и documents
-        result = await rag.rag_answer(chat_conversations[message.chat.id][1:])
-        answer = result["answer"]
-        documents = result["documents"]
+        # Получаем ответ через RAG (история с кратким содержанием старых сообщений)
+        history = await history_store.get_messages(message.chat.id)
+        stream = None
+        if config.STREAMING_ENABLED:
+            answer, documents, stream = await _stream_answer(message, history)
+        else:
+            result = await rag.rag_answer(history, chat_id=message.chat.id)
+            answer = result["answer"]
+            documents = result["documents"]
         
         # Добавляем ответ в историю
-        chat_conversations[message.chat.id].append(
-            AIMessage(content=answer)
-        )
+        await history_store.append(message.chat.id, AIMessage(content=answer))
         
         # Формируем итоговый ответ с источниками если включено
         final_response = answer
@@ -272,12 +491,18 @@ async def handle_message(message: Message):
             if sources:
                 final_response = f"{answer}\n\n{sources}"
         
-        await message.answer(final_response)
+        if stream is not None:
+            await stream.finish(final_response)
+        else:
+            await message.answer(final_response)
+        
+        # Лимиты истории применяем после ответа (сворачивание может вызывать LLM)
+        await history_store.compact(message.chat.id)
         
     except ValueError as e:
         logger.error(f"ValueError in handle_message for chat {message.chat.id}: {e}")
         # Удаляем последнее сообщение из истории
-        chat_conversations[message.chat.id].pop()
+        await history_store.pop(message.chat.id)
         await message.answer(
             "⚠️ Векторное хранилище не готово. "
             "Используйте /index для индексации документов."
@@ -285,7 +510,7 @@ async def handle_message(message: Message):
     except Exception as e:
         logger.error(f"Error in handle_message for chat {message.chat.id}: {e}", exc_info=True)
         # Удаляем последнее сообщение из истории
-        chat_conversations[message.chat.id].pop()
+        await history_store.pop(message.chat.id)
         await message.answer(
             "Произошла ошибка при обработке вашего сообщения. "
             "Попробуйте еще раз или используйте /start для начала нового диалога."
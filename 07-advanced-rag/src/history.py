@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Как часто искать простаивающие диалоги (секунды)
+EVICTION_INTERVAL_S = 60
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога:\n"
+
+MESSAGE_TYPES = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+
+class ChatHistory:
+    """История одного чата: последние сообщения и сжатое содержание более старых"""
+
+    def __init__(self):
+        self.messages = []
+        self.summary = ""
+        self.tokens = 0
+        self.last_active = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def get_messages(self) -> list:
+        if not self.summary:
+            return list(self.messages)
+        return [SystemMessage(content=SUMMARY_PREFIX + self.summary)] + self.messages
+
+class HistoryStore:
+    """
+    Ограниченное хранилище историй диалогов по chat_id
+
+    История чата ограничена max_turns реплик пользователя и max_tokens токенов:
+    самые старые сообщения вытесняются (при заданном summarize - сворачиваются
+    в краткое содержание). Диалоги без активности дольше idle_ttl_s удаляются,
+    при превышении max_chats удаляются давно неактивные.
+
+    Args:
+        max_turns: максимум реплик пользователя (с ответами) в истории
+        max_tokens: максимум токенов сообщений истории
+        idle_ttl_s: время жизни неактивного диалога (0 - без ограничения)
+        max_chats: максимум хранимых диалогов
+        summarize: async (summary, messages) -> новое summary; None - старые сообщения просто удаляются
+        backend: постоянное хранилище (SQLiteConversationStore); в памяти остаются
+            только активные диалоги, вытесненные загружаются из backend при следующем сообщении
+    """
+
+    def __init__(self, max_turns: int, max_tokens: int, idle_ttl_s: float, max_chats: int,
+                 summarize=None, backend=None):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.idle_ttl_s = idle_ttl_s
+        self.max_chats = max_chats
+        self.summarize = summarize
+        self.backend = backend
+        self.evicted_chats = 0
+        self.trimmed_messages = 0
+        self._chats = OrderedDict()
+        self._last_eviction = time.monotonic()
+
+    async def _get(self, chat_id: int) -> ChatHistory:
+        self._evict_idle()
+        history = self._chats.get(chat_id)
+        if history is None:
+            history = ChatHistory()
+            if self.backend is not None:
+                await self._load(chat_id, history)
+            # Пока шла загрузка, чат мог появиться из другого сообщения
+            history = self._chats.setdefault(chat_id, history)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+                self.evicted_chats += 1
+        history.last_active = time.monotonic()
+        self._chats.move_to_end(chat_id)
+        return history
+
+    async def _load(self, chat_id: int, history: ChatHistory):
+        """Загрузка истории чата из backend (после рестарта или вытеснения из памяти)"""
+        rows = await self.backend.get_messages(chat_id, limit=self.max_turns * 2)
+        history.messages = [MESSAGE_TYPES[row["role"]](content=row["content"]) for row in rows]
+        history.tokens = sum(estimate_tokens(message.content) for message in history.messages)
+        history.summary = await self.backend.get_summary(chat_id)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        if not self.idle_ttl_s or now - self._last_eviction < EVICTION_INTERVAL_S:
+            return
+        self._last_eviction = now
+        # OrderedDict упорядочен по активности - неактивные в начале
+        while self._chats:
+            chat_id, history = next(iter(self._chats.items()))
+            if now - history.last_active <= self.idle_ttl_s:
+                break
+            del self._chats[chat_id]
+            self.evicted_chats += 1
+
+    async def reset(self, chat_id: int):
+        """Начать диалог заново"""
+        self._chats.pop(chat_id, None)
+        if self.backend is not None:
+            await self.backend.clear(chat_id)
+
+    async def append(self, chat_id: int, message):
+        history = await self._get(chat_id)
+        history.messages.append(message)
+        history.tokens += estimate_tokens(message.content)
+        if self.backend is not None:
+            await self.backend.add_message(chat_id, message.type, message.content)
+
+    async def pop(self, chat_id: int):
+        """Удаление последнего сообщения (откат реплики при ошибке ответа)"""
+        history = self._chats.get(chat_id)
+        if history is not None and history.messages:
+            history.tokens -= estimate_tokens(history.messages.pop().content)
+            if self.backend is not None:
+                await self.backend.delete_last(chat_id)
+
+    async def get_messages(self, chat_id: int) -> list:
+        """Сообщения для цепочек RAG: краткое содержание (SystemMessage) + последние сообщения"""
+        return (await self._get(chat_id)).get_messages()
+
+    def _take_overflow(self, history: ChatHistory) -> list:
+        """Вынимает самые старые сообщения сверх лимитов (история начинается с реплики пользователя)"""
+        def turns() -> int:
+            return sum(1 for message in history.messages if message.type == "human")
+
+        dropped = []
+        # Последнюю пару (вопрос + ответ) не трогаем, даже если она больше лимита
+        while len(history.messages) > 2 and (turns() > self.max_turns or history.tokens > self.max_tokens):
+            dropped.append(history.messages.pop(0))
+            while len(history.messages) > 2 and history.messages[0].type != "human":
+                dropped.append(history.messages.pop(0))
+        history.tokens -= sum(estimate_tokens(message.content) for message in dropped)
+        return dropped
+
+    async def compact(self, chat_id: int):
+        """Применение лимитов к истории чата (после ответа, чтобы не задерживать его)"""
+        history = self._chats.get(chat_id)
+        if history is None:
+            return
+        async with history.lock:
+            dropped = self._take_overflow(history)
+            if not dropped:
+                return
+            self.trimmed_messages += len(dropped)
+            if self.backend is not None:
+                await self.backend.trim(chat_id, keep=len(history.messages))
+            if self.summarize is None:
+                return
+            try:
+                history.summary = await self.summarize(history.summary, dropped)
+            except Exception as e:
+                logger.warning(f"History summarization failed for chat {chat_id}: {e}")
+                return
+            if self.backend is not None:
+                await self.backend.set_summary(chat_id, history.summary)
+
+    def get_stats(self) -> dict:
+        """Размер хранилища: число диалогов, сообщений, токенов и объем текста"""
+        histories = list(self._chats.values())
+        text_bytes = sum(
+            len(history.summary.encode()) + sum(len(message.content.encode()) for message in history.messages)
+            for history in histories
+        )
+        return {
+            "chats": len(histories),
+            "messages": sum(len(history.messages) for history in histories),
+            "tokens": sum(history.tokens for history in histories),
+            "text_kb": round(text_bytes / 1024, 1),
+            "summarized_chats": sum(1 for history in histories if history.summary),
+            "trimmed_messages": self.trimmed_messages,
+            "evicted_chats": self.evicted_chats,
+        }
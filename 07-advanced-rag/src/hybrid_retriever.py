@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import PrivateAttr
+from bm25_index import BM25Index
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Пул для синхронного вызова: обе ветки поиска выполняются параллельно
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid")
+
+def rrf_fusion(legs: list, weights: list, rrf_k: int) -> list:
+    """
+    Reciprocal Rank Fusion: score = sum(weight / (rrf_k + rank))
+
+    Args:
+        legs: результаты веток [(Document, score), ...] по убыванию score
+    """
+    fused = {}
+    for results, weight in zip(legs, weights):
+        for rank, (doc, _) in enumerate(results, 1):
+            entry = fused.setdefault(doc.id, [doc, 0.0])
+            entry[1] += weight / (rrf_k + rank)
+    return sorted(fused.values(), key=lambda item: item[1], reverse=True)
+
+def weighted_fusion(legs: list, weights: list) -> list:
+    """Взвешенная сумма scores веток после min-max нормализации каждой ветки в [0, 1]"""
+    fused = {}
+    for results, weight in zip(legs, weights):
+        if not results:
+            continue
+        scores = [score for _, score in results]
+        low, high = min(scores), max(scores)
+        for doc, score in results:
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            entry = fused.setdefault(doc.id, [doc, 0.0])
+            entry[1] += weight * normalized
+    return sorted(fused.values(), key=lambda item: item[1], reverse=True)
+
+class HybridRetriever(BaseRetriever):
+    """
+    Гибридный retriever: semantic + BM25 с собственным слиянием результатов
+
+    Ветки выполняются параллельно: в async режиме embedding запроса ожидается
+    в event loop, а CPU-bound поиск по матрице и BM25 уходит в потоки.
+    Время каждой ветки и слияния копится в статистике (get_stats).
+    """
+
+    vector_store: object
+    bm25_index: BM25Index
+    documents: list
+    semantic_k: int = 10
+    bm25_k: int = 10
+    semantic_weight: float = 0.5
+    bm25_weight: float = 0.5
+    fusion: str = "rrf"
+    rrf_k: int = 60
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    _stats: dict = PrivateAttr(default_factory=lambda: {
+        "queries": 0, "semantic_ms": 0.0, "bm25_ms": 0.0, "fusion_ms": 0.0, "total_ms": 0.0,
+    })
+    _stats_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _semantic_search_by_vector(self, embedding: list):
+        started_at = time.perf_counter()
+        results = self.vector_store.similarity_search_with_score_by_vector(embedding, self.semantic_k)
+        return results, time.perf_counter() - started_at
+
+    def _semantic_search(self, query: str):
+        started_at = time.perf_counter()
+        results, _ = self._semantic_search_by_vector(self.vector_store.embeddings.embed_query(query))
+        return results, time.perf_counter() - started_at
+
+    def _bm25_search(self, query: str):
+        started_at = time.perf_counter()
+        doc_ids, scores = self.bm25_index.search(query, self.bm25_k)
+        results = [(self.documents[doc_id], float(score)) for doc_id, score in zip(doc_ids, scores)]
+        return results, time.perf_counter() - started_at
+
+    def _fuse(self, semantic: list, bm25: list, timings: dict, started_at: float) -> list[Document]:
+        fusion_started_at = time.perf_counter()
+        legs = [semantic, bm25]
+        weights = [self.semantic_weight, self.bm25_weight]
+        if self.fusion == "weighted":
+            fused = weighted_fusion(legs, weights)
+        else:
+            fused = rrf_fusion(legs, weights, self.rrf_k)
+        timings["fusion"] = time.perf_counter() - fusion_started_at
+        timings["total"] = time.perf_counter() - started_at
+        self._record(timings)
+        return [doc for doc, _ in fused]
+
+    def _record(self, timings: dict):
+        with self._stats_lock:
+            self._stats["queries"] += 1
+            for leg, seconds in timings.items():
+                self._stats[f"{leg}_ms"] += seconds * 1000
+        # Ветки поиска - отдельными спанами в метриках запроса (total уже есть как retrieval)
+        for leg in ("semantic", "bm25", "fusion"):
+            metrics.record(f"retrieval_{leg}", timings[leg])
+        logger.info(
+            "Hybrid retrieval: " + ", ".join(f"{leg}={seconds * 1000:.1f}ms" for leg, seconds in timings.items())
+        )
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        started_at = time.perf_counter()
+        semantic_future = _executor.submit(self._semantic_search, query)
+        bm25_future = _executor.submit(self._bm25_search, query)
+        semantic, semantic_time = semantic_future.result()
+        bm25, bm25_time = bm25_future.result()
+        return self._fuse(semantic, bm25, {"semantic": semantic_time, "bm25": bm25_time}, started_at)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> list[Document]:
+        started_at = time.perf_counter()
+
+        async def semantic_leg():
+            leg_started_at = time.perf_counter()
+            embedding = await self.vector_store.embeddings.aembed_query(query)
+            results, _ = await asyncio.to_thread(self._semantic_search_by_vector, embedding)
+            return results, time.perf_counter() - leg_started_at
+
+        (semantic, semantic_time), (bm25, bm25_time) = await asyncio.gather(
+            semantic_leg(),
+            asyncio.to_thread(self._bm25_search, query),
+        )
+        return self._fuse(semantic, bm25, {"semantic": semantic_time, "bm25": bm25_time}, started_at)
+
+    def get_stats(self) -> dict:
+        """Средняя длительность веток, слияния и всего поиска (мс)"""
+        with self._stats_lock:
+            queries = self._stats["queries"]
+            stats = {"queries": queries}
+            for key, value in self._stats.items():
+                if key.endswith("_ms"):
+                    stats[f"avg_{key}"] = round(value / queries, 2) if queries else 0.0
+        return stats
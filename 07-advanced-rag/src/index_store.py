@@ -0,0 +1,246 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+import numpy as np
+from langchain_core.documents import Document
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Версия формата индекса на диске (при изменении формата старые индексы игнорируются)
+INDEX_FORMAT_VERSION = 2
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.jsonl"
+META_FILE = "meta.json"
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+
+# Сколько версий индекса хранить на диске (текущая + предыдущие)
+KEEP_VERSIONS = 2
+
+def get_embedding_model_name() -> str:
+    """Имя embedding модели для текущего провайдера"""
+    if config.EMBEDDING_PROVIDER == "huggingface":
+        return config.HUGGINGFACE_EMBEDDING_MODEL
+    return config.EMBEDDING_MODEL
+
+def get_model_key() -> str:
+    """Ключ индекса по провайдеру и модели embeddings (безопасный для имени директории)"""
+    raw = f"{config.EMBEDDING_PROVIDER}__{get_embedding_model_name()}"
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", raw)
+
+def get_model_dir() -> Path:
+    """Директория индексов для текущей embedding модели"""
+    return Path(config.INDEX_DIR) / get_model_key()
+
+def get_current_index_dir() -> Path | None:
+    """Директория текущей версии индекса (или None, если индекса нет)"""
+    current_file = get_model_dir() / CURRENT_FILE
+    if not current_file.exists():
+        return None
+    version_dir = get_model_dir() / current_file.read_text(encoding="utf-8").strip()
+    return version_dir if version_dir.is_dir() else None
+
+def file_sha256(path: Path) -> str:
+    """SHA-256 содержимого файла (читается блоками)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def compute_corpus_fingerprint(file_hashes: dict, params: dict) -> str:
+    """
+    Отпечаток корпуса: имена и хеши файлов + параметры разбиения
+
+    Args:
+        file_hashes: {имя файла: sha256 содержимого}
+        params: параметры, влияющие на чанки (chunk_size, chunk_overlap и т.д.)
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    for name in sorted(file_hashes):
+        digest.update(name.encode("utf-8"))
+        digest.update(file_hashes[name].encode("utf-8"))
+    return digest.hexdigest()
+
+def read_meta() -> dict | None:
+    """Метаданные текущей версии индекса"""
+    index_dir = get_current_index_dir()
+    if index_dir is None:
+        return None
+    try:
+        return json.loads((index_dir / META_FILE).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Cannot read index meta in {index_dir}: {e}")
+        return None
+
+def read_manifest() -> dict | None:
+    """
+    Манифест текущей версии индекса
+
+    Формат: {"params": {...}, "files": {имя файла: {"sha256": ..., "chunk_ids": [...], "chunk_hashes": [...]}}}
+    """
+    index_dir = get_current_index_dir()
+    if index_dir is None:
+        return None
+    try:
+        return json.loads((index_dir / MANIFEST_FILE).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Cannot read index manifest in {index_dir}: {e}")
+        return None
+
+def save_index(chunks: list, vectors: np.ndarray, meta: dict, manifest: dict | None = None) -> Path:
+    """
+    Сохранение индекса в новую версию и атомарное переключение CURRENT
+
+    Старая версия не перезаписывается: она может быть memory-mapped
+    в работающем процессе.
+
+    Args:
+        chunks: список Document (порядок совпадает со строками vectors)
+        vectors: матрица L2-нормализованных embeddings (n_chunks x dim)
+        meta: метаданные (fingerprint, модель и т.д.)
+        manifest: хеши файлов и чанков для инкрементальной переиндексации
+
+    Returns:
+        Path: директория сохраненной версии
+    """
+    if len(chunks) != len(vectors):
+        raise ValueError(f"Chunks/vectors size mismatch: {len(chunks)} != {len(vectors)}")
+
+    model_dir = get_model_dir()
+    model_dir.mkdir(parents=True, exist_ok=True)
+
+    version = f"v{time.time_ns()}"
+    tmp_dir = model_dir / f".{version}.tmp"
+    tmp_dir.mkdir()
+
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    np.save(tmp_dir / EMBEDDINGS_FILE, matrix)
+
+    with open(tmp_dir / CHUNKS_FILE, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            record = {"id": chunk.id, "page_content": chunk.page_content, "metadata": chunk.metadata}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    full_meta = {
+        **meta,
+        "format_version": INDEX_FORMAT_VERSION,
+        "embedding_provider": config.EMBEDDING_PROVIDER,
+        "embedding_model": get_embedding_model_name(),
+        "count": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    (tmp_dir / META_FILE).write_text(json.dumps(full_meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    if manifest is not None:
+        (tmp_dir / MANIFEST_FILE).write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+
+    version_dir = model_dir / version
+    tmp_dir.rename(version_dir)
+
+    # Атомарное переключение текущей версии
+    current_tmp = model_dir / f".{CURRENT_FILE}.tmp"
+    current_tmp.write_text(version, encoding="utf-8")
+    os.replace(current_tmp, model_dir / CURRENT_FILE)
+
+    _cleanup_old_versions(model_dir, keep=version)
+    logger.info(f"Index saved: {version_dir} ({full_meta['count']} chunks, dim={full_meta['dim']})")
+    return version_dir
+
+def save_arrays(arrays: dict):
+    """
+    Добавление массивов в текущую версию индекса
+
+    Используется, когда производная структура (например ANN индекс) строится
+    для уже сохраненной версии. Файлы пишутся через временное имя и os.replace.
+    """
+    index_dir = get_current_index_dir()
+    if index_dir is None:
+        raise FileNotFoundError(f"No persisted index in {get_model_dir()}")
+    for name, array in arrays.items():
+        tmp_path = index_dir / f".{name}.tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, index_dir / f"{name}.npy")
+
+def load_arrays(names: list) -> dict | None:
+    """Загрузка дополнительных массивов текущей версии (memory-mapped); None если какого-то нет"""
+    index_dir = get_current_index_dir()
+    if index_dir is None:
+        return None
+    arrays = {}
+    for name in names:
+        path = index_dir / f"{name}.npy"
+        if not path.exists():
+            return None
+        arrays[name] = np.load(path, mmap_mode="r")
+    return arrays
+
+def _cleanup_old_versions(model_dir: Path, keep: str):
+    """Удаление старых версий индекса (кроме KEEP_VERSIONS последних)"""
+    versions = sorted(
+        (p for p in model_dir.iterdir() if p.is_dir() and p.name.startswith("v")),
+        key=lambda p: p.name,
+    )
+    for old_dir in versions[:-KEEP_VERSIONS]:
+        if old_dir.name == keep:
+            continue
+        # На POSIX удаление memory-mapped файлов безопасно: данные живут до закрытия mmap
+        shutil.rmtree(old_dir, ignore_errors=True)
+        logger.info(f"Removed old index version: {old_dir.name}")
+
+def load_index(expected_fingerprint: str | None = None):
+    """
+    Загрузка текущей версии индекса с диска
+
+    Матрица embeddings открывается через memory-map (без чтения в память целиком).
+
+    Args:
+        expected_fingerprint: если задан, индекс с другим отпечатком корпуса не загружается
+
+    Returns:
+        tuple: (chunks, vectors, meta) или None если индекс отсутствует/устарел
+    """
+    index_dir = get_current_index_dir()
+    if index_dir is None:
+        logger.info(f"No persisted index found in {get_model_dir()}")
+        return None
+
+    meta = read_meta()
+    if meta is None:
+        return None
+    if meta.get("format_version") != INDEX_FORMAT_VERSION:
+        logger.info(f"Index format version mismatch: {meta.get('format_version')} != {INDEX_FORMAT_VERSION}")
+        return None
+    if expected_fingerprint is not None and meta.get("corpus_fingerprint") != expected_fingerprint:
+        logger.info("Corpus fingerprint changed, persisted index is stale")
+        return None
+
+    try:
+        vectors = np.load(index_dir / EMBEDDINGS_FILE, mmap_mode="r")
+        chunks = []
+        with open(index_dir / CHUNKS_FILE, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                chunks.append(Document(
+                    id=record["id"],
+                    page_content=record["page_content"],
+                    metadata=record["metadata"],
+                ))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Cannot load persisted index from {index_dir}: {e}")
+        return None
+
+    if len(chunks) != vectors.shape[0]:
+        logger.warning(f"Corrupted index in {index_dir}: {len(chunks)} chunks vs {vectors.shape[0]} vectors")
+        return None
+
+    logger.info(f"Loaded persisted index {index_dir.name}: {len(chunks)} chunks")
+    return chunks, vectors, meta
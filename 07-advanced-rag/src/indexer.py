@@ -1,38 +1,50 @@
+import asyncio
+import hashlib
 import logging
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
 from langchain_community.document_loaders import PyPDFLoader, JSONLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import InMemoryVectorStore
 from config import config
+import index_store
+from vector_store import NumpyVectorStore, normalize_rows
+from bm25_index import build_bm25_index, load_bm25_index
+from ann_index import IVFIndex, IVF_CENTROIDS, IVF_ROWS, IVF_OFFSETS, default_nlist, evaluate_recall
+from embedding_cache import with_cache
+from batch_embedder import BatchEmbedder
 
 logger = logging.getLogger(__name__)
 
-def load_pdf_documents(data_dir: str) -> list:
-    """Загрузка всех PDF документов из директории"""
-    pages = []
-    data_path = Path(data_dir)
-    
-    if not data_path.exists():
-        logger.warning(f"Directory {data_dir} does not exist")
-        return pages
-    
-    pdf_files = list(data_path.glob("*.pdf"))
-    logger.info(f"Found {len(pdf_files)} PDF files in {data_dir}")
-    
-    for pdf_file in pdf_files:
-        loader = PyPDFLoader(str(pdf_file))
-        pages.extend(loader.load())
-        logger.info(f"Loaded {pdf_file.name}")
-    
-    return pages
+# Параметры разбиения на чанки (входят в отпечаток корпуса)
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+JSON_FILE_NAME = "sberbank_help_documents.json"
+
+# Отчет последней переиндексации (что было загружено, переиспользовано, удалено)
+last_report = None
+
+# Идет ли фоновая переиндексация (одновременно выполняется только одна)
+reindex_running = False
+# Очередь прогресса в процессе фоновой переиндексации (см. _init_reindex_worker)
+_progress_queue = None
+
+def get_index_workers(num_files: int) -> int:
+    """Число процессов для загрузки и разбиения файлов (INDEX_WORKERS, 0 = по числу ядер)"""
+    workers = config.INDEX_WORKERS if config.INDEX_WORKERS > 0 else (os.cpu_count() or 1)
+    return max(1, min(workers, num_files))
 
 def split_documents(pages: list) -> list:
     """Разбиение документов на чанки"""
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
     )
     chunks = text_splitter.split_documents(pages)
     logger.info(f"Split into {len(chunks)} chunks")
@@ -67,59 +79,343 @@ def create_embeddings():
     
     if provider == "openai":
         logger.info(f"Creating OpenAI embeddings: {config.EMBEDDING_MODEL}")
-        return OpenAIEmbeddings(model=config.EMBEDDING_MODEL)
+        return with_cache(OpenAIEmbeddings(model=config.EMBEDDING_MODEL), provider, config.EMBEDDING_MODEL)
     
     elif provider == "huggingface":
         logger.info(f"Creating HuggingFace embeddings: {config.HUGGINGFACE_EMBEDDING_MODEL} on {config.HUGGINGFACE_DEVICE}")
-        return HuggingFaceEmbeddings(
+        embeddings = HuggingFaceEmbeddings(
             model_name=config.HUGGINGFACE_EMBEDDING_MODEL,
             model_kwargs={'device': config.HUGGINGFACE_DEVICE},
             encode_kwargs={'normalize_embeddings': True}
         )
+        return with_cache(embeddings, provider, config.HUGGINGFACE_EMBEDDING_MODEL)
     
     else:
         raise ValueError(f"Unknown embedding provider: {provider}. Use 'openai' or 'huggingface'")
 
-def create_vector_store(chunks: list):
-    """Создание векторного хранилища"""
-    embeddings = create_embeddings()
-    vector_store = InMemoryVectorStore.from_documents(
-        documents=chunks,
-        embedding=embeddings
-    )
+def get_source_files(data_dir: str) -> list:
+    """Список исходных файлов корпуса: все PDF + JSON с Q&A парами"""
+    data_path = Path(data_dir)
+    if not data_path.exists():
+        return []
+    files = sorted(data_path.glob("*.pdf"))
+    json_file = data_path / JSON_FILE_NAME
+    if json_file.exists():
+        files.append(json_file)
+    return files
+
+def get_index_params() -> dict:
+    """Параметры индексации, влияющие на содержимое чанков"""
+    return {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "json_file": JSON_FILE_NAME,
+    }
+
+def assign_chunk_ids(chunks: list) -> list:
+    """Стабильные id чанков: хеш источника, страницы и текста"""
+    seen = {}
+    for chunk in chunks:
+        key = f"{chunk.metadata.get('source', '')}\x00{chunk.metadata.get('page', '')}\x00{chunk.page_content}"
+        base_id = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        # Одинаковый текст на одной странице - добавляем порядковый суффикс
+        count = seen.get(base_id, 0)
+        seen[base_id] = count + 1
+        chunk.id = base_id if count == 0 else f"{base_id}-{count}"
+    return chunks
+
+def chunk_text_hash(text: str) -> str:
+    """Хеш текста чанка (ключ переиспользования embeddings)"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_source_file(path: Path) -> list:
+    """Загрузка и разбиение одного исходного файла (PDF или JSON) на чанки"""
+    if path.suffix.lower() == ".pdf":
+        pages = PyPDFLoader(str(path)).load()
+        logger.info(f"Loaded {path.name}")
+        return split_documents(pages) if pages else []
+    return load_json_documents(str(path))
+
+def _load_source_file_task(path: Path) -> tuple:
+    """Задача пула: загрузка и разбиение файла, возвращает (path, chunks)"""
+    return path, load_source_file(path)
+
+async def iter_source_chunks(paths: list):
+    """
+    Параллельная загрузка и разбиение файлов в пуле процессов
+    
+    Чанки отдаются по мере готовности файлов (в порядке завершения),
+    чтобы embedding мог начаться до окончания разбора остальных файлов.
+    
+    Yields:
+        tuple: (path, chunks)
+    """
+    if not paths:
+        return
+    
+    workers = get_index_workers(len(paths))
+    if workers == 1:
+        for path in paths:
+            yield await asyncio.to_thread(_load_source_file_task, path)
+        return
+    
+    logger.info(f"Loading {len(paths)} files with {workers} worker processes")
+    loop = asyncio.get_running_loop()
+    # spawn, как и в reindex_in_background: fork процесса бота с работающими потоками небезопасен
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [loop.run_in_executor(pool, _load_source_file_task, path) for path in paths]
+        for future in asyncio.as_completed(futures):
+            yield await future
+
+def embed_chunks(chunks: list, embeddings) -> np.ndarray:
+    """Вычисление embeddings для чанков в виде матрицы float32"""
+    vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+    return np.asarray(vectors, dtype=np.float32)
+
+def create_vector_store(chunks: list, vectors=None, embeddings=None, normalized: bool = False):
+    """
+    Создание векторного хранилища (NumPy матрица + документы)
+    
+    Args:
+        chunks: список Document с заполненным id
+        vectors: готовая матрица embeddings (если None - вычисляется)
+        embeddings: embeddings объект для запросов (если None - создается)
+        normalized: строки vectors уже L2-нормализованы (например, memory-mapped индекс)
+    """
+    if embeddings is None:
+        embeddings = create_embeddings()
+    if vectors is None:
+        vectors = embed_chunks(chunks, embeddings)
+        normalized = False
+    
+    vector_store = NumpyVectorStore(embeddings, chunks, vectors, normalized=normalized)
     logger.info(f"Created vector store with {len(chunks)} chunks")
     return vector_store
 
-async def reindex_all():
-    """Полная переиндексация всех документов (PDF + JSON)
+def attach_ann_index(vector_store, report: dict, persisted: bool = True):
+    """
+    ANN индекс для semantic поиска (VECTOR_INDEX_TYPE=ivf)
+    
+    Загружается из текущей версии индекса на диске; если его нет или он построен
+    с другим числом кластеров - строится заново, сохраняется рядом с чанками,
+    а в отчет добавляется recall относительно точного поиска.
+    
+    Args:
+        persisted: индекс vector_store сохранен текущей версией на диске
+            (иначе ANN индекс только строится в памяти)
+    """
+    if config.VECTOR_INDEX_TYPE != "ivf" or len(vector_store) == 0:
+        return
+    
+    matrix = vector_store.matrix
+    nlist = config.IVF_NLIST if config.IVF_NLIST > 0 else default_nlist(matrix.shape[0])
+    arrays = index_store.load_arrays([IVF_CENTROIDS, IVF_ROWS, IVF_OFFSETS]) if persisted else None
+    if arrays is not None and arrays[IVF_CENTROIDS].shape[0] == nlist and len(arrays[IVF_ROWS]) == matrix.shape[0]:
+        ivf = IVFIndex.from_arrays(arrays)
+        logger.info(f"Loaded IVF index: nlist={nlist}")
+    else:
+        ivf = IVFIndex.build(matrix, nlist)
+        if persisted:
+            try:
+                index_store.save_arrays(ivf.to_arrays())
+            except OSError as e:
+                logger.warning(f"Failed to persist IVF index: {e}")
+        recall = evaluate_recall(matrix, ivf, config.SEMANTIC_RETRIEVER_K, config.IVF_NPROBE, n_queries=100)
+        report["ann"] = recall
+        logger.info(
+            f"IVF recall@{recall['k']} (nprobe={recall['nprobe']}): {recall['recall']:.3f}, "
+            f"latency {recall['ann_ms']}ms vs exact {recall['exact_ms']}ms"
+        )
+    
+    vector_store.ann_index = ivf
+    vector_store.nprobe = config.IVF_NPROBE
+
+def persist_bm25_index(chunks: list):
+    """
+    Построение BM25 индекса для текущей версии индекса на диске
+    
+    Строится один раз: если сохраненный BM25 индекс соответствует чанкам,
+    ничего не делается. Retriever загружает его лениво (см. rag.get_bm25_index).
+    """
+    if load_bm25_index(chunks) is not None:
+        return
+    try:
+        index_store.save_arrays(build_bm25_index(chunks).to_arrays())
+    except OSError as e:
+        logger.warning(f"Failed to persist BM25 index: {e}")
+
+async def reindex_all(force: bool = False, progress=None):
+    """Инкрементальная переиндексация документов (PDF + JSON)
+    
+    Хеши файлов сравниваются с манифестом сохраненного индекса: загружаются,
+    разбиваются и эмбеддятся только новые и измененные файлы, чанки удаленных
+    файлов выбрасываются. Для чанков измененных файлов с тем же текстом
+    embeddings переиспользуются. Итог пишется в last_report.
+    
+    Args:
+        force: игнорировать сохраненный индекс и пересчитать все embeddings
+        progress: callback (stage, info) о ходе переиндексации
     
     Returns:
         tuple: (vector_store, chunks) для инициализации retriever
     """
-    logger.info("Starting full reindexing...")
+    def report_progress(stage: str, **info):
+        if progress is not None:
+            progress(stage, info)
+    
+    started_at = time.perf_counter()
+    logger.info("Starting reindexing..." if not force else "Starting full reindexing (forced)...")
     
     try:
-        # Загрузка PDF документов
-        pages = load_pdf_documents(config.DATA_DIR)
-        pdf_chunks = split_documents(pages) if pages else []
-        logger.info(f"PDF: {len(pdf_chunks)} chunks")
+        source_files = get_source_files(config.DATA_DIR)
+        if not source_files:
+            logger.warning("No documents found to index")
+            return None, []
+        
+        params = get_index_params()
+        file_hashes = {path.name: index_store.file_sha256(path) for path in source_files}
+        fingerprint = index_store.compute_corpus_fingerprint(file_hashes, params)
+        
+        previous = None if force else index_store.load_index()
+        manifest = index_store.read_manifest() if previous is not None else None
+        previous_files = manifest.get("files", {}) if manifest else {}
+        # При смене параметров разбиения файлы нужно перезагрузить, но embeddings чанков с тем же текстом валидны
+        reusable_files = previous_files if manifest and manifest.get("params") == params else {}
+        
+        report = {
+            "added": [],
+            "changed": [],
+            "removed": sorted(set(previous_files) - set(file_hashes)),
+            "unchanged": [],
+            "embedded_chunks": 0,
+            "reused_chunks": 0,
+        }
+        
+        # Быстрый путь: корпус не изменился
+        if previous is not None and previous[2].get("corpus_fingerprint") == fingerprint:
+            chunks, vectors, _ = previous
+            vector_store = create_vector_store(chunks, vectors, normalized=True)
+            attach_ann_index(vector_store, report)
+            persist_bm25_index(chunks)
+            report["unchanged"] = sorted(file_hashes)
+            report["reused_chunks"] = len(chunks)
+            report["persisted"] = True
+            _finish_report(report, len(chunks), started_at)
+            return vector_store, chunks
+        
+        prev_chunks, prev_vectors = (previous[0], previous[1]) if previous is not None else ([], None)
+        prev_rows = {chunk.id: row for row, chunk in enumerate(prev_chunks)}
+        prev_hash_rows = {}
+        for row, chunk in enumerate(prev_chunks):
+            prev_hash_rows.setdefault(chunk_text_hash(chunk.page_content), row)
+        
+        embeddings = create_embeddings()
+        batcher = BatchEmbedder(embeddings)
+        file_chunks = {}
+        file_rows = {}  # для каждого чанка: вектор из старого индекса или None (нужно вычислить)
+        changed_paths = []
+        
+        for path in source_files:
+            name = path.name
+            info = reusable_files.get(name)
+            if info and info.get("sha256") == file_hashes[name] and all(cid in prev_rows for cid in info["chunk_ids"]):
+                # Файл не изменился - берем чанки и векторы из старого индекса
+                file_chunks[name] = [prev_chunks[prev_rows[cid]] for cid in info["chunk_ids"]]
+                file_rows[name] = [prev_vectors[prev_rows[cid]] for cid in info["chunk_ids"]]
+                report["unchanged"].append(name)
+                report["reused_chunks"] += len(file_chunks[name])
+            else:
+                report["changed" if name in previous_files else "added"].append(name)
+                changed_paths.append(path)
+        
+        logger.info(
+            f"Files: {len(report['added'])} added, {len(report['changed'])} changed, "
+            f"{len(report['removed'])} removed, {len(report['unchanged'])} unchanged"
+        )
+        report_progress(
+            "files", added=len(report["added"]), changed=len(report["changed"]),
+            removed=len(report["removed"]), unchanged=len(report["unchanged"]),
+        )
+        
+        # Новые и измененные файлы разбираются параллельно, embedding файла
+        # стартует сразу после его разбиения
+        embed_tasks = {}
+        async for path, chunks in iter_source_chunks(changed_paths):
+            name = path.name
+            chunks = assign_chunk_ids(chunks)
+            rows = []
+            for chunk in chunks:
+                row = prev_hash_rows.get(chunk_text_hash(chunk.page_content))
+                rows.append(prev_vectors[row] if row is not None else None)
+            missing = [chunk for chunk, row in zip(chunks, rows) if row is None]
+            report["reused_chunks"] += len(chunks) - len(missing)
+            report["embedded_chunks"] += len(missing)
+            file_chunks[name] = chunks
+            file_rows[name] = rows
+            report_progress("file_loaded", name=name, chunks=len(chunks), new_chunks=len(missing))
+            if missing:
+                logger.info(f"{name}: embedding {len(missing)} new chunks (of {len(chunks)})")
+                embed_tasks[name] = asyncio.create_task(batcher.embed([chunk.page_content for chunk in missing]))
         
-        # Загрузка JSON Q&A пар
-        json_file = Path(config.DATA_DIR) / "sberbank_help_documents.json"
-        json_documents = load_json_documents(str(json_file))
-        logger.info(f"JSON: {len(json_documents)} Q&A pairs")
+        if embed_tasks:
+            report_progress("embedding", chunks=report["embedded_chunks"])
+        for name, task in embed_tasks.items():
+            new_vectors = iter(await task)
+            file_rows[name] = [row if row is not None else next(new_vectors) for row in file_rows[name]]
         
-        # Объединяем все чанки
-        all_chunks = pdf_chunks + json_documents
+        if embed_tasks:
+            report["embedding"] = batcher.get_stats()
+            logger.info(
+                f"Embedding stage: {report['embedding']['chunks']} chunks in {report['embedding']['batches']} batches, "
+                f"{report['embedding']['chunks_per_s']} chunks/s, ~{report['embedding']['tokens_per_s']} tokens/s, "
+                f"{report['embedding']['retries']} retries"
+            )
+        
+        # Собираем индекс в стабильном порядке исходных файлов
+        all_chunks = []
+        rows = []
+        for path in source_files:
+            all_chunks.extend(file_chunks.get(path.name, []))
+            rows.extend(file_rows.get(path.name, []))
         
         if not all_chunks:
             logger.warning("No documents found to index")
             return None, []
         
-        logger.info(f"Total chunks to index: {len(all_chunks)} (PDF: {len(pdf_chunks)}, JSON: {len(json_documents)})")
+        # Индекс хранит нормализованные векторы - при загрузке они используются как есть (mmap)
+        vectors = normalize_rows(np.vstack(rows))
+        vector_store = create_vector_store(all_chunks, vectors, embeddings, normalized=True)
+        
+        # Сохраняем индекс и манифест на диск
+        manifest = {
+            "params": params,
+            "files": {
+                name: {
+                    "sha256": file_hashes[name],
+                    "chunk_ids": [chunk.id for chunk in chunks],
+                    "chunk_hashes": [chunk_text_hash(chunk.page_content) for chunk in chunks],
+                }
+                for name, chunks in file_chunks.items()
+            },
+        }
+        report_progress("saving", chunks=len(all_chunks))
+        persisted = True
+        try:
+            index_store.save_index(all_chunks, vectors, {
+                "corpus_fingerprint": fingerprint,
+                "params": params,
+                "files": sorted(file_hashes),
+            }, manifest)
+        except OSError as e:
+            logger.warning(f"Failed to persist index: {e}")
+            persisted = False
+        report["persisted"] = persisted
+        report_progress("search_indexes")
+        attach_ann_index(vector_store, report, persisted)
+        if persisted:
+            persist_bm25_index(all_chunks)
         
-        vector_store = create_vector_store(all_chunks)
-        logger.info("Reindexing completed successfully")
+        _finish_report(report, len(all_chunks), started_at)
         
         # Возвращаем vector_store и chunks для BM25
         return vector_store, all_chunks
@@ -131,3 +427,93 @@ async def reindex_all():
         logger.error(f"Error during reindexing: {e}", exc_info=True)
         return None, []
 
+def _init_reindex_worker(progress_queue):
+    """Инициализация процесса фоновой переиндексации"""
+    global _progress_queue
+    _progress_queue = progress_queue
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - reindex - %(name)s - %(levelname)s - %(message)s')
+
+def _reindex_worker_task(force: bool) -> dict | None:
+    """
+    Задача процесса переиндексации
+    
+    Индекс (чанки, векторы, ANN и BM25) сохраняется на диск новой версией,
+    в родительский процесс возвращается только отчет - индекс загружается оттуда (mmap).
+    """
+    vector_store, _ = asyncio.run(reindex_all(force, lambda stage, info: _progress_queue.put((stage, info))))
+    if vector_store is None:
+        return None
+    return last_report
+
+def load_persisted_index(embeddings=None):
+    """Загрузка текущей версии индекса с диска: (vector_store, chunks) или None"""
+    loaded = index_store.load_index()
+    if loaded is None:
+        return None
+    chunks, vectors, _ = loaded
+    vector_store = create_vector_store(chunks, vectors, embeddings, normalized=True)
+    attach_ann_index(vector_store, {})
+    return vector_store, chunks
+
+async def reindex_in_background(force: bool = False, on_progress=None, embeddings=None):
+    """
+    Переиндексация в отдельном процессе, не блокирующая event loop бота
+    
+    Пока процесс строит новую версию индекса, бот отвечает по старой. Затем
+    новая версия загружается с диска в потоке.
+    
+    Args:
+        force: игнорировать сохраненный индекс и пересчитать все embeddings
+        on_progress: async callback (stage, info) о ходе переиндексации
+        embeddings: embeddings текущего vector_store (чтобы не загружать модель повторно)
+    
+    Returns:
+        tuple: (vector_store, chunks) или None, если индексировать нечего или произошла ошибка
+    """
+    global reindex_running, last_report
+    if reindex_running:
+        raise RuntimeError("Reindexing is already running")
+    reindex_running = True
+    
+    # spawn: в процессе бота уже работают потоки (reranker, хранилища), fork с ними небезопасен
+    context = multiprocessing.get_context("spawn")
+    progress_queue = context.Queue()
+    pool = ProcessPoolExecutor(
+        max_workers=1, mp_context=context,
+        initializer=_init_reindex_worker, initargs=(progress_queue,),
+    )
+    try:
+        future = asyncio.wrap_future(pool.submit(_reindex_worker_task, force))
+        while True:
+            try:
+                stage, info = await asyncio.to_thread(progress_queue.get, True, 0.5)
+            except queue.Empty:
+                if future.done():
+                    break
+                continue
+            if on_progress is not None:
+                await on_progress(stage, info)
+        
+        report = await future
+        if report is None:
+            return None
+        last_report = report
+        if not report.get("persisted"):
+            raise RuntimeError("Failed to persist the new index version")
+        if on_progress is not None:
+            await on_progress("loading", {})
+        return await asyncio.to_thread(load_persisted_index, embeddings)
+    finally:
+        pool.shutdown(wait=False)
+        reindex_running = False
+
+def _finish_report(report: dict, total_chunks: int, started_at: float):
+    """Фиксация отчета о переиндексации в last_report"""
+    global last_report
+    report["total_chunks"] = total_chunks
+    report["duration_s"] = round(time.perf_counter() - started_at, 2)
+    last_report = report
+    logger.info(
+        f"Reindexing completed in {report['duration_s']}s: {total_chunks} chunks, "
+        f"{report['embedded_chunks']} embedded, {report['reused_chunks']} reused"
+    )
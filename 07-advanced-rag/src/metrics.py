@@ -0,0 +1,169 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+# Отдельный логгер для строк по запросам (можно направить в свой файл или отключить)
+request_logger = logging.getLogger("rag.requests")
+
+# Границы бакетов гистограмм длительности (секунды)
+DURATION_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Границы бакетов гистограмм размеров: токены, число кандидатов
+SIZE_BUCKETS = (1, 5, 10, 20, 50, 100, 250, 500, 1000, 2500, 5000)
+
+HISTOGRAMS = {
+    "rag_stage_duration_seconds": ("Длительность этапа RAG", DURATION_BUCKETS_S),
+    "rag_stage_tokens": ("Токены на выходе этапа RAG (оценка)", SIZE_BUCKETS),
+    "rag_stage_candidates": ("Число документов на входе этапа RAG", SIZE_BUCKETS),
+    "rag_request_duration_seconds": ("Полное время ответа RAG", DURATION_BUCKETS_S),
+}
+
+class Histogram:
+    """Гистограмма с фиксированными бакетами (формат Prometheus)"""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+# (метрика, label) -> Histogram; label - этап для rag_stage_*, статус для rag_request_*
+_histograms = {}
+_lock = threading.Lock()
+_current_trace = ContextVar("rag_request_trace", default=None)
+
+def observe(metric: str, label: str, value: float):
+    with _lock:
+        histogram = _histograms.get((metric, label))
+        if histogram is None:
+            histogram = _histograms[(metric, label)] = Histogram(HISTOGRAMS[metric][1])
+        histogram.observe(value)
+
+class RequestTrace:
+    """Спаны одного запроса к RAG: этап, длительность, токены и число кандидатов"""
+
+    def __init__(self, **attrs):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.attrs = attrs
+        self.spans = []
+        self.status = "ok"
+        self.started_at = time.perf_counter()
+
+def start_trace(**attrs) -> RequestTrace:
+    """Начало трассировки запроса: спаны этапов в этом контексте (и его задачах) попадают в нее"""
+    trace = RequestTrace(**attrs)
+    _current_trace.set(trace)
+    return trace
+
+def finish_trace(trace: RequestTrace):
+    """Завершение трассировки: гистограмма полного времени и строка JSON в лог rag.requests"""
+    total = time.perf_counter() - trace.started_at
+    observe("rag_request_duration_seconds", trace.status, total)
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    request_logger.info(json.dumps({
+        "request_id": trace.request_id,
+        "status": trace.status,
+        "total_ms": round(total * 1000, 1),
+        **trace.attrs,
+        "spans": trace.spans,
+    }, ensure_ascii=False, default=str))
+
+def record(stage: str, duration_s: float, tokens: int = None, candidates: int = None, **attrs):
+    """Запись спана этапа: в гистограммы и в трассировку текущего запроса (если есть)"""
+    observe("rag_stage_duration_seconds", stage, duration_s)
+    if tokens is not None:
+        observe("rag_stage_tokens", stage, tokens)
+    if candidates is not None:
+        observe("rag_stage_candidates", stage, candidates)
+    trace = _current_trace.get()
+    if trace is not None:
+        span = {"stage": stage, "ms": round(duration_s * 1000, 1)}
+        if tokens is not None:
+            span["tokens"] = tokens
+        if candidates is not None:
+            span["candidates"] = candidates
+        span.update(attrs)
+        trace.spans.append(span)
+
+@contextmanager
+def span(stage: str, **attrs):
+    """
+    Замер этапа: with span("rerank", candidates=n) as info: ...
+
+    В info можно дописать tokens, candidates и другие атрибуты, известные после этапа.
+    """
+    info = dict(attrs)
+    started_at = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record(stage, time.perf_counter() - started_at, **info)
+
+def get_stats() -> dict:
+    """Число замеров и средняя длительность (мс) по этапам"""
+    with _lock:
+        return {
+            stage: {"count": histogram.count, "avg_ms": round(histogram.sum / histogram.count * 1000, 1)}
+            for (metric, stage), histogram in sorted(_histograms.items())
+            if metric == "rag_stage_duration_seconds" and histogram.count
+        }
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_prometheus() -> str:
+    """Все гистограммы в текстовом формате Prometheus"""
+    lines = []
+    with _lock:
+        for metric, (help_text, _) in HISTOGRAMS.items():
+            label_name = "status" if metric.startswith("rag_request_") else "stage"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for (name, label), histogram in sorted(_histograms.items()):
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label_name}="{label}",le="{_format_value(bound)}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label_name}="{label}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{{label_name}="{label}"}} {_format_value(histogram.sum)}')
+                lines.append(f'{metric}_count{{{label_name}="{label}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Опросы Prometheus не пишем в лог бота
+        pass
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """HTTP сервер с /metrics в фоновом потоке (не зависит от event loop бота)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics server started on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,52 @@
+import re
+from collections import Counter
+
+# Политика трансформации запроса: LLM-переписывание нужно только уточняющим
+# вопросам, которые без истории диалога непонятны ("а для пенсионеров?")
+
+# Слова, отсылающие к предыдущим репликам
+REFERENCE_WORDS = frozenset("""
+он она оно они его ее ему ей им ими их него нее нему ней ним них нем
+этот эта это эти этого этой этому этим этих этом
+тот та те того той тому тем тех том там туда оттуда тогда
+такой такая такое такие такого таких такую таким
+тоже также еще подробнее выше предыдущий предыдущем
+""".split())
+
+# Начала реплик-продолжений
+FOLLOW_UP_PREFIXES = ("а ", "и ", "но ", "а что", "а как", "а если")
+
+# Более короткие реплики во втором и дальше ходе считаем уточнениями
+MIN_SELF_CONTAINED_WORDS = 4
+
+# Счетчики решений политики (для /index_status)
+decisions = Counter()
+
+def get_last_user_text(messages: list) -> str:
+    """Текст последнего сообщения пользователя"""
+    for message in reversed(messages):
+        if message.type == "human":
+            return message.content
+    return messages[-1].content if messages else ""
+
+def is_follow_up(text: str) -> bool:
+    """Похожа ли реплика на уточнение, которое нельзя искать без контекста"""
+    normalized = text.lower().replace("ё", "е").strip()
+    words = re.findall(r"\w+", normalized)
+    if len(words) < MIN_SELF_CONTAINED_WORDS:
+        return True
+    if normalized.startswith(FOLLOW_UP_PREFIXES):
+        return True
+    return any(word in REFERENCE_WORDS for word in words)
+
+def needs_rewrite(messages: list) -> bool:
+    """
+    Нужно ли переписывать запрос LLM перед поиском
+
+    Первый вопрос диалога переписывать не нужно (разрешать нечего), как и
+    самодостаточный вопрос в середине диалога.
+    """
+    human_turns = sum(1 for message in messages if message.type == "human")
+    if human_turns <= 1:
+        return False
+    return is_follow_up(get_last_user_text(messages))
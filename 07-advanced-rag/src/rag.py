@@ -1,11 +1,21 @@
+import asyncio
 import logging
+import time
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough, RunnablePick
 from langchain_openai import ChatOpenAI
-from langchain_community.retrievers import BM25Retriever
-from langchain_classic.retrievers import EnsembleRetriever
 from config import config
+from bm25_index import BM25IndexRetriever, build_bm25_index, load_bm25_index
+from hybrid_retriever import HybridRetriever
+from reranker import RerankerService
+from cross_encoder import load_cross_encoder
+from cache import LRUTTLCache, SemanticCache
+from text_utils import estimate_tokens, normalize_query
+from context_packer import pack_chunks
+import context_packer
+import metrics
+import query_policy
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +23,20 @@ logger = logging.getLogger(__name__)
 vector_store = None
 retriever = None
 chunks = None  # Для BM25 retriever
+bm25_index = None  # BM25 индекс для текущих chunks (lazy loading)
+_bm25_index_chunks = None
 cross_encoder = None  # Для reranking (lazy loading)
+reranker_service = None  # Поток-воркер для reranking с батчингом
+rag_chain = None  # RAG цепочка, собранная для текущего retriever
+retrieval_chain = None  # Только поиск documents (для потоковой генерации ответа)
+answer_chain = None  # Только генерация ответа по documents
+# Кеш scores cross-encoder: (нормализованный вопрос, id чанка) -> score, сбрасывается при переиндексации
+rerank_cache = LRUTTLCache(config.RERANK_CACHE_MAX_ENTRIES, config.RERANK_CACHE_TTL_S) if config.RERANK_CACHE_ENABLED else None
+# Семантический кеш ответов: embedding поискового запроса -> {"answer", "documents"}
+answer_cache = SemanticCache(
+    config.ANSWER_CACHE_MAX_ENTRIES, config.ANSWER_CACHE_TTL_S, config.ANSWER_CACHE_THRESHOLD
+) if config.ANSWER_CACHE_ENABLED else None
+index_generation = 0  # Увеличивается при каждой инициализации retriever (новый индекс)
 
 # Кеши для промптов и LLM клиентов
 _conversational_answering_prompt = None
@@ -21,33 +44,62 @@ _retrieval_query_transform_prompt = None
 _llm_query_transform = None
 _llm = None
 
-def create_semantic_retriever():
+def create_semantic_retriever(store=None):
     """Создание semantic retriever из vector store"""
-    if vector_store is None:
+    store = store or vector_store
+    if store is None:
         raise ValueError("Vector store not initialized")
-    return vector_store.as_retriever(
+    return store.as_retriever(
         search_kwargs={'k': config.SEMANTIC_RETRIEVER_K}
     )
 
-def create_bm25_retriever():
+def get_bm25_index(index_chunks=None):
+    """Ленивая загрузка BM25 индекса для chunks (с диска, иначе построение в памяти)"""
+    global bm25_index, _bm25_index_chunks
+    index_chunks = chunks if index_chunks is None else index_chunks
+    current, current_chunks = bm25_index, _bm25_index_chunks
+    if current is None or current_chunks is not index_chunks:
+        current = load_bm25_index(index_chunks)
+        if current is None:
+            logger.info("Persisted BM25 index not found, building in memory")
+            current = build_bm25_index(index_chunks)
+        else:
+            logger.info(f"Loaded BM25 index: {len(current.terms)} terms")
+        bm25_index, _bm25_index_chunks = current, index_chunks
+    return current
+
+def create_bm25_retriever(index_chunks=None):
     """Создание BM25 retriever из chunks"""
-    if chunks is None or len(chunks) == 0:
+    index_chunks = chunks if index_chunks is None else index_chunks
+    if index_chunks is None or len(index_chunks) == 0:
         raise ValueError("Chunks not initialized for BM25")
-    bm25 = BM25Retriever.from_documents(chunks)
-    bm25.k = config.BM25_RETRIEVER_K
-    return bm25
+    return BM25IndexRetriever(index=get_bm25_index(index_chunks), documents=index_chunks, k=config.BM25_RETRIEVER_K)
 
-def create_hybrid_retriever():
-    """Создание гибридного retriever (Semantic + BM25)"""
-    semantic = create_semantic_retriever()
-    bm25 = create_bm25_retriever()
+def create_hybrid_retriever(store=None, index_chunks=None):
+    """Создание гибридного retriever (Semantic + BM25, параллельный поиск и слияние)"""
+    store = store or vector_store
+    index_chunks = chunks if index_chunks is None else index_chunks
+    if store is None:
+        raise ValueError("Vector store not initialized")
+    if index_chunks is None or len(index_chunks) == 0:
+        raise ValueError("Chunks not initialized for BM25")
     
     logger.info(f"Hybrid retriever: semantic_k={config.SEMANTIC_RETRIEVER_K}, bm25_k={config.BM25_RETRIEVER_K}")
-    logger.info(f"Ensemble weights: semantic={config.ENSEMBLE_SEMANTIC_WEIGHT}, bm25={config.ENSEMBLE_BM25_WEIGHT}")
+    logger.info(
+        f"Fusion: {config.HYBRID_FUSION}, weights: semantic={config.ENSEMBLE_SEMANTIC_WEIGHT}, "
+        f"bm25={config.ENSEMBLE_BM25_WEIGHT}"
+    )
     
-    return EnsembleRetriever(
-        retrievers=[semantic, bm25],
-        weights=[config.ENSEMBLE_SEMANTIC_WEIGHT, config.ENSEMBLE_BM25_WEIGHT]
+    return HybridRetriever(
+        vector_store=store,
+        bm25_index=get_bm25_index(index_chunks),
+        documents=index_chunks,
+        semantic_k=config.SEMANTIC_RETRIEVER_K,
+        bm25_k=config.BM25_RETRIEVER_K,
+        semantic_weight=config.ENSEMBLE_SEMANTIC_WEIGHT,
+        bm25_weight=config.ENSEMBLE_BM25_WEIGHT,
+        fusion=config.HYBRID_FUSION,
+        rrf_k=config.HYBRID_RRF_K,
     )
 
 def get_cross_encoder():
@@ -55,15 +107,50 @@ def get_cross_encoder():
     global cross_encoder
     if cross_encoder is None:
         try:
-            from sentence_transformers import CrossEncoder
-            logger.info(f"Loading cross-encoder model: {config.CROSS_ENCODER_MODEL}")
-            cross_encoder = CrossEncoder(config.CROSS_ENCODER_MODEL)
+            logger.info(f"Loading cross-encoder model: {config.CROSS_ENCODER_MODEL} ({config.CROSS_ENCODER_BACKEND})")
+            cross_encoder = load_cross_encoder()
             logger.info("✓ Cross-encoder loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load cross-encoder: {e}", exc_info=True)
             raise
     return cross_encoder
 
+def get_reranker_service():
+    """Сервис reranking (создается при первом обращении, модель загружается в его потоке)"""
+    global reranker_service
+    if reranker_service is None:
+        reranker_service = RerankerService(
+            load_model=get_cross_encoder,
+            batch_window_ms=config.RERANKER_BATCH_WINDOW_MS,
+            max_batch_pairs=config.RERANKER_MAX_BATCH_PAIRS,
+        )
+    return reranker_service
+
+def _get_cached_scores(query: str, documents: list):
+    """Scores из кеша (None для промахов) и тексты документов, которые нужно оценить моделью"""
+    if rerank_cache is None:
+        return [None] * len(documents), [doc.page_content for doc in documents]
+    normalized = normalize_query(query)
+    scores = [rerank_cache.get((normalized, doc.id)) if doc.id is not None else None for doc in documents]
+    return scores, [doc.page_content for doc, score in zip(documents, scores) if score is None]
+
+def _merge_scores(query: str, documents: list, scores: list, computed: list) -> list:
+    """Подстановка вычисленных scores на места промахов и запись их в кеш"""
+    computed = iter(computed)
+    normalized = normalize_query(query)
+    for i, doc in enumerate(documents):
+        if scores[i] is None:
+            scores[i] = next(computed)
+            if rerank_cache is not None and doc.id is not None:
+                rerank_cache.set((normalized, doc.id), scores[i])
+    return scores
+
+def _rank_documents(documents: list, scores: list, top_k: int):
+    """Сортировка документов по убыванию score и отсечение top_k"""
+    ranked = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
+    logger.info(f"Reranked {len(documents)} documents, returning top {top_k}")
+    return ranked[:top_k]
+
 def rerank_documents(query: str, documents: list, top_k: int = None):
     """
     Переранжирование документов с помощью cross-encoder
@@ -82,53 +169,98 @@ def rerank_documents(query: str, documents: list, top_k: int = None):
     if not documents:
         return []
     
-    encoder = get_cross_encoder()
-    
-    # Создаем пары (query, document_text) для cross-encoder
-    pairs = [(query, doc.page_content) for doc in documents]
-    
-    # Cross-encoder оценивает релевантность каждой пары
-    scores = encoder.predict(pairs)
-    
-    # Сортируем по убыванию score
-    ranked = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
+    # Cross-encoder оценивает релевантность пар (query, document_text) в потоке сервиса,
+    # пары, уже оцененные для этого вопроса, берутся из кеша
+    with metrics.span("rerank", candidates=len(documents)) as info:
+        scores, passages = _get_cached_scores(query, documents)
+        computed = get_reranker_service().score(query, passages) if passages else []
+        info["scored"] = len(passages)
+        return _rank_documents(documents, _merge_scores(query, documents, scores, computed), top_k)
+
+async def arerank_documents(query: str, documents: list, top_k: int = None):
+    """Асинхронная версия rerank_documents: не блокирует event loop, батчится с другими запросами"""
+    if top_k is None:
+        top_k = config.RERANKER_TOP_K
     
-    logger.info(f"Reranked {len(documents)} documents, returning top {top_k}")
+    if not documents:
+        return []
     
-    # Возвращаем top_k наиболее релевантных
-    return ranked[:top_k]
+    with metrics.span("rerank", candidates=len(documents)) as info:
+        scores, passages = _get_cached_scores(query, documents)
+        computed = await get_reranker_service().ascore(query, passages) if passages else []
+        info["scored"] = len(passages)
+        return _rank_documents(documents, _merge_scores(query, documents, scores, computed), top_k)
+
+def _rerank_step(x: dict) -> list:
+    """Шаг reranking в RAG цепочке: ensemble_docs → documents"""
+    query = x["messages"][-1].content if x["messages"] else ""
+    return [doc for doc, score in rerank_documents(query, x["ensemble_docs"], config.RERANKER_TOP_K)]
+
+async def _arerank_step(x: dict) -> list:
+    query = x["messages"][-1].content if x["messages"] else ""
+    return [doc for doc, score in await arerank_documents(query, x["ensemble_docs"], config.RERANKER_TOP_K)]
 
-def create_retriever():
+def create_retriever(store=None, index_chunks=None):
     """Фабрика для создания retriever по режиму"""
     mode = config.RETRIEVAL_MODE.lower()
     
     if mode == "semantic":
         logger.info("Creating semantic retriever")
-        return create_semantic_retriever()
+        return create_semantic_retriever(store)
     
     elif mode == "hybrid":
         logger.info("Creating hybrid retriever (Semantic + BM25)")
-        return create_hybrid_retriever()
+        return create_hybrid_retriever(store, index_chunks)
     
     elif mode == "hybrid_reranker":
         logger.info("Creating hybrid retriever with reranker (Semantic + BM25 + Cross-encoder)")
         # Для hybrid_reranker используем тот же hybrid retriever
         # Reranking будет применен в get_rag_chain()
-        return create_hybrid_retriever()
+        return create_hybrid_retriever(store, index_chunks)
     
     else:
         raise ValueError(f"Unknown retrieval mode: {mode}. Use 'semantic', 'hybrid', or 'hybrid_reranker'")
 
+def build_retriever_chains(store=None, index_chunks=None) -> tuple:
+    """
+    Сборка retriever и цепочек для индекса без переключения на него
+    
+    Может выполняться в потоке (загрузка BM25 индекса), пока бот отвечает по текущему индексу.
+    
+    Returns:
+        tuple: (retriever, retrieval_chain, answer_chain, rag_chain)
+    """
+    new_retriever = create_retriever(store, index_chunks)
+    return (
+        new_retriever,
+        get_retrieval_chain(new_retriever),
+        get_answer_chain(),
+        get_rag_chain(new_retriever),
+    )
+
+def activate_index(store, index_chunks, built: tuple):
+    """Переключение на новый индекс: vector_store, chunks, retriever и цепочки меняются вместе"""
+    global vector_store, chunks, retriever, retrieval_chain, answer_chain, rag_chain, index_generation
+    vector_store, chunks, (retriever, retrieval_chain, answer_chain, rag_chain) = store, index_chunks, built
+    
+    # Индекс мог измениться - scores для старых чанков больше не актуальны
+    if rerank_cache is not None:
+        rerank_cache.clear()
+    # Ответы, найденные по старому индексу, больше не выдаются и не сохраняются
+    index_generation += 1
+    if answer_cache is not None:
+        answer_cache.clear(version=index_generation)
+    logger.info(f"✓ Retriever initialized in '{config.RETRIEVAL_MODE}' mode")
+
 def initialize_retriever():
-    """Инициализация retriever по режиму из конфига"""
-    global retriever
+    """Инициализация retriever и RAG цепочки по режиму из конфига"""
     if vector_store is None:
         logger.error("Cannot initialize retriever: vector_store is None")
         return False
     
     try:
-        retriever = create_retriever()
-        logger.info(f"✓ Retriever initialized in '{config.RETRIEVAL_MODE}' mode")
+        # Переключаем retriever и цепочки вместе, когда все уже собраны
+        activate_index(vector_store, chunks, build_retriever_chains(vector_store, chunks))
         return True
     except Exception as e:
         logger.error(f"Failed to initialize retriever: {e}", exc_info=True)
@@ -137,22 +269,21 @@ def initialize_retriever():
 def format_chunks(chunks):
     """
     Форматирование чанков с метаданными для лучшей прозрачности
+    
+    Чанки упаковываются в бюджет CONTEXT_MAX_TOKENS: без дубликатов,
+    соседние чанки одной страницы склеиваются (см. context_packer).
     """
     if not chunks:
         return "Нет доступной информации"
     
     formatted_parts = []
-    for i, chunk in enumerate(chunks, 1):
-        # Получаем метаданные
-        source = chunk.metadata.get('source', 'Unknown')
-        page = chunk.metadata.get('page', 'N/A')
-        
+    for i, block in enumerate(pack_chunks(chunks, config.CONTEXT_MAX_TOKENS), 1):
         # Извлекаем имя файла из пути
-        source_name = source.split('/')[-1] if '/' in source else source
+        source_name = block.source.split('/')[-1] if '/' in block.source else block.source
         
-        # Форматируем чанк
+        # Форматируем фрагмент
         formatted_parts.append(
-            f"[Источник {i}: {source_name}, стр. {page}]\n{chunk.page_content}"
+            f"[Источник {i}: {source_name}, стр. {block.page}]\n{block.text}"
         )
     
     return "\n\n---\n\n".join(formatted_parts)
@@ -245,6 +376,19 @@ def _get_llm():
         logger.info(f"Main LLM initialized: {config.MODEL}")
     return _llm
 
+async def summarize_history(summary: str, messages: list) -> str:
+    """Сворачивание вытесненных из истории сообщений в краткое содержание диалога"""
+    prompt_text = config.load_prompt(config.HISTORY_SUMMARY_PROMPT_FILE)
+    dialog = "\n".join(
+        f"{'Клиент' if message.type == 'human' else 'Ассистент'}: {message.content}" for message in messages
+    )
+    prompt = prompt_text.format(
+        max_words=config.HISTORY_SUMMARY_MAX_WORDS, summary=summary or "(нет)", messages=dialog
+    )
+    result = await _get_llm_query_transform().ainvoke(prompt)
+    # Ограничение на случай, если модель не уложилась в лимит слов
+    return " ".join(result.content.split()[:config.HISTORY_SUMMARY_MAX_WORDS * 2])
+
 def get_retrieval_query_transformation_chain():
     """Цепочка трансформации запроса"""
     _, retrieval_query_transform_prompt = _load_prompts()
@@ -254,75 +398,312 @@ def get_retrieval_query_transformation_chain():
         | StrOutputParser()
     )
 
-def get_rag_chain():
-    """Финальная RAG-цепочка возвращающая answer и documents в LCEL стиле"""
-    if retriever is None:
+def _answer_inputs(x: dict) -> dict:
+    """Входы промпта ответа: контекст из documents и история сообщений"""
+    with metrics.span("context", candidates=len(x["documents"])) as info:
+        context = format_chunks(x["documents"])
+        info["tokens"] = estimate_tokens(context)
+    return {"context": context, "messages": x["messages"]}
+
+def get_answer_chain():
+    """Цепочка генерации ответа: documents + messages → answer"""
+    conversational_answering_prompt, _ = _load_prompts()
+    return (
+        RunnableLambda(_answer_inputs)
+        | conversational_answering_prompt
+        | _get_llm()
+        | StrOutputParser()
+    )
+
+def get_timed_answer_step(chain):
+    """Шаг генерации ответа с замером (спан generation) для RAG цепочки"""
+    def answer(x: dict) -> str:
+        with metrics.span("generation") as info:
+            result = chain.invoke(x)
+            info["tokens"] = estimate_tokens(result)
+        return result
+    
+    async def aanswer(x: dict) -> str:
+        with metrics.span("generation") as info:
+            result = await chain.ainvoke(x)
+            info["tokens"] = estimate_tokens(result)
+        return result
+    
+    return RunnableLambda(answer, afunc=aanswer)
+
+def _should_rewrite(messages: list) -> bool:
+    """Решение политики QUERY_TRANSFORM_MODE: переписывать ли запрос LLM"""
+    if config.QUERY_TRANSFORM_MODE == "always" or query_policy.needs_rewrite(messages):
+        return True
+    query_policy.decisions["skipped"] += 1
+    return False
+
+def _transform_query(transform_chain, x: dict) -> str:
+    with metrics.span("query_transform") as info:
+        rewritten = transform_chain.invoke(x)
+        info["tokens"] = estimate_tokens(rewritten)
+    return rewritten
+
+async def _atransform_query(transform_chain, x: dict) -> str:
+    with metrics.span("query_transform") as info:
+        rewritten = await transform_chain.ainvoke(x)
+        info["tokens"] = estimate_tokens(rewritten)
+    return rewritten
+
+def _search(chain_retriever, query: str) -> list:
+    with metrics.span("retrieval") as info:
+        documents = chain_retriever.invoke(query)
+        info["candidates"] = len(documents)
+    return documents
+
+async def _asearch(chain_retriever, query: str) -> list:
+    with metrics.span("retrieval") as info:
+        documents = await chain_retriever.ainvoke(query)
+        info["candidates"] = len(documents)
+    return documents
+
+async def start_search(chain_retriever, messages: list, transform_chain=None) -> tuple:
+    """
+    Поисковый запрос диалога по политике QUERY_TRANSFORM_MODE и уже запущенный поиск по нему
+    
+    always - запрос всегда переписывается LLM перед поиском;
+    auto - переписываются только уточняющие вопросы (см. query_policy), остальные ищутся как есть;
+    speculative - как auto, но для уточнений поиск по исходному вопросу идет параллельно
+    с переписыванием и используется, если переписывание не успело, упало или не изменило запрос.
+    
+    Поиск возвращается задачей, чтобы до его окончания можно было заглянуть в кеш ответов
+    и отменить поиск при попадании.
+    
+    Returns:
+        tuple: (query, asyncio.Task со списком documents)
+    """
+    raw_query = query_policy.get_last_user_text(messages)
+    if not _should_rewrite(messages):
+        return raw_query, asyncio.create_task(_asearch(chain_retriever, raw_query))
+    
+    transform_chain = transform_chain or get_retrieval_query_transformation_chain()
+    x = {"messages": messages}
+    if config.QUERY_TRANSFORM_MODE != "speculative":
+        rewritten = await _atransform_query(transform_chain, x)
+        query_policy.decisions["rewritten"] += 1
+        return rewritten, asyncio.create_task(_asearch(chain_retriever, rewritten))
+    
+    raw_task = asyncio.create_task(_asearch(chain_retriever, raw_query))
+    try:
+        rewritten = await asyncio.wait_for(_atransform_query(transform_chain, x), config.QUERY_TRANSFORM_TIMEOUT_S)
+    except asyncio.CancelledError:
+        raw_task.cancel()
+        raise
+    except Exception as e:
+        logger.warning(f"Query transformation failed, using raw query results: {e!r}")
+        rewritten = ""
+    if not rewritten.strip() or normalize_query(rewritten) == normalize_query(raw_query):
+        query_policy.decisions["speculative_raw"] += 1
+        return raw_query, raw_task
+    raw_task.cancel()
+    query_policy.decisions["rewritten"] += 1
+    return rewritten, asyncio.create_task(_asearch(chain_retriever, rewritten))
+
+def get_query_retrieval_step(chain_retriever):
+    """
+    Шаг поиска с политикой трансформации запроса (QUERY_TRANSFORM_MODE, см. start_search)
+    
+    В синхронном вызове speculative работает как auto. Если во входе уже есть
+    найденные документы (retrieved, см. rag_answer), поиск не выполняется.
+    """
+    transform_chain = get_retrieval_query_transformation_chain()
+    
+    def retrieve(x: dict) -> list:
+        if "retrieved" in x:
+            return x["retrieved"]
+        if not _should_rewrite(x["messages"]):
+            return _search(chain_retriever, query_policy.get_last_user_text(x["messages"]))
+        query_policy.decisions["rewritten"] += 1
+        return _search(chain_retriever, _transform_query(transform_chain, x))
+    
+    async def aretrieve(x: dict) -> list:
+        if "retrieved" in x:
+            return x["retrieved"]
+        _, search = await start_search(chain_retriever, x["messages"], transform_chain)
+        return await search
+    
+    return RunnableLambda(retrieve, afunc=aretrieve)
+
+def get_retrieval_chain(chain_retriever=None):
+    """Цепочка поиска: messages → messages + documents (с query transformation и reranking по режиму)"""
+    chain_retriever = chain_retriever or retriever
+    if chain_retriever is None:
         raise ValueError("Retriever not initialized")
     
-    conversational_answering_prompt, _ = _load_prompts()
     mode = config.RETRIEVAL_MODE.lower()
     
     # Для hybrid_reranker режима добавляем промежуточный шаг reranking
     if mode == "hybrid_reranker":
-        # LCEL цепочка с reranking: ensemble_docs → rerank → documents → answer
+        # ensemble_docs → rerank → documents
         return (
             RunnablePassthrough.assign(
-                ensemble_docs=get_retrieval_query_transformation_chain() | retriever
-            )
-            # Шаг reranking: переранжируем документы cross-encoder
-            | RunnablePassthrough.assign(
-                documents=lambda x: [doc for doc, score in rerank_documents(
-                    query=x["messages"][-1].content if x["messages"] else "",
-                    documents=x["ensemble_docs"],
-                    top_k=config.RERANKER_TOP_K
-                )]
+                ensemble_docs=get_query_retrieval_step(chain_retriever)
             )
-            # Генерируем ответ на основе переранжированных documents
+            # Шаг reranking: переранжируем документы cross-encoder (в потоке сервиса, с батчингом)
             | RunnablePassthrough.assign(
-                answer=lambda x: (conversational_answering_prompt | _get_llm() | StrOutputParser()).invoke({
-                    "context": format_chunks(x["documents"]),
-                    "messages": x["messages"]
-                })
+                documents=RunnableLambda(_rerank_step, afunc=_arerank_step)
             )
-            # Возвращаем только answer и documents
-            | (lambda x: {"answer": x["answer"], "documents": x["documents"]})
+            | RunnablePick(["messages", "documents"])
         )
     
-    # Для semantic и hybrid режимов - стандартная цепочка без reranking
-    # LCEL цепочка в стиле из референсного ноутбука
-    # Шаг 1: Получаем documents через query transformation
+    # Для semantic и hybrid режимов - documents через query transformation без reranking
+    return RunnablePassthrough.assign(documents=get_query_retrieval_step(chain_retriever))
+
+def get_rag_chain(chain_retriever=None):
+    """
+    Финальная RAG-цепочка возвращающая answer и documents в LCEL стиле
+    
+    Собирается один раз на retriever (см. initialize_retriever), а не на каждое сообщение.
+    """
+    # Шаг 1: Получаем documents (query transformation → retriever → reranking по режиму)
+    # Шаг 2: Генерируем ответ на основе documents
+    # Шаг 3: Возвращаем только answer и documents
     return (
-        RunnablePassthrough.assign(
-            documents=get_retrieval_query_transformation_chain() | retriever
-        )
-        # Шаг 2: Генерируем ответ на основе documents
-        | RunnablePassthrough.assign(
-            answer=lambda x: (conversational_answering_prompt | _get_llm() | StrOutputParser()).invoke({
-                "context": format_chunks(x["documents"]),
-                "messages": x["messages"]
-            })
-        )
-        # Шаг 3: Возвращаем только answer и documents
-        | (lambda x: {"answer": x["answer"], "documents": x["documents"]})
+        get_retrieval_chain(chain_retriever)
+        | RunnablePassthrough.assign(answer=get_timed_answer_step(get_answer_chain()))
+        | RunnablePick(["answer", "documents"])
     )
 
-async def rag_answer(messages):
+async def _search_with_answer_cache(chain_retriever, messages: list) -> tuple:
+    """
+    Поиск по запросу диалога и параллельно - ответ в семантическом кеше
+    
+    Поиск запускается сразу после выбора запроса (в speculative режиме - еще до конца
+    переписывания), embedding запроса для кеша считается параллельно с ним;
+    при попадании в кеш поиск отменяется.
+    
+    Returns:
+        tuple: (query, vector, cached, search) - search равен None при попадании
+    """
+    query, search = await start_search(chain_retriever, messages)
+    try:
+        vector, cached = await _lookup_answer_cache(query)
+    except BaseException:
+        search.cancel()
+        raise
+    if cached is not None:
+        search.cancel()
+        return query, vector, cached, None
+    return query, vector, None, search
+
+async def _lookup_answer_cache(query: str) -> tuple:
+    """Embedding поискового запроса и ответ из семантического кеша (None при промахе)"""
+    with metrics.span("answer_cache") as info:
+        vector = await vector_store.embeddings.aembed_query(query)
+        cached = answer_cache.get(vector)
+        info["hit"] = cached is not None
+    if cached is not None:
+        logger.info(f"Answer cache hit for query: {query[:80]}")
+    return vector, cached
+
+async def rag_answer(messages, chat_id: int = None):
     """
     Получить ответ от RAG с учетом истории диалога
     
+    При включенном ANSWER_CACHE_ENABLED ответ на близкий по смыслу вопрос
+    возвращается из кеша без поиска, reranking и генерации.
+    Время каждого этапа пишется в метрики и одной строкой в лог rag.requests.
+    
     Args:
         messages: список LangChain messages (HumanMessage, AIMessage)
+        chat_id: id чата для строки лога запроса
     
     Returns:
         dict: {"answer": str, "documents": list[Document]}
     """
-    if vector_store is None or retriever is None:
+    # Берем цепочку один раз: /index может подменить ее во время ответа
+    chain, chain_retriever, generation = rag_chain, retriever, index_generation
+    if vector_store is None or chain is None:
+        logger.error("Vector store or retriever not initialized")
+        raise ValueError("Векторное хранилище не инициализировано. Запустите индексацию.")
+    
+    trace = metrics.start_trace(chat_id=chat_id, mode=config.RETRIEVAL_MODE, stream=False)
+    try:
+        if answer_cache is None:
+            return await chain.ainvoke({"messages": messages})
+        
+        query, vector, cached, search = await _search_with_answer_cache(chain_retriever, messages)
+        trace.attrs["cache_hit"] = cached is not None
+        if cached is not None:
+            return cached
+        result = await chain.ainvoke({"messages": messages, "retrieved": await search})
+        answer_cache.set(normalize_query(query), vector, result, version=generation)
+        return result
+    except BaseException:
+        trace.status = "error"
+        raise
+    finally:
+        metrics.finish_trace(trace)
+
+async def rag_answer_stream(messages, chat_id: int = None):
+    """
+    Потоковый ответ RAG: сначала найденные документы, затем фрагменты ответа по мере генерации
+    
+    Args:
+        messages: список LangChain messages (HumanMessage, AIMessage)
+        chat_id: id чата для строки лога запроса
+    
+    Yields:
+        tuple: ("documents", list[Document]) один раз, затем ("token", str) для каждого фрагмента
+    """
+    chains, chain_retriever, generation = (retrieval_chain, answer_chain), retriever, index_generation
+    if vector_store is None or chains[0] is None:
         logger.error("Vector store or retriever not initialized")
         raise ValueError("Векторное хранилище не инициализировано. Запустите индексацию.")
     
-    rag_chain = get_rag_chain()
-    result = await rag_chain.ainvoke({"messages": messages})
-    return result
+    trace = metrics.start_trace(chat_id=chat_id, mode=config.RETRIEVAL_MODE, stream=True)
+    try:
+        inputs = {"messages": messages}
+        if answer_cache is not None:
+            query, vector, cached, search = await _search_with_answer_cache(chain_retriever, messages)
+            trace.attrs["cache_hit"] = cached is not None
+            if cached is not None:
+                # Ответ из кеша целиком - одним фрагментом
+                yield "documents", cached["documents"]
+                yield "token", cached["answer"]
+                return
+            inputs["retrieved"] = await search
+        
+        retrieved = await chains[0].ainvoke(inputs)
+        yield "documents", retrieved["documents"]
+        answer = []
+        # Спан generation - только ожидание фрагментов LLM, без времени потребителя между yield
+        # (правки сообщения в Telegram)
+        stream = chains[1].astream(retrieved).__aiter__()
+        generation_s = 0.0
+        info = {}
+        try:
+            while True:
+                started_at = time.perf_counter()
+                try:
+                    token = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    generation_s += time.perf_counter() - started_at
+                if not answer:
+                    info["first_token_ms"] = round(generation_s * 1000, 1)
+                answer.append(token)
+                yield "token", token
+        finally:
+            metrics.record("generation", generation_s, tokens=estimate_tokens("".join(answer)), **info)
+        if answer_cache is not None:
+            result = {"answer": "".join(answer), "documents": retrieved["documents"]}
+            answer_cache.set(normalize_query(query), vector, result, version=generation)
+    except GeneratorExit:
+        # Потребитель перестал читать ответ
+        trace.status = "aborted"
+        raise
+    except BaseException:
+        trace.status = "error"
+        raise
+    finally:
+        metrics.finish_trace(trace)
 
 def get_vector_store_stats():
     """Возвращает статистику векторного хранилища с полной информацией о конфигурации"""
@@ -334,8 +715,7 @@ def get_vector_store_stats():
     }
     
     if vector_store is not None:
-        doc_count = len(vector_store.store) if hasattr(vector_store, 'store') else 0
-        stats["count"] = doc_count
+        stats["count"] = len(vector_store)
     
     # Добавляем информацию о моделях в зависимости от провайдера
     if config.EMBEDDING_PROVIDER == "openai":
@@ -352,13 +732,31 @@ def get_vector_store_stats():
         stats["bm25_k"] = config.BM25_RETRIEVER_K
         stats["semantic_weight"] = config.ENSEMBLE_SEMANTIC_WEIGHT
         stats["bm25_weight"] = config.ENSEMBLE_BM25_WEIGHT
+        stats["fusion"] = config.HYBRID_FUSION
     elif config.RETRIEVAL_MODE == "hybrid_reranker":
         stats["semantic_k"] = config.SEMANTIC_RETRIEVER_K
         stats["bm25_k"] = config.BM25_RETRIEVER_K
         stats["semantic_weight"] = config.ENSEMBLE_SEMANTIC_WEIGHT
         stats["bm25_weight"] = config.ENSEMBLE_BM25_WEIGHT
+        stats["fusion"] = config.HYBRID_FUSION
         stats["cross_encoder_model"] = config.CROSS_ENCODER_MODEL
+        stats["cross_encoder_backend"] = config.CROSS_ENCODER_BACKEND
         stats["reranker_top_k"] = config.RERANKER_TOP_K
     
+    stats["query_transform_mode"] = config.QUERY_TRANSFORM_MODE
+    stats["query_transform"] = dict(query_policy.decisions)
+    
+    if isinstance(retriever, HybridRetriever):
+        stats["hybrid_timings"] = retriever.get_stats()
+    if reranker_service is not None:
+        stats["reranker"] = reranker_service.get_stats()
+    if rerank_cache is not None and config.RETRIEVAL_MODE == "hybrid_reranker":
+        stats["rerank_cache"] = rerank_cache.get_stats()
+    if answer_cache is not None:
+        stats["answer_cache"] = answer_cache.get_stats()
+    stats["context_max_tokens"] = config.CONTEXT_MAX_TOKENS
+    stats["context_packing"] = context_packer.get_stats()
+    stats["stage_timings"] = metrics.get_stats()
+    
     return stats
 
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+class RerankerService:
+    """
+    Cross-encoder reranking в отдельном потоке с micro-batching
+
+    Запросы (query, passages) от одновременных пользователей складываются в
+    очередь. Поток-воркер забирает первый запрос, ждет еще не дольше
+    batch_window_ms (или пока не наберется max_batch_pairs пар) и прогоняет все
+    пары одним вызовом predict. Вызывающий получает Future со scores, поэтому
+    event loop не блокируется, а модель не вызывается параллельно из разных потоков.
+    """
+
+    def __init__(self, load_model: Callable, batch_window_ms: float, max_batch_pairs: int):
+        self._load_model = load_model
+        self._batch_window = batch_window_ms / 1000
+        self._max_batch_pairs = max_batch_pairs
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "pairs": 0, "wait_s": 0.0, "predict_s": 0.0}
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="reranker", daemon=True)
+                self._thread.start()
+
+    def submit(self, query: str, passages: list) -> Future:
+        """Поставить пары (query, passage) в очередь; Future вернет список scores в порядке passages"""
+        future = Future()
+        if not passages:
+            future.set_result([])
+            return future
+        self._ensure_started()
+        self._queue.put((query, list(passages), future, time.perf_counter()))
+        return future
+
+    async def ascore(self, query: str, passages: list) -> list:
+        """Асинхронная оценка релевантности passages для query"""
+        return await asyncio.wrap_future(self.submit(query, passages))
+
+    def score(self, query: str, passages: list) -> list:
+        """Синхронная оценка (блокирует вызывающий поток до готовности батча)"""
+        return self.submit(query, passages).result()
+
+    def _collect_batch(self) -> list:
+        """Первый запрос из очереди + все, что успело прийти за окно батчинга"""
+        batch = [self._queue.get()]
+        pairs = len(batch[0][1])
+        deadline = time.perf_counter() + self._batch_window
+        while pairs < self._max_batch_pairs:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            pairs += len(item[1])
+        return batch
+
+    def _run(self):
+        while True:
+            # Отмененные запросы (пользователь ушел, таймаут) не считаем
+            batch = [item for item in self._collect_batch() if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started_at = time.perf_counter()
+            pairs = [(query, passage) for query, passages, _, _ in batch for passage in passages]
+            try:
+                model = self._load_model()
+                scores = model.predict(pairs, batch_size=len(pairs))
+            except Exception as e:
+                logger.error(f"Reranking batch failed: {e}", exc_info=True)
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished_at = time.perf_counter()
+
+            offset = 0
+            for _, passages, future, enqueued_at in batch:
+                future.set_result([float(score) for score in scores[offset:offset + len(passages)]])
+                offset += len(passages)
+                self._stats["wait_s"] += started_at - enqueued_at
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["pairs"] += len(pairs)
+            self._stats["predict_s"] += finished_at - started_at
+            logger.info(
+                f"Reranked batch: {len(batch)} requests, {len(pairs)} pairs in {(finished_at - started_at) * 1000:.0f}ms"
+            )
+
+    def get_stats(self) -> dict:
+        """Статистика батчинга: запросы, батчи, средний размер батча, ожидание в очереди и время модели"""
+        stats = dict(self._stats)
+        requests = stats["requests"]
+        batches = stats["batches"]
+        return {
+            "requests": requests,
+            "batches": batches,
+            "avg_batch_pairs": round(stats["pairs"] / batches, 1) if batches else 0.0,
+            "avg_wait_ms": round(stats["wait_s"] / requests * 1000, 1) if requests else 0.0,
+            "avg_predict_ms": round(stats["predict_s"] / batches * 1000, 1) if batches else 0.0,
+        }
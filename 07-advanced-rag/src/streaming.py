@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list:
+    """Разбиение длинного текста на части до limit символов (по возможности по переводу строки)"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+class StreamingMessage:
+    """
+    Сообщение Telegram, которое дописывается по мере генерации ответа
+
+    Первый фрагмент отправляется сразу, дальше сообщение редактируется не чаще
+    одного раза в edit_interval_s (лимиты Telegram на редактирование).
+    При TelegramRetryAfter следующие правки откладываются на указанное время.
+    """
+
+    def __init__(self, message: Message, edit_interval_s: float, cursor: str = " ▌"):
+        self.message = message
+        self.edit_interval_s = edit_interval_s
+        self.cursor = cursor
+        self.sent = None
+        self.edits = 0
+        self.first_token_at = None
+        self._shown_text = ""
+        self._next_edit_at = 0.0
+
+    async def update(self, text: str):
+        """Показать текущий текст ответа (с учетом троттлинга)"""
+        if not text.strip():
+            return
+        now = time.monotonic()
+        if self.sent is None:
+            self.first_token_at = now
+            self.sent = await self.message.answer(self._preview(text))
+            self._shown_text = text
+            self._next_edit_at = now + self.edit_interval_s
+            return
+        if now < self._next_edit_at or text == self._shown_text:
+            return
+        await self._edit(self._preview(text))
+        self._shown_text = text
+
+    async def finish(self, text: str):
+        """Финальный текст: последняя правка без курсора, продолжение длинного ответа - новыми сообщениями"""
+        parts = split_message(text)
+        if self.sent is None:
+            self.sent = await self.message.answer(parts[0])
+        else:
+            # Финальную правку нельзя пропустить - ждем окончания троттлинга
+            delay = self._next_edit_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._edit(parts[0], final=True)
+        for part in parts[1:]:
+            await self.message.answer(part)
+
+    def _preview(self, text: str) -> str:
+        limit = TELEGRAM_MESSAGE_LIMIT - len(self.cursor)
+        return text[:limit] + self.cursor
+
+    async def _edit(self, text: str, final: bool = False):
+        try:
+            await self.sent.edit_text(text)
+            self.edits += 1
+            self._next_edit_at = time.monotonic() + self.edit_interval_s
+        except TelegramRetryAfter as e:
+            logger.warning(f"Telegram edit rate limit, retry after {e.retry_after}s")
+            self._next_edit_at = time.monotonic() + e.retry_after
+            if final:
+                await asyncio.sleep(e.retry_after)
+                await self._edit(text, final=True)
+        except TelegramBadRequest as e:
+            # "message is not modified" и подобные - не критично для промежуточных правок
+            if final and "not modified" not in str(e):
+                raise
+            logger.debug(f"Skipped message edit: {e}")
@@ -0,0 +1,18 @@
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов без токенизатора
+    
+    Для смешанного русского/английского текста BPE-токенизаторы дают
+    в среднем ~3 символа на токен - оценка с запасом для бюджетов.
+    """
+    return len(text) // 3 + 1
+
+def normalize_query(text: str) -> str:
+    """
+    Нормализация вопроса для ключей кешей
+    
+    Нижний регистр, ё -> е, схлопывание пробелов, без концевой пунктуации:
+    "Досрочное погашение?" и "досрочное  погашение" дают один ключ.
+    """
+    text = " ".join(text.lower().replace("ё", "е").split())
+    return text.rstrip("?!.,;: ")
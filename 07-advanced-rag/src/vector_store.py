@@ -0,0 +1,142 @@
+import uuid
+from typing import Callable
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-нормализация строк матрицы (нулевые строки остаются нулевыми)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Индексы k наибольших scores по убыванию (argpartition + сортировка только k элементов)"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+class NumpyVectorStore(VectorStore):
+    """
+    Векторное хранилище на NumPy
+
+    Все embeddings лежат в одной непрерывной float32 матрице, нормализованной
+    один раз при загрузке, поэтому поиск - одно матрично-векторное умножение
+    (косинусная близость) и argpartition для top-k. Матрица может быть
+    memory-mapped (из index_store) - тогда она уже должна быть нормализована.
+
+    Если задан ann_index (см. ann_index.IVFIndex), поиск без фильтра идет
+    приближенно по nprobe ближайшим кластерам вместо полного перебора.
+    """
+
+    def __init__(self, embedding: Embeddings, documents: list | None = None,
+                 vectors: np.ndarray | None = None, normalized: bool = False):
+        self.embedding = embedding
+        self.documents = list(documents or [])
+        if vectors is None or len(self.documents) == 0:
+            self.matrix = np.empty((0, 0), dtype=np.float32)
+        elif normalized:
+            self.matrix = vectors
+        else:
+            self.matrix = np.ascontiguousarray(normalize_rows(vectors))
+        if len(self.documents) != self.matrix.shape[0]:
+            raise ValueError(f"Documents/vectors size mismatch: {len(self.documents)} != {self.matrix.shape[0]}")
+        self._id_to_row = {doc.id: row for row, doc in enumerate(self.documents)}
+        self.ann_index = None
+        self.nprobe = 0
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add_texts(self, texts, metadatas: list | None = None, ids: list | None = None, **kwargs) -> list:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = normalize_rows(self.embedding.embed_documents(texts))
+
+        new_docs = [
+            Document(id=doc_id, page_content=text, metadata=metadata)
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        # Пересоздаем матрицу целиком, чтобы она оставалась непрерывной; ANN индекс устаревает
+        self.ann_index = None
+        self.matrix = vectors if len(self.documents) == 0 else np.vstack([self.matrix, vectors])
+        for doc in new_docs:
+            self._id_to_row[doc.id] = len(self.documents)
+            self.documents.append(doc)
+        return ids
+
+    def delete(self, ids: list | None = None, **kwargs) -> bool | None:
+        if not ids:
+            return False
+        to_delete = {self._id_to_row[doc_id] for doc_id in ids if doc_id in self._id_to_row}
+        keep = [row for row in range(len(self.documents)) if row not in to_delete]
+        self.documents = [self.documents[row] for row in keep]
+        self.matrix = np.ascontiguousarray(self.matrix[keep]) if keep else np.empty((0, 0), dtype=np.float32)
+        self._id_to_row = {doc.id: row for row, doc in enumerate(self.documents)}
+        self.ann_index = None
+        return True
+
+    def get_by_ids(self, ids) -> list:
+        return [self.documents[self._id_to_row[doc_id]] for doc_id in ids if doc_id in self._id_to_row]
+
+    @staticmethod
+    def _normalize_query(embedding: list) -> np.ndarray:
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
+
+    def similarity_search_with_score_by_vector(self, embedding: list, k: int = 4,
+                                               filter: Callable | None = None, **kwargs) -> list:
+        """Top-k (Document, cosine similarity) для вектора запроса"""
+        if len(self.documents) == 0:
+            return []
+        query = self._normalize_query(embedding)
+        if filter is None and self.ann_index is not None:
+            rows, ann_scores = self.ann_index.search(self.matrix, query, k, self.nprobe)
+            return [(self.documents[row], float(score)) for row, score in zip(rows, ann_scores)]
+        scores = self.matrix @ query
+        if filter is None:
+            rows = top_k_indices(scores, k)
+        else:
+            # С фильтром сортируем всех кандидатов и берем первые k прошедших фильтр
+            rows = [row for row in np.argsort(-scores, kind="stable") if filter(self.documents[row])][:k]
+        return [(self.documents[row], float(scores[row])) for row in rows]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list:
+        embedding = await self.embedding.aembed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: list, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        # Косинусная близость уже в [-1, 1], приводим к [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(cls, texts, embedding: Embeddings, metadatas: list | None = None,
+                   ids: list | None = None, **kwargs) -> "NumpyVectorStore":
+        store = cls(embedding=embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import time
+from config import config
+import rag
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TEXT = "Прогрев модели"
+
+# Состояние прогрева: имя модели -> pending / loading / ready / failed
+models_status: dict[str, str] = {}
+ready = False
+_task = None
+
+def _get_base_embeddings(embeddings):
+    """Исходная модель embeddings без дискового кеша (иначе прогрев попадет в кеш, а не в модель)"""
+    return getattr(embeddings, "embeddings", embeddings)
+
+async def _warm_up_embeddings():
+    embeddings = _get_base_embeddings(rag.vector_store.embeddings)
+    await asyncio.to_thread(embeddings.embed_query, WARMUP_TEXT)
+
+async def _warm_up_cross_encoder():
+    # Модель загружается и выполняет инференс в потоке сервиса reranking
+    await rag.get_reranker_service().ascore(WARMUP_TEXT, [WARMUP_TEXT])
+
+def get_warmup_targets() -> dict:
+    """Модели, которые нужно прогреть при текущей конфигурации"""
+    targets = {}
+    # OpenAI embeddings - внешний API, прогревать нечего
+    if config.EMBEDDING_PROVIDER == "huggingface" and rag.vector_store is not None:
+        targets["embeddings"] = _warm_up_embeddings
+    if config.RETRIEVAL_MODE == "hybrid_reranker":
+        targets["cross_encoder"] = _warm_up_cross_encoder
+    return targets
+
+async def _run_target(name: str, warm_up):
+    models_status[name] = "loading"
+    started_at = time.perf_counter()
+    try:
+        await warm_up()
+        models_status[name] = "ready"
+        logger.info(f"✓ Warm-up {name} finished in {time.perf_counter() - started_at:.1f}s")
+    except Exception as e:
+        models_status[name] = "failed"
+        logger.error(f"Warm-up {name} failed: {e}", exc_info=True)
+
+async def warm_up_models():
+    """Загрузка и тестовый инференс всех используемых моделей (параллельно)"""
+    global ready
+    targets = get_warmup_targets()
+    for name in targets:
+        models_status[name] = "pending"
+    await asyncio.gather(*(_run_target(name, warm_up) for name, warm_up in targets.items()))
+    ready = all(status == "ready" for status in models_status.values())
+    logger.info(f"Models warm-up completed: {models_status or 'nothing to warm up'}")
+
+def start_warmup() -> asyncio.Task:
+    """Запуск прогрева в фоне (бот начинает принимать сообщения сразу)"""
+    global _task
+    _task = asyncio.create_task(warm_up_models())
+    return _task
+
+def get_status() -> dict:
+    """Готовность моделей для /index_status"""
+    return {"ready": ready, "models": dict(models_status)}